@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Carga offline contra main.app, sem OpenAI, Evolution ou Redis de verdade.
+
+- ChatOpenAI e OpenAIEmbeddings são trocados por modelos falsos com latência configurável
+- a Evolution é um servidor HTTP local (/message/sendText) rodando em outra thread
+- o Redis é o fakeredis (de requirements-dev.txt) ou um Redis local via --redis-url
+
+Para cada nível de concorrência (chats simultâneos) mede vazão, latência ponta a ponta
+(última mensagem do lote → resposta recebida pela Evolution), p50/p95/p99 de cada etapa
+do pipeline (histograma pipeline_stage_seconds) e o atraso do event loop.
+
+Exemplos:
+    python benchmark.py --chats 1,100,1000
+    python benchmark.py --payloads gravados.jsonl --llm-latency 2.5 --json resultado.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from functools import partial
+
+BENCH_INSTANCE = 'benchmark'
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot', 'prompts')
+EMBEDDING_SIZE = 64
+LAG_INTERVAL = 0.05
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def setup_environment(args, workdir, evolution_port):
+    """Variáveis lidas por config.py/main.py; precisam existir antes de qualquer import do bot."""
+    docs_dir = os.path.join(workdir, 'docs')
+    os.makedirs(docs_dir, exist_ok=True)
+    for i in range(args.docs):
+        with open(os.path.join(docs_dir, f'doc_{i}.txt'), 'w', encoding='utf-8') as f:
+            f.write(f'Documento sintético {i}. ' + 'Informação sobre cursos, preços e horários da escola. ' * 40)
+
+    os.environ.update({
+        'OPENAI_API_KEY': 'benchmark',
+        'EVOLUTION_INSTANCE_NAME': BENCH_INSTANCE,
+        'AUTHENTICATION_API_KEY': 'benchmark',
+        'EVOLUTION_API_URL': f'http://127.0.0.1:{evolution_port}',
+        'VECTOR_STORE_PATH': os.path.join(workdir, 'vectorstore'),
+        'RAG_FILES_DIR': docs_dir,
+        'AI_CONTEXTUALIZE_PROMPT_FILE': os.path.join(PROMPTS_DIR, 'contextualize.txt'),
+        'AI_SYSTEM_PROMPT_FILE': os.path.join(PROMPTS_DIR, 'system.txt'),
+        'DEBOUNCE_SECONDS': str(args.debounce),
+        'DEBOUNCE_MIN_SECONDS': str(min(args.debounce, float(os.getenv('DEBOUNCE_MIN_SECONDS', '1.5')))),
+        'DEBOUNCE_MAX_WAIT_SECONDS': str(args.debounce * 2),
+        'DEBOUNCE_POLL_INTERVAL': os.getenv('DEBOUNCE_POLL_INTERVAL', '0.05'),
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+        'INGEST_ON_STARTUP': 'off',
+    })
+    if args.redis_url:
+        os.environ['CACHE_REDIS_URI'] = args.redis_url
+
+
+def install_fakes(args):
+    """Troca os clientes externos pelos falsos antes de main.py construir o chain."""
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    class FakeChatModel(BaseChatModel):
+        """Responde com um eco da última mensagem após 'latency' segundos."""
+
+        model: str = 'fake'
+        temperature: object = None
+        streaming: bool = False
+        latency: float = 0.0
+
+        @property
+        def _llm_type(self):
+            return 'benchmark-fake'
+
+        def _result(self, messages):
+            text = str(messages[-1].content) if messages else ''
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f'Resposta simulada: {text[:80]}'))])
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(self.latency)
+            return self._result(messages)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            await asyncio.sleep(self.latency)
+            return self._result(messages)
+
+    class FakeEmbeddings(Embeddings):
+        """Vetores determinísticos a partir do hash do texto, com latência por chamada."""
+
+        def __init__(self, latency=0.0, **kwargs):
+            self.latency = latency
+
+        @staticmethod
+        def _vector(text):
+            digest = hashlib.sha256(text.encode('utf-8')).digest() * (EMBEDDING_SIZE // 32)
+            return [byte / 255 for byte in digest[:EMBEDDING_SIZE]]
+
+        def embed_documents(self, texts):
+            time.sleep(self.latency)
+            return [self._vector(text) for text in texts]
+
+        def embed_query(self, text):
+            time.sleep(self.latency)
+            return self._vector(text)
+
+        async def aembed_documents(self, texts):
+            await asyncio.sleep(self.latency)
+            return [self._vector(text) for text in texts]
+
+        async def aembed_query(self, text):
+            await asyncio.sleep(self.latency)
+            return self._vector(text)
+
+    import config
+    import redis_pool
+
+    # O agent com tools depende do Google Calendar; o benchmark cobre o chain RAG
+    config.ENABLE_GOOGLE_CALENDAR = False
+
+    if not args.redis_url:
+        try:
+            import fakeredis
+            import fakeredis.aioredis
+            import lupa  # Os scripts Lua do debounce precisam do extra [lua]
+        except ImportError as e:
+            raise SystemExit(
+                f'fakeredis[lua] não está instalado ({e}). Rode `pip install -r requirements-dev.txt` '
+                'ou use um Redis local com --redis-url redis://localhost:6379/15'
+            )
+
+        server = fakeredis.FakeServer()
+        redis_pool.get_redis = lambda: fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+        redis_pool.get_sync_redis = lambda: fakeredis.FakeRedis(server=server, decode_responses=True)
+
+    import chains
+    import vectorstore
+
+    chains.ChatOpenAI = partial(FakeChatModel, latency=args.llm_latency)
+    vectorstore.OpenAIEmbeddings = partial(FakeEmbeddings, latency=args.embedding_latency)
+
+
+class FakeEvolution:
+    """Servidor /message/sendText em uma thread própria; registra quando cada resposta chega."""
+
+    def __init__(self, port, latency):
+        self.port = port
+        self.latency = latency
+        self.replies = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _app(self):
+        from fastapi import FastAPI, Request
+
+        app = FastAPI()
+
+        @app.post('/message/sendText/{instance}')
+        async def send_text(instance: str, request: Request):
+            body = await request.json()
+            await asyncio.sleep(self.latency)
+            number = body['number'].replace('@s.whatsapp.net', '')
+            with self._lock:
+                self.replies.setdefault(number, []).append(time.perf_counter())
+            return {'key': {'id': 'fake'}, 'status': 'PENDING'}
+
+        return app
+
+    def start(self):
+        import uvicorn
+
+        self._server = uvicorn.Server(uvicorn.Config(self._app(), host='127.0.0.1', port=self.port, log_level='warning'))
+        self._thread = threading.Thread(target=self._server.run, name='fake-evolution', daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+    def reset(self):
+        with self._lock:
+            self.replies.clear()
+
+    def first_reply(self, number):
+        with self._lock:
+            times = self.replies.get(number)
+            return times[0] if times else None
+
+
+def synthetic_payload(chat_number, text):
+    return {
+        'event': 'messages.upsert',
+        'instance': BENCH_INSTANCE,
+        'data': {
+            'key': {'remoteJid': f'{chat_number}@s.whatsapp.net', 'fromMe': False, 'id': os.urandom(8).hex()},
+            'message': {'conversation': text},
+        },
+    }
+
+
+def load_payloads(path):
+    """Payloads gravados (um JSON de webhook por linha)."""
+    payloads = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                payloads.append(json.loads(line))
+    return payloads
+
+
+def build_bursts(args, chats, recorded):
+    """Um lote de mensagens por chat; payloads gravados são redistribuídos entre os números sintéticos."""
+    bursts = {}
+    for i in range(chats):
+        number = f'5511{i:09d}'
+        messages = []
+        for j in range(args.burst):
+            if recorded:
+                payload = json.loads(json.dumps(recorded[(i * args.burst + j) % len(recorded)]))
+                payload.setdefault('data', {}).setdefault('key', {})['remoteJid'] = f'{number}@s.whatsapp.net'
+                payload['data']['key']['id'] = os.urandom(8).hex()
+            else:
+                payload = synthetic_payload(number, f'Mensagem {j + 1} do chat {i}: quais cursos vocês oferecem?')
+            messages.append(payload)
+        bursts[number] = messages
+    return bursts
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def histogram_quantile(buckets, counts, total, q):
+    """Quantil estimado por interpolação linear nos buckets cumulativos (como no Prometheus)."""
+    if not total:
+        return None
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0
+    for bound, count in zip(buckets, counts):
+        if count >= rank:
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return buckets[-1]
+
+
+def stage_snapshot():
+    """Contagens cumulativas por etapa (somando os demais labels) do histograma do pipeline."""
+    from metrics import STAGE_LATENCY
+
+    snapshot = {}
+    for key, counts in list(STAGE_LATENCY._counts.items()):
+        stage = dict(key)['stage']
+        current = snapshot.setdefault(stage, [[0] * len(STAGE_LATENCY.buckets), 0])
+        current[0] = [a + b for a, b in zip(current[0], counts)]
+        current[1] += STAGE_LATENCY._totals[key]
+    return snapshot
+
+
+def stage_report(before, after):
+    from metrics import STAGE_LATENCY
+
+    report = {}
+    for stage, (counts, total) in sorted(after.items()):
+        base_counts, base_total = before.get(stage, [[0] * len(counts), 0])
+        delta = [a - b for a, b in zip(counts, base_counts)]
+        n = total - base_total
+        if n:
+            report[stage] = {
+                'count': n,
+                **{f'p{int(q * 100)}': histogram_quantile(STAGE_LATENCY.buckets, delta, n, q) for q in (0.5, 0.95, 0.99)},
+            }
+    return report
+
+
+async def measure_loop_lag(samples, stop):
+    while not stop.is_set():
+        expected = time.perf_counter() + LAG_INTERVAL
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run_scenario(args, client, evolution, chats, recorded):
+    from executor import REJECTED
+
+    evolution.reset()
+    bursts = build_bursts(args, chats, recorded)
+    last_sent = {}
+    ack_latencies = []
+    errors = 0
+    rejected_before = REJECTED.value(tenant=BENCH_INSTANCE)
+    stages_before = stage_snapshot()
+
+    lag_samples, stop_lag = [], asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples, stop_lag))
+
+    async def send_burst(number, payloads):
+        nonlocal errors
+        # Espalha o início dos chats para não chegarem todos no mesmo instante
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        for payload in payloads:
+            started_at = time.perf_counter()
+            response = await client.post('/webhook', json=payload)
+            ack_latencies.append(time.perf_counter() - started_at)
+            if response.status_code != 200 or response.json().get('status') != 'ok':
+                errors += 1
+            last_sent[number] = time.perf_counter()
+            await asyncio.sleep(args.gap)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(send_burst(number, payloads) for number, payloads in bursts.items()))
+
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        if all(evolution.first_reply(number) for number in bursts):
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started_at
+    stop_lag.set()
+    await lag_task
+
+    e2e = []
+    for number in bursts:
+        replied_at = evolution.first_reply(number)
+        if replied_at is not None:
+            e2e.append(replied_at - last_sent[number])
+
+    def summary(samples):
+        return {f'p{q}': percentile(samples, q / 100) for q in (50, 95, 99)} | {'max': max(samples) if samples else None}
+
+    return {
+        'chats': chats,
+        'messages': sum(len(p) for p in bursts.values()),
+        'completed': len(e2e),
+        'webhook_errors': errors,
+        'rejected': REJECTED.value(tenant=BENCH_INSTANCE) - rejected_before,
+        'elapsed_seconds': elapsed,
+        'throughput_turns_per_second': len(e2e) / elapsed if elapsed else 0.0,
+        'end_to_end_seconds': summary(e2e),
+        'webhook_ack_seconds': summary(ack_latencies),
+        'loop_lag_seconds': summary(lag_samples),
+        'stages_seconds': stage_report(stages_before, stage_snapshot()),
+    }
+
+
+def _fmt(value):
+    return '-' if value is None else f'{value * 1000:.1f}ms' if value < 1 else f'{value:.2f}s'
+
+
+def print_result(result):
+    print(f"\n=== {result['chats']} chats / {result['messages']} mensagens ===")
+    print(
+        f"concluídos: {result['completed']}/{result['chats']}  "
+        f"erros no webhook: {result['webhook_errors']}  recusados: {result['rejected']:.0f}  "
+        f"vazão: {result['throughput_turns_per_second']:.2f} turnos/s em {result['elapsed_seconds']:.1f}s"
+    )
+    for label, key in (('ponta a ponta', 'end_to_end_seconds'), ('ack do webhook', 'webhook_ack_seconds'), ('atraso do loop', 'loop_lag_seconds')):
+        values = result[key]
+        print(f"  {label:<16} p50={_fmt(values['p50'])} p95={_fmt(values['p95'])} p99={_fmt(values['p99'])} max={_fmt(values['max'])}")
+    for stage, values in result['stages_seconds'].items():
+        print(f"  {stage:<16} n={values['count']:<6} p50={_fmt(values['p50'])} p95={_fmt(values['p95'])} p99={_fmt(values['p99'])}")
+
+
+async def run(args):
+    import httpx
+    import main
+    from ingest import ingest_directory
+    from vectorstore import open_vectorstore
+
+    recorded = load_payloads(args.payloads) if args.payloads else None
+    evolution = FakeEvolution(args.evolution_port, args.send_latency)
+    evolution.start()
+    # Ingere os documentos sintéticos antes de medir, como um deploy já com a base pronta
+    await asyncio.to_thread(ingest_directory, open_vectorstore())
+    await main.startup()
+    await main.pipeline.ready.wait()
+    results = []
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            for chats in args.chats:
+                result = await run_scenario(args, client, evolution, chats, recorded)
+                print_result(result)
+                results.append(result)
+    finally:
+        await main.shutdown()
+        evolution.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline do pipeline de mensagens.')
+    parser.add_argument('--chats', default='1,100,1000', help='Níveis de concorrência (chats simultâneos), separados por vírgula')
+    parser.add_argument('--burst', type=int, default=2, help='Mensagens por chat em cada lote')
+    parser.add_argument('--gap', type=float, default=0.2, help='Intervalo (segundos) entre mensagens do mesmo lote')
+    parser.add_argument('--ramp', type=float, default=1.0, help='Janela (segundos) em que os chats começam')
+    parser.add_argument('--debounce', type=float, default=1.0, help='DEBOUNCE_SECONDS usado no benchmark')
+    parser.add_argument('--llm-latency', type=float, default=1.0, help='Latência simulada de cada chamada ao LLM')
+    parser.add_argument('--embedding-latency', type=float, default=0.1, help='Latência simulada de cada chamada de embedding')
+    parser.add_argument('--send-latency', type=float, default=0.05, help='Latência simulada da Evolution')
+    parser.add_argument('--docs', type=int, default=5, help='Documentos sintéticos ingeridos na base')
+    parser.add_argument('--payloads', help='Arquivo JSONL com payloads de webhook gravados')
+    parser.add_argument('--redis-url', help='Redis de verdade (padrão: fakeredis em memória)')
+    parser.add_argument('--timeout', type=float, default=120, help='Espera máxima pelas respostas de cada cenário')
+    parser.add_argument('--json', help='Grava os resultados neste arquivo')
+    args = parser.parse_args()
+    args.chats = [int(value) for value in args.chats.split(',') if value.strip()]
+    args.evolution_port = _free_port()
+
+    with tempfile.TemporaryDirectory(prefix='whats-ai-bench-') as workdir:
+        setup_environment(args, workdir, args.evolution_port)
+        install_fakes(args)
+        results = asyncio.run(run(args))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta, timezone
+
+from googleapiclient.errors import HttpError
+
+from config import CALENDAR_SYNC_INTERVAL, CALENDAR_SYNC_PAST_DAYS, CALENDAR_SYNC_FUTURE_DAYS
+
+# Campos usados na busca por palavra-chave (os mesmos que o parâmetro q da API considera)
+SEARCH_FIELDS = ('summary', 'description', 'location')
+# O índice deixa de ser usado se ficar esse número de intervalos sem sincronizar
+STALE_AFTER_SYNCS = 3
+
+
+def _fold(text):
+    text = unicodedata.normalize('NFD', text or '')
+    return ''.join(c for c in text if unicodedata.category(c) != 'Mn').casefold()
+
+
+def rfc3339(value):
+    return value.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def event_time(value):
+    """Converte start/end do evento ({'dateTime'} ou {'date'} de dia inteiro) em datetime UTC."""
+    if not value:
+        return None
+    if 'dateTime' in value:
+        return datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')).astimezone(timezone.utc)
+    if 'date' in value:
+        return datetime.fromisoformat(value['date']).replace(tzinfo=timezone.utc)
+    return None
+
+
+class CalendarEventIndex:
+    """
+    Índice local dos eventos do calendário, sincronizado de forma incremental com syncToken.
+    - a sincronização roda em segundo plano (thread do CalendarServiceManager), a cada 'interval'
+      segundos; listagens e buscas só leem a memória, sem chamar a API no caminho da resposta
+    - a sincronização completa cobre só a janela de agendamento (past_days para trás,
+      future_days para frente) e é refeita quando metade da janela futura já passou
+    - consultas fora da janela, ou com o índice ainda vazio ou desatualizado, recebem None
+      e quem chamou consulta a API diretamente
+    """
+
+    def __init__(
+        self,
+        service_factory,
+        calendar_id='primary',
+        interval=CALENDAR_SYNC_INTERVAL,
+        past_days=CALENDAR_SYNC_PAST_DAYS,
+        future_days=CALENDAR_SYNC_FUTURE_DAYS,
+    ):
+        self.service_factory = service_factory
+        self.calendar_id = calendar_id
+        self.interval = interval
+        self.past = timedelta(days=past_days)
+        self.future = timedelta(days=future_days)
+        self._events = {}
+        self._sync_token = None
+        self._window = None
+        self._last_sync = None
+        self._lock = threading.Lock()
+        # Só uma sincronização por vez; o lock do índice fica livre durante as chamadas à API
+        self._sync_lock = threading.Lock()
+
+    def _fetch(self, service, sync_token, window=None):
+        """Percorre as páginas da listagem; devolve (eventos alterados, próximo syncToken)."""
+        changes = []
+        page_token = None
+        while True:
+            params = {
+                'calendarId': self.calendar_id,
+                'singleEvents': True,
+                'maxResults': 2500,
+            }
+            if sync_token:
+                params['syncToken'] = sync_token
+            else:
+                # timeMin/timeMax só na sincronização completa (a API os recusa junto com syncToken)
+                params['timeMin'], params['timeMax'] = (rfc3339(value) for value in window)
+            if page_token:
+                params['pageToken'] = page_token
+            response = service.events().list(**params).execute()
+            changes.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return changes, response.get('nextSyncToken')
+
+    def _full_sync(self, service):
+        now = datetime.now(timezone.utc)
+        window = (now - self.past, now + self.future)
+        changes, sync_token = self._fetch(service, None, window)
+        events = {event['id']: event for event in changes if event.get('status') != 'cancelled'}
+        with self._lock:
+            self._events, self._sync_token, self._window = events, sync_token, window
+
+    def _incremental_sync(self, service):
+        changes, sync_token = self._fetch(service, self._sync_token)
+        with self._lock:
+            for event in changes:
+                if event.get('status') == 'cancelled':
+                    self._events.pop(event['id'], None)
+                else:
+                    self._events[event['id']] = event
+            self._sync_token = sync_token
+
+    def _needs_full_sync(self):
+        if self._sync_token is None or self._window is None:
+            return True
+        return datetime.now(timezone.utc) + self.future / 2 > self._window[1]
+
+    def sync(self):
+        """Busca as alterações desde a última sincronização (ou a janela inteira, quando preciso)."""
+        with self._sync_lock:
+            service = self.service_factory()
+            if self._needs_full_sync():
+                self._full_sync(service)
+            else:
+                try:
+                    self._incremental_sync(service)
+                except HttpError as error:
+                    # 410 Gone: o token expirou, é preciso refazer a sincronização completa
+                    if error.resp.status != 410:
+                        raise
+                    self._full_sync(service)
+            self._last_sync = time.monotonic()
+
+    def is_fresh(self):
+        return self._last_sync is not None and time.monotonic() - self._last_sync <= self.interval * STALE_AFTER_SYNCS
+
+    def covers(self, time_min, time_max=None):
+        """O índice está atualizado e a janela sincronizada contém o intervalo pedido."""
+        window = self._window
+        if window is None or not self.is_fresh():
+            return False
+        return time_min >= window[0] and (time_max is None or time_max <= window[1])
+
+    def upsert(self, event):
+        with self._lock:
+            self._events[event['id']] = event
+
+    def remove(self, event_id):
+        with self._lock:
+            self._events.pop(event_id, None)
+
+    def _sorted(self, events, max_results):
+        events.sort(key=lambda event: event_time(event.get('start')) or datetime.min.replace(tzinfo=timezone.utc))
+        return events[:max_results]
+
+    def _between(self, time_min, time_max):
+        with self._lock:
+            return [
+                event for event in self._events.values()
+                if (event_time(event.get('end')) or event_time(event.get('start'))) > time_min
+                and (time_max is None or event_time(event.get('start')) < time_max)
+            ]
+
+    def list_events(self, time_min, time_max=None, max_results=10):
+        """
+        Eventos que terminam depois de time_min e começam antes de time_max (como a API),
+        ou None se o índice não puder responder por esse intervalo.
+        """
+        if not self.covers(time_min, time_max):
+            return None
+        return self._sorted(self._between(time_min, time_max), max_results)
+
+    def search_events(self, query, time_min, max_results=10):
+        """
+        Eventos a partir de time_min (até o fim da janela sincronizada) que contêm todas
+        as palavras da busca, ou None se o índice não puder responder.
+        """
+        if not self.covers(time_min):
+            return None
+        terms = _fold(query).split()
+        matches = []
+        for event in self._between(time_min, None):
+            text = ' '.join(_fold(event.get(field)) for field in SEARCH_FIELDS)
+            if all(term in text for term in terms):
+                matches.append(event)
+        return self._sorted(matches, max_results)
@@ -1,6 +1,9 @@
+import logging
 import os
 import pickle
-from datetime import datetime, timedelta
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -9,37 +12,222 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from langchain_core.tools import tool
 
+from calendar_index import CalendarEventIndex, rfc3339
+from config import CALENDAR_INDEX_ENABLED
+
+logger = logging.getLogger(__name__)
+
 # Se modificar esses escopos, delete o arquivo token.pickle
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+TOKEN_PATH = 'token.pickle'
+CREDENTIALS_PATH = 'credentials.json'
+# Renova o token quando faltar menos que isso para expirar
+REFRESH_MARGIN_SECONDS = 300
+# Espera após uma renovação com erro e máximo que a thread de fundo dorme sem nada agendado
+TOKEN_RETRY_SECONDS = 60
+IDLE_SECONDS = 60
+
+
+class CalendarAuthorizationRequired(Exception):
+    """Não há token válido e o login interativo (navegador) não é permitido nesse caminho."""
+
+
+class CalendarServiceManager:
+    """
+    Mantém as credenciais e o cliente do Google Calendar em memória para todo o processo.
+    - as credenciais são carregadas uma vez e renovadas em segundo plano antes de expirar
+    - o token é salvo com escrita atômica (arquivo temporário + os.replace)
+    - um cliente por thread, construído uma única vez (httplib2 não é thread-safe)
+    - a mesma thread de fundo mantém o índice de eventos sincronizado
+    """
+
+    def __init__(self, token_path=TOKEN_PATH, credentials_path=CREDENTIALS_PATH):
+        self.token_path = token_path
+        self.credentials_path = credentials_path
+        self._creds = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._refresher = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._index = None
+        self._auth_warned = False
+
+    def _save_credentials(self, creds):
+        tmp_path = f'{self.token_path}.tmp'
+        with open(tmp_path, 'wb') as token:
+            pickle.dump(creds, token)
+        os.replace(tmp_path, self.token_path)
+
+    def _load_credentials(self, interactive=True):
+        creds = None
+
+        # O arquivo token.pickle armazena os tokens de acesso e refresh do usuário
+        if os.path.exists(self.token_path):
+            with open(self.token_path, 'rb') as token:
+                creds = pickle.load(token)
+
+        # Se não há credenciais válidas disponíveis, fazer login do usuário
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                if not interactive:
+                    raise CalendarAuthorizationRequired(
+                        f"Sem token válido em '{self.token_path}'. "
+                        "Execute uma ferramenta do calendário em um terminal com navegador para autorizar o acesso."
+                    )
+                if not os.path.exists(self.credentials_path):
+                    raise FileNotFoundError(
+                        "Arquivo 'credentials.json' não encontrado. "
+                        "Faça o download das credenciais OAuth 2.0 do Google Cloud Console."
+                    )
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    self.credentials_path, SCOPES)
+                creds = flow.run_local_server(port=0)
+
+            # Salva as credenciais para a próxima execução
+            self._save_credentials(creds)
+
+        return creds
+
+    def credentials(self, interactive=True):
+        """
+        Credenciais do processo. Com interactive=False (thread de fundo) nunca abre o login
+        no navegador: sem token válido levanta CalendarAuthorizationRequired.
+        """
+        with self._lock:
+            loaded = self._creds is None
+            if loaded:
+                self._creds = self._load_credentials(interactive)
+        if loaded:
+            self.start()
+        return self._creds
+
+    def start(self, index=None):
+        """
+        Inicia (uma vez) a thread de fundo: renova o token antes de expirar e, se houver
+        índice, sincroniza-o a cada index.interval segundos, começando imediatamente.
+        """
+        with self._start_lock:
+            if index is not None:
+                self._index = index
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._background_loop, name='calendar-background', daemon=True)
+                self._refresher.start()
+        self._wakeup.set()
+
+    def _token_wait(self):
+        """Segundos até a renovação do token (None se não houver token renovável)."""
+        creds = self._creds
+        if creds is None or not creds.refresh_token or creds.expiry is None:
+            return None
+        return (creds.expiry - datetime.utcnow()).total_seconds() - REFRESH_MARGIN_SECONDS
+
+    def _refresh_token(self):
+        try:
+            with self._lock:
+                self._creds.refresh(Request())
+            self._save_credentials(self._creds)
+        except Exception as e:
+            logger.warning('[CALENDAR] Erro ao renovar token: %s', e)
+
+    def _sync_index(self, index):
+        try:
+            index.sync()
+            self._auth_warned = False
+        except CalendarAuthorizationRequired as e:
+            # Avisa uma vez; as ferramentas consultam a API até alguém autorizar o acesso
+            if not self._auth_warned:
+                logger.warning('[CALENDAR] Índice de eventos parado: %s', e)
+                self._auth_warned = True
+        except Exception as e:
+            logger.warning('[CALENDAR] Erro ao sincronizar o índice de eventos: %s', e)
+
+    def _background_loop(self):
+        next_sync = 0.0
+        token_retry_at = 0.0
+        while True:
+            self._wakeup.clear()
+            index = self._index
+            if index is not None and time.monotonic() >= next_sync:
+                self._sync_index(index)
+                next_sync = time.monotonic() + index.interval
+            token_wait = self._token_wait()
+            if token_wait is not None and token_wait <= 0 and time.monotonic() >= token_retry_at:
+                self._refresh_token()
+                token_retry_at = time.monotonic() + TOKEN_RETRY_SECONDS
+                continue
+            waits = [IDLE_SECONDS]
+            if token_wait is not None:
+                waits.append(max(token_wait, token_retry_at - time.monotonic()))
+            if index is not None:
+                waits.append(next_sync - time.monotonic())
+            self._wakeup.wait(max(min(waits), 0))
+
+    def service(self, interactive=True):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = build('calendar', 'v3', credentials=self.credentials(interactive), cache_discovery=False)
+            self._local.service = service
+        return service
+
+
+calendar_manager = CalendarServiceManager()
+
 
 def get_calendar_service():
     """Obtém o serviço do Google Calendar autenticado."""
-    creds = None
-    
-    # O arquivo token.pickle armazena os tokens de acesso e refresh do usuário
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    
-    # Se não há credenciais válidas disponíveis, fazer login do usuário
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            if not os.path.exists('credentials.json'):
-                raise FileNotFoundError(
-                    "Arquivo 'credentials.json' não encontrado. "
-                    "Faça o download das credenciais OAuth 2.0 do Google Cloud Console."
-                )
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
+    return calendar_manager.service()
+
+
+# Índice local de eventos (listagem e busca sem ir à API a cada passo do agente); a sincronização
+# roda na thread de fundo, onde o login interativo travaria o processo sem terminal
+calendar_index = CalendarEventIndex(lambda: calendar_manager.service(interactive=False)) if CALENDAR_INDEX_ENABLED else None
+
+
+def start_calendar_sync():
+    """Começa a sincronizar o índice em segundo plano (chamado ao montar o agent com as tools)."""
+    if calendar_index:
+        calendar_manager.start(calendar_index)
+
+
+def _list_from_api(time_min, time_max=None, max_results=10, query=None):
+    """Consulta direta à API, para quando o índice não cobre o intervalo pedido."""
+    params = {
+        'calendarId': 'primary',
+        'timeMin': rfc3339(time_min),
+        'maxResults': max_results,
+        'singleEvents': True,
+        'orderBy': 'startTime',
+    }
+    if time_max is not None:
+        params['timeMax'] = rfc3339(time_max)
+    if query:
+        params['q'] = query
+    return get_calendar_service().events().list(**params).execute().get('items', [])
+
+
+def format_events(header, events):
+    result = [header]
+    for event in events:
+        start = event['start'].get('dateTime', event['start'].get('date'))
+        summary = event.get('summary', 'Sem título')
         
-        # Salva as credenciais para a próxima execução
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+        # Formata a data/hora
+        try:
+            if 'T' in start:
+                dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
+                formatted_date = dt.strftime('%d/%m/%Y às %H:%M')
+            else:
+                dt = datetime.fromisoformat(start)
+                formatted_date = dt.strftime('%d/%m/%Y (dia inteiro)')
+        except:
+            formatted_date = start
+        
+        result.append(f'- {summary} - {formatted_date}')
     
-    return build('calendar', 'v3', credentials=creds)
+    return '\n'.join(result)
 
 
 @tool
@@ -58,45 +246,17 @@ def list_calendar_events(
         String formatada com a lista de eventos ou mensagem se não houver eventos
     """
     try:
-        service = get_calendar_service()
-        
-        # Busca eventos a partir de agora
-        now = datetime.utcnow().isoformat() + 'Z'
-        time_max = (datetime.utcnow() + timedelta(days=days_ahead)).isoformat() + 'Z'
-        
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=now,
-            timeMax=time_max,
-            maxResults=max_results,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        
-        events = events_result.get('items', [])
+        # Busca eventos a partir de agora (no índice local, se ele cobrir o período)
+        now = datetime.now(timezone.utc)
+        time_max = now + timedelta(days=days_ahead)
+        events = calendar_index.list_events(now, time_max, max_results) if calendar_index else None
+        if events is None:
+            events = _list_from_api(now, time_max, max_results)
         
         if not events:
             return f'Nenhum evento encontrado nos próximos {days_ahead} dias.'
         
-        result = [f'Próximos {len(events)} eventos:']
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            summary = event.get('summary', 'Sem título')
-            
-            # Formata a data/hora
-            try:
-                if 'T' in start:
-                    dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                    formatted_date = dt.strftime('%d/%m/%Y às %H:%M')
-                else:
-                    dt = datetime.fromisoformat(start)
-                    formatted_date = dt.strftime('%d/%m/%Y (dia inteiro)')
-            except:
-                formatted_date = start
-            
-            result.append(f'- {summary} - {formatted_date}')
-        
-        return '\n'.join(result)
+        return format_events(f'Próximos {len(events)} eventos:', events)
         
     except HttpError as error:
         return f'Erro ao buscar eventos: {error}'
@@ -147,6 +307,9 @@ def create_calendar_event(
             event['location'] = location
         
         event = service.events().insert(calendarId='primary', body=event).execute()
+        # Atualiza o índice local imediatamente (write-through)
+        if calendar_index:
+            calendar_index.upsert(event)
         
         return f'Evento criado com sucesso: {summary}\nLink: {event.get("htmlLink")}'
         
@@ -172,44 +335,16 @@ def search_calendar_events(
         String formatada com os eventos encontrados ou mensagem se não houver resultados
     """
     try:
-        service = get_calendar_service()
-        
         # Busca eventos a partir de 30 dias atrás
-        time_min = (datetime.utcnow() - timedelta(days=30)).isoformat() + 'Z'
-        
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=time_min,
-            maxResults=max_results,
-            singleEvents=True,
-            orderBy='startTime',
-            q=query
-        ).execute()
-        
-        events = events_result.get('items', [])
+        time_min = datetime.now(timezone.utc) - timedelta(days=30)
+        events = calendar_index.search_events(query, time_min, max_results) if calendar_index else None
+        if events is None:
+            events = _list_from_api(time_min, max_results=max_results, query=query)
         
         if not events:
             return f'Nenhum evento encontrado com "{query}".'
         
-        result = [f'Eventos encontrados ({len(events)}):']
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            summary = event.get('summary', 'Sem título')
-            
-            # Formata a data/hora
-            try:
-                if 'T' in start:
-                    dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                    formatted_date = dt.strftime('%d/%m/%Y às %H:%M')
-                else:
-                    dt = datetime.fromisoformat(start)
-                    formatted_date = dt.strftime('%d/%m/%Y (dia inteiro)')
-            except:
-                formatted_date = start
-            
-            result.append(f'- {summary} - {formatted_date}')
-        
-        return '\n'.join(result)
+        return format_events(f'Eventos encontrados ({len(events)}):', events)
         
     except HttpError as error:
         return f'Erro ao buscar eventos: {error}'
@@ -231,6 +366,8 @@ def delete_calendar_event(event_id: str) -> str:
     try:
         service = get_calendar_service()
         service.events().delete(calendarId='primary', eventId=event_id).execute()
+        if calendar_index:
+            calendar_index.remove(event_id)
         return f'Evento deletado com sucesso.'
         
     except HttpError as error:
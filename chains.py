@@ -1,5 +1,10 @@
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+import logging
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+
 from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.runnables import RunnablePassthrough
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_openai import ChatOpenAI
 from langchain.agents import create_tool_calling_agent, AgentExecutor
@@ -8,24 +13,71 @@ from config import (
     OPENAI_MODEL_NAME,
     OPENAI_MODEL_TEMPERATURE,
     ENABLE_GOOGLE_CALENDAR,
+    SEMANTIC_CACHE_ENABLED,
+    CONTEXTUALIZE_MODEL_NAME,
+    AGENT_VERBOSE,
+    REPLY_STREAMING,
+    TENANT_CACHE_SIZE,
 )
 from memory import get_session_history
-from vectorstore import get_vectorstore
+from vectorstore import open_vectorstore, get_index_version
+from tenants import DEFAULT_COLLECTION_NAME
+from hybrid_retriever import get_retriever
 from prompts import get_contextualize_prompt, get_qa_prompt
+from contextualize import get_standalone_question_chain
+from prompt_budget import PromptBudget
 
+logger = logging.getLogger(__name__)
 
-def get_rag_chain(contextualize_prompt_text, system_prompt_text):
-    # Inicializa o LLM (desabilitando streaming para evitar erro 400)
-    llm = ChatOpenAI(
-        model=OPENAI_MODEL_NAME,
-        temperature=OPENAI_MODEL_TEMPERATURE,
-        streaming=False,  # Desabilita streaming para evitar erro de organização
-    )
+_llms = {}
+
+
+def get_llm(model=OPENAI_MODEL_NAME, temperature=OPENAI_MODEL_TEMPERATURE, streaming=False):
+    """Cliente do LLM compartilhado pelos chains de todas as instâncias (um pool de conexões por configuração)."""
+    key = (model, str(temperature), streaming)
+    if key not in _llms:
+        _llms[key] = ChatOpenAI(model=model, temperature=temperature, streaming=streaming)
+    return _llms[key]
+
+
+_retrievers = OrderedDict()
+_retrievers_lock = threading.Lock()
+
+
+def get_collection_retriever(collection_name=DEFAULT_COLLECTION_NAME):
+    """
+    Recuperador da coleção, reaproveitado enquanto a versão da base não muda:
+    recarregar só os prompts não reabre o Chroma nem relê o índice BM25.
+    """
+    version = get_index_version(collection_name)
+    with _retrievers_lock:
+        cached = _retrievers.get(collection_name)
+    if cached is None or cached[0] != version:
+        cached = (version, get_retriever(open_vectorstore(collection_name)))
+    # Os chains são montados em threads (uma por instância carregando)
+    with _retrievers_lock:
+        _retrievers[collection_name] = cached
+        _retrievers.move_to_end(collection_name)
+        while len(_retrievers) > TENANT_CACHE_SIZE:
+            _retrievers.popitem(last=False)
+    return cached[1]
+
+
+def get_contextualize_llm(llm):
+    """LLM usado para reescrever a pergunta; pode ser um modelo menor e mais rápido."""
+    if not CONTEXTUALIZE_MODEL_NAME:
+        return llm
+    return get_llm(model=CONTEXTUALIZE_MODEL_NAME, temperature=0)
+
+
+def get_rag_chain(contextualize_prompt_text, system_prompt_text, collection_name=DEFAULT_COLLECTION_NAME):
+    # Streaming só com REPLY_STREAMING (desabilitado por padrão para evitar erro 400 de organização)
+    llm = get_llm(streaming=REPLY_STREAMING)
 
-    # Recuperador de vetores
-    retriever = get_vectorstore().as_retriever()
+    # Recuperador híbrido (vetorial + BM25)
+    retriever = get_collection_retriever(collection_name)
     contextualize_prompt = get_contextualize_prompt(contextualize_prompt_text)
-    history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_prompt)
+    standalone_question = get_standalone_question_chain(get_contextualize_llm(llm), contextualize_prompt)
 
     # Chain de QA ajustada para aceitar a variável "context"
     qa_prompt = get_qa_prompt(system_prompt_text)
@@ -35,22 +87,50 @@ def get_rag_chain(contextualize_prompt_text, system_prompt_text):
         document_variable_name="context"  # ESSENCIAL: indica que o texto recuperado estará na variável 'context'
     )
 
+    # Orçamento de tokens entre prompt de sistema, histórico e contexto
+    budget = PromptBudget(system_prompt_text)
+
+    # Recupera com a pergunta independente e responde com o contexto deduplicado e limitado
+    answer_chain = RunnablePassthrough.assign(
+        context=itemgetter('standalone_question') | retriever,
+    ).assign(context=budget.context_step()).assign(answer=question_answer_chain)
+
+    # Cache semântico: perguntas equivalentes já respondidas não chamam o LLM de resposta
+    if SEMANTIC_CACHE_ENABLED:
+        from semantic_cache import SemanticCache, SemanticCachedChain, prompt_version
+
+        cache = SemanticCache(
+            prompt_version(OPENAI_MODEL_NAME, contextualize_prompt_text, system_prompt_text),
+            collection_name,
+        )
+        answer_chain = SemanticCachedChain(answer_chain, cache)
+
     # Cria o chain completo de RAG
-    return create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    return (
+        RunnablePassthrough.assign(chat_history=budget.history_step())
+        | RunnablePassthrough.assign(standalone_question=standalone_question)
+        | answer_chain
+    ).with_config(run_name='retrieval_chain')
 
 
-def get_conversational_rag_chain(contextualize_prompt_text, system_prompt_text):
+def get_conversational_rag_chain(
+    contextualize_prompt_text,
+    system_prompt_text,
+    collection_name=DEFAULT_COLLECTION_NAME,
+    enable_calendar=ENABLE_GOOGLE_CALENDAR,
+):
     # Se o Google Calendar estiver habilitado, usa agent com tools
-    if ENABLE_GOOGLE_CALENDAR:
+    if enable_calendar:
         try:
-            from calendar_tools import CALENDAR_TOOLS
-            return get_agent_with_tools(contextualize_prompt_text, system_prompt_text, CALENDAR_TOOLS)
+            from calendar_tools import CALENDAR_TOOLS, start_calendar_sync
+
+            start_calendar_sync()
+            return get_agent_with_tools(contextualize_prompt_text, system_prompt_text, CALENDAR_TOOLS, collection_name)
         except Exception as e:
-            print(f"Erro ao carregar ferramentas do Google Calendar: {e}")
-            print("Continuando sem integração do Calendar...")
+            logger.exception('[CALENDAR] Erro ao carregar ferramentas do Google Calendar, continuando sem integração: %s', e)
     
     # Chain RAG padrão sem tools
-    rag_chain = get_rag_chain(contextualize_prompt_text, system_prompt_text)
+    rag_chain = get_rag_chain(contextualize_prompt_text, system_prompt_text, collection_name)
     return RunnableWithMessageHistory(
         runnable=rag_chain,
         get_session_history=get_session_history,
@@ -60,20 +140,16 @@ def get_conversational_rag_chain(contextualize_prompt_text, system_prompt_text):
     )
 
 
-def get_agent_with_tools(contextualize_prompt_text, system_prompt_text, tools):
+def get_agent_with_tools(contextualize_prompt_text, system_prompt_text, tools, collection_name=DEFAULT_COLLECTION_NAME):
     """Cria um agente com ferramentas (tools) e RAG."""
     from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
     
     # Inicializa o LLM (desabilitando streaming para evitar erro 400)
-    llm = ChatOpenAI(
-        model=OPENAI_MODEL_NAME,
-        temperature=OPENAI_MODEL_TEMPERATURE,
-        streaming=False,  # Desabilita streaming para evitar erro de organização
-    )
-    
-    # Recuperador de vetores
-    retriever = get_vectorstore().as_retriever()
+    llm = get_llm(streaming=False)  # Desabilita streaming para evitar erro de organização
     
+    # Recuperador híbrido (vetorial + BM25), já limitado pelo orçamento de tokens
+    retriever = get_collection_retriever(collection_name)
+
     # Cria uma tool para buscar no RAG
     from langchain_core.tools import tool
     
@@ -90,17 +166,18 @@ def get_agent_with_tools(contextualize_prompt_text, system_prompt_text, tools):
         Returns:
             Informações relevantes da base de conhecimento
         """
-        docs = retriever.get_relevant_documents(query)
+        docs = retriever.invoke(query)
         if not docs:
             return "Nenhuma informação encontrada na base de conhecimento."
-        return "\n\n".join([doc.page_content for doc in docs[:3]])
+        return "\n\n".join([doc.page_content for doc in docs])
     
     # Adiciona a tool de RAG às outras tools
     all_tools = tools + [search_knowledge_base]
     
     # Cria o prompt do agente
+    agent_system_text = system_prompt_text + "\n\nVocê tem acesso a ferramentas para buscar informações e gerenciar o calendário. Use-as quando necessário."
     prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt_text + "\n\nVocê tem acesso a ferramentas para buscar informações e gerenciar o calendário. Use-as quando necessário."),
+        ("system", agent_system_text),
         MessagesPlaceholder(variable_name="chat_history", optional=True),
         ("human", "{input}"),
         MessagesPlaceholder(variable_name="agent_scratchpad"),
@@ -111,17 +188,35 @@ def get_agent_with_tools(contextualize_prompt_text, system_prompt_text, tools):
     agent_executor = AgentExecutor(
         agent=agent,
         tools=all_tools,
-        verbose=True,
+        verbose=AGENT_VERBOSE,
         handle_parsing_errors=True,
         max_iterations=5,
         return_intermediate_steps=False,  # Evita streaming interno
     )
     
+    # Histórico limitado pelo orçamento de tokens antes de chegar ao agente
+    budget = PromptBudget(agent_system_text)
+    agent_with_budget = RunnablePassthrough.assign(chat_history=budget.history_step()) | agent_executor
+
     # Retorna com histórico de mensagens
     return RunnableWithMessageHistory(
-        runnable=agent_executor,
+        runnable=agent_with_budget,
         get_session_history=get_session_history,
         input_messages_key='input',
         history_messages_key='chat_history',
         output_messages_key='output',
     )
+
+
+def get_tenant_chain(tenant):
+    """
+    Chain de uma instância: prompts e coleção próprios, clientes compartilhados.
+    As ferramentas do Google Calendar são da conta configurada no .env, então só a
+    instância padrão usa o agent; as demais usam o chain RAG.
+    """
+    return get_conversational_rag_chain(
+        tenant.contextualize_prompt,
+        tenant.system_prompt,
+        collection_name=tenant.collection_name,
+        enable_calendar=ENABLE_GOOGLE_CALENDAR and tenant.is_default,
+    )
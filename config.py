@@ -8,12 +8,28 @@ load_dotenv()
 # Diretório dos prompts dentro do container
 # Variáveis de ambiente
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY não encontrada. Configure no arquivo .env")
 OPENAI_MODEL_NAME = os.getenv('OPENAI_MODEL_NAME', 'gpt-5')  # Modelo mais avançado (GPT-5)
 OPENAI_MODEL_TEMPERATURE = os.getenv('OPENAI_MODEL_TEMPERATURE', '0.7')  # Aumentado para GPT-5 (mais natural)
 VECTOR_STORE_PATH = os.getenv('VECTOR_STORE_PATH')
 RAG_FILES_DIR = os.getenv('RAG_FILES_DIR')
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '64'))  # Chunks por chamada de embedding
+INGEST_BATCH_MAX_CHARS = int(os.getenv('INGEST_BATCH_MAX_CHARS', '100000'))  # Tamanho máximo do lote
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '0'))  # Processos lendo/dividindo arquivos; 0 = núcleos da CPU, 1 = sem pool
+INGEST_EMBED_CONCURRENCY = int(os.getenv('INGEST_EMBED_CONCURRENCY', '4'))  # Lotes de embedding em paralelo (reduz sozinho em 429)
+INGEST_WRITE_BATCH_SIZE = int(os.getenv('INGEST_WRITE_BATCH_SIZE', '1000'))  # Chunks por gravação no Chroma
+INGEST_JOURNAL_PATH = os.getenv(  # Diário da ingestão (retomada após falha ou reinício)
+    'INGEST_JOURNAL_PATH',
+    os.path.join(VECTOR_STORE_PATH or '.', 'ingest_journal.sqlite'),
+)
+
+# Cache persistente de embeddings (SQLite)
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+EMBEDDING_CACHE_PATH = os.getenv(
+    'EMBEDDING_CACHE_PATH',
+    os.path.join(VECTOR_STORE_PATH or '.', 'embedding_cache.sqlite'),
+)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', str(30 * 24 * 3600)))  # 30 dias
 # Configuração da Evolution API - detecta automaticamente se está rodando dentro ou fora do Docker
 EVOLUTION_API_URL_DOCKER = os.getenv('EVOLUTION_API_URL', 'http://evolution-api:8080')
 EVOLUTION_API_URL_LOCAL = EVOLUTION_API_URL_DOCKER.replace('http://evolution-api:', 'http://localhost:')
@@ -21,12 +37,11 @@ EVOLUTION_API_URL_LOCAL = EVOLUTION_API_URL_DOCKER.replace('http://evolution-api
 # Se estiver rodando fora do Docker, usa localhost
 EVOLUTION_API_URL = EVOLUTION_API_URL_LOCAL if not os.path.exists('/.dockerenv') else EVOLUTION_API_URL_DOCKER
 EVOLUTION_INSTANCE_NAME = os.getenv('EVOLUTION_INSTANCE_NAME')
-if not EVOLUTION_INSTANCE_NAME:
-    raise ValueError("EVOLUTION_INSTANCE_NAME não encontrada. Configure no arquivo .env")
-
 EVOLUTION_AUTHENTICATION_API_KEY = os.getenv('AUTHENTICATION_API_KEY')
-if not EVOLUTION_AUTHENTICATION_API_KEY:
-    raise ValueError("AUTHENTICATION_API_KEY não encontrada. Configure no arquivo .env")
+EVOLUTION_MAX_CONNECTIONS = int(os.getenv('EVOLUTION_MAX_CONNECTIONS', '20'))  # Conexões keep-alive no pool
+EVOLUTION_MAX_CONCURRENCY = int(os.getenv('EVOLUTION_MAX_CONCURRENCY', '20'))  # Envios simultâneos
+EVOLUTION_MAX_RETRIES = int(os.getenv('EVOLUTION_MAX_RETRIES', '3'))  # Novas tentativas em 5xx/429
+EVOLUTION_TIMEOUT = float(os.getenv('EVOLUTION_TIMEOUT', '10'))
 
 # Configuração do Redis - detecta automaticamente se está rodando dentro ou fora do Docker
 REDIS_URL_DOCKER = os.getenv('CACHE_REDIS_URI', 'redis://redis:6379/6')
@@ -34,10 +49,115 @@ REDIS_URL_LOCAL = REDIS_URL_DOCKER.replace('redis://redis:', 'redis://localhost:
 
 # Se estiver rodando fora do Docker, usa localhost
 REDIS_URL = REDIS_URL_LOCAL if not os.path.exists('/.dockerenv') else REDIS_URL_DOCKER
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))  # Tamanho do pool compartilhado
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '5'))
 BUFFER_KEY_SUFIX = os.getenv('BUFFER_KEY_SUFIX', ':buffer')
-DEBOUNCE_SECONDS = os.getenv('DEBOUNCE_SECONDS', '10')
+DEBOUNCE_SECONDS = os.getenv('DEBOUNCE_SECONDS', '10')  # Espera máxima após a última mensagem
+# Debounce adaptativo: aprende o intervalo entre mensagens de cada chat e encerra cedo em sinais de fim
+DEBOUNCE_ADAPTIVE = os.getenv('DEBOUNCE_ADAPTIVE', 'true').lower() == 'true'
+DEBOUNCE_MIN_SECONDS = float(os.getenv('DEBOUNCE_MIN_SECONDS', '1.5'))  # Espera após pergunta/mensagem longa
+DEBOUNCE_MAX_WAIT_SECONDS = float(os.getenv('DEBOUNCE_MAX_WAIT_SECONDS', '20'))  # Espera total máxima do lote
+DEBOUNCE_GAP_FACTOR = float(os.getenv('DEBOUNCE_GAP_FACTOR', '1.5'))  # Multiplicador do intervalo típico
+DEBOUNCE_LONG_MESSAGE_CHARS = int(os.getenv('DEBOUNCE_LONG_MESSAGE_CHARS', '120'))
 BUFFER_TTL = os.getenv('BUFFER_TTL', '300')
+DEBOUNCE_LEASE_SECONDS = float(os.getenv('DEBOUNCE_LEASE_SECONDS', '60'))  # Lease de um worker sobre um chat
+DEBOUNCE_POLL_INTERVAL = float(os.getenv('DEBOUNCE_POLL_INTERVAL', '0.25'))  # Intervalo de consulta à agenda
+DEBOUNCE_MAX_ATTEMPTS = int(os.getenv('DEBOUNCE_MAX_ATTEMPTS', '3'))  # Tentativas de um lote antes de descartá-lo
 
 # Configuração do Google Calendar
 # TEMPORARIAMENTE DESABILITADO devido ao erro de streaming da OpenAI
 ENABLE_GOOGLE_CALENDAR = True  # ✅ Verificação feita - aguardando propagação (até 15min)
+# Índice local de eventos sincronizado por syncToken (listagem/busca sem chamar a API a cada passo)
+CALENDAR_INDEX_ENABLED = os.getenv('CALENDAR_INDEX_ENABLED', 'true').lower() == 'true'
+CALENDAR_SYNC_INTERVAL = float(os.getenv('CALENDAR_SYNC_INTERVAL', '60'))  # Intervalo da sincronização em segundo plano (segundos)
+CALENDAR_SYNC_PAST_DAYS = int(os.getenv('CALENDAR_SYNC_PAST_DAYS', '30'))  # Janela do índice: dias para trás (buscas)
+CALENDAR_SYNC_FUTURE_DAYS = int(os.getenv('CALENDAR_SYNC_FUTURE_DAYS', '180'))  # Janela do índice: dias à frente (agendamentos)
+
+# Execução dos chains fora do event loop
+# auto: usa ainvoke quando o chain tem implementação assíncrona nativa; thread: sempre usa o pool
+CHAIN_EXECUTION_MODE = os.getenv('CHAIN_EXECUTION_MODE', 'auto')
+CHAIN_THREAD_POOL_SIZE = int(os.getenv('CHAIN_THREAD_POOL_SIZE', '16'))
+CHAIN_TENANT_CONCURRENCY = int(os.getenv('CHAIN_TENANT_CONCURRENCY', '32'))  # Execuções simultâneas por instância
+CHAIN_QUEUE_SIZE = int(os.getenv('CHAIN_QUEUE_SIZE', '500'))  # Máximo de execuções aguardando + em andamento
+
+# Turnos de geração: um por chat de cada vez, limite global e descarte quando a fila passa do SLO
+TURN_MAX_CONCURRENCY = int(os.getenv('TURN_MAX_CONCURRENCY', '32'))  # Turnos gerando resposta ao mesmo tempo
+TURN_QUEUE_SLO_SECONDS = float(os.getenv('TURN_QUEUE_SLO_SECONDS', '60'))  # Espera máxima estimada na fila
+TURN_SHED_ENABLED = os.getenv('TURN_SHED_ENABLED', 'true').lower() == 'true'
+TURN_SHED_MESSAGE = os.getenv(
+    'TURN_SHED_MESSAGE',
+    'Estamos recebendo muitas mensagens agora. Por favor, envie sua pergunta novamente em alguns minutos.',
+)
+
+# Cache semântico de respostas (perguntas equivalentes reaproveitam a resposta anterior)
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))  # Similaridade mínima (cosseno)
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '86400'))  # Validade das respostas (segundos)
+
+# Reescrita da pergunta (contextualização)
+CONTEXTUALIZE_MODEL_NAME = os.getenv('CONTEXTUALIZE_MODEL_NAME', '')  # Vazio: usa OPENAI_MODEL_NAME
+CONTEXTUALIZE_HEURISTIC = os.getenv('CONTEXTUALIZE_HEURISTIC', 'true').lower() == 'true'  # Pula perguntas autocontidas
+CONTEXTUALIZE_MIN_WORDS = int(os.getenv('CONTEXTUALIZE_MIN_WORDS', '4'))  # Perguntas menores sempre são reescritas
+
+# Observabilidade
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()  # DEBUG mostra o detalhe de cada mensagem do buffer
+AGENT_VERBOSE = os.getenv('AGENT_VERBOSE', 'false').lower() == 'true'  # Saída passo a passo do AgentExecutor
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'  # Expõe /metrics (Prometheus)
+
+# Recebimento de webhooks (ack imediato, entrega ao buffer em segundo plano)
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '10000'))  # Acima disso responde 503 para a Evolution reenviar
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', '256'))  # Mensagens retiradas da fila por ciclo
+WEBHOOK_COALESCE = os.getenv('WEBHOOK_COALESCE', 'true').lower() == 'true'  # Agrupa rajadas do mesmo chat na fila
+
+# Deduplicação de webhooks reentregues pela Evolution (por id da mensagem)
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_TTL = int(os.getenv('DEDUP_TTL', '3600'))  # Por quanto tempo um id é lembrado (segundos)
+DEDUP_LOCAL_SIZE = int(os.getenv('DEDUP_LOCAL_SIZE', '50000'))  # Ids lembrados em memória por processo
+
+# Resposta em streaming: envia a resposta em partes enquanto o modelo gera (somente chain RAG)
+# Desligado por padrão: algumas organizações da OpenAI recebem erro 400 ao usar streaming
+REPLY_STREAMING = os.getenv('REPLY_STREAMING', 'false').lower() == 'true'
+REPLY_CHUNK_MIN_CHARS = int(os.getenv('REPLY_CHUNK_MIN_CHARS', '120'))  # Tamanho mínimo antes de cortar em um parágrafo
+REPLY_CHUNK_MAX_CHARS = int(os.getenv('REPLY_CHUNK_MAX_CHARS', '800'))  # Acima disso corta no último fim de frase
+
+# Recuperação: híbrida (vetorial + BM25 com reciprocal rank fusion) ou só vetorial
+RETRIEVER_MODE = os.getenv('RETRIEVER_MODE', 'hybrid')  # hybrid | vector
+RETRIEVER_K = int(os.getenv('RETRIEVER_K', '4'))  # Documentos entregues ao LLM
+RETRIEVER_FETCH_K = int(os.getenv('RETRIEVER_FETCH_K', '20'))  # Candidatos de cada busca antes da fusão
+RETRIEVER_RRF_K = int(os.getenv('RETRIEVER_RRF_K', '60'))  # Constante da reciprocal rank fusion
+RETRIEVER_RERANK = os.getenv('RETRIEVER_RERANK', 'false').lower() == 'true'  # Reordena com FlashRank (CPU)
+RETRIEVER_RERANK_MODEL = os.getenv('RETRIEVER_RERANK_MODEL', 'ms-marco-MiniLM-L-12-v2')
+RETRIEVER_CONTEXT_TOKENS = int(os.getenv('RETRIEVER_CONTEXT_TOKENS', '1500'))  # Orçamento de tokens do contexto
+
+# Orçamento de tokens de entrada (prompt de sistema + histórico + contexto recuperado)
+PROMPT_MAX_INPUT_TOKENS = int(os.getenv('PROMPT_MAX_INPUT_TOKENS', '9000'))  # Total de entrada (o system.txt padrão usa ~4,4k)
+PROMPT_HISTORY_TOKENS = int(os.getenv('PROMPT_HISTORY_TOKENS', '1500'))  # Máximo para o histórico (depois de reservar o contexto)
+PROMPT_MESSAGE_MAX_TOKENS = int(os.getenv('PROMPT_MESSAGE_MAX_TOKENS', '400'))  # Mensagens maiores são truncadas
+
+# Inicialização: a API aceita conexões na hora e o chain é montado em segundo plano
+INGEST_ON_STARTUP = os.getenv('INGEST_ON_STARTUP', 'background')  # background (após ficar pronto) | off
+STARTUP_BUILD_ATTEMPTS = int(os.getenv('STARTUP_BUILD_ATTEMPTS', '5'))  # Tentativas de montar o chain antes de desistir
+STARTUP_RETRY_SECONDS = float(os.getenv('STARTUP_RETRY_SECONDS', '5'))  # Espera antes da 2ª tentativa (dobra a cada falha)
+
+# Multi-instância: um processo atende várias instâncias da Evolution, roteadas pelo campo 'instance' do webhook
+TENANTS_DIR = os.getenv('TENANTS_DIR', '')  # Um subdiretório por instância, com prompts e docs/ próprios
+TENANT_CACHE_SIZE = int(os.getenv('TENANT_CACHE_SIZE', '50'))  # Instâncias com chain montado em memória (LRU)
+
+# Recarga de prompts e da base de conhecimento sem reiniciar o processo
+RELOAD_WATCH_INTERVAL = float(os.getenv('RELOAD_WATCH_INTERVAL', '0'))  # Segundos entre verificações dos arquivos; 0 desliga
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', '')  # Habilita POST /admin/reload (header 'apikey'); vazio desliga
+
+
+def check_required_settings():
+    """
+    Verifica as variáveis obrigatórias. Chamado por quem precisa delas (montagem do chain,
+    ingestão), e não no import, para a API poder subir e reportar o erro em /ready.
+    """
+    required = {
+        'OPENAI_API_KEY': OPENAI_API_KEY,
+        'EVOLUTION_INSTANCE_NAME': EVOLUTION_INSTANCE_NAME,
+        'AUTHENTICATION_API_KEY': EVOLUTION_AUTHENTICATION_API_KEY,
+    }
+    for name, value in required.items():
+        if not value:
+            raise ValueError(f"{name} não encontrada. Configure no arquivo .env")
@@ -0,0 +1,68 @@
+import re
+import unicodedata
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+from config import CONTEXTUALIZE_HEURISTIC, CONTEXTUALIZE_MIN_WORDS
+from metrics import counter
+from tracing import CONTEXTUALIZE_TAG
+
+CONTEXTUALIZE_PATHS = counter('contextualize_path_total', 'Caminho usado para obter a pergunta independente')
+
+# Palavras que indicam referência a algo dito antes (pronomes, demonstrativos, advérbios de lugar).
+# Comparadas com acento: "esta" (demonstrativo) não é "está" e "e" (conectivo) não é "é";
+# as grafias sem acento que não colidem com outras palavras também entram
+REFERENCE_WORDS = {
+    'ele', 'ela', 'eles', 'elas', 'dele', 'dela', 'deles', 'delas', 'nele', 'nela', 'neles', 'nelas',
+    'isso', 'isto', 'disso', 'disto', 'nisso', 'nisto', 'aquilo', 'daquilo', 'naquilo',
+    'esse', 'essa', 'esses', 'essas', 'desse', 'dessa', 'desses', 'dessas', 'nesse', 'nessa',
+    'este', 'esta', 'estes', 'estas', 'deste', 'desta', 'neste', 'nesta',
+    'aquele', 'aquela', 'aqueles', 'aquelas', 'daquele', 'daquela', 'naquele', 'naquela',
+    'mesmo', 'mesma', 'mesmos', 'mesmas', 'outro', 'outra', 'outros', 'outras',
+    'lá', 'la', 'ali', 'aí', 'ai', 'também', 'tambem', 'anterior', 'acima', 'tal', 'cujo', 'cuja',
+}
+# Conectivos no início que indicam continuação ("e o preço?", "mas e sábado?")
+CONTINUATION_STARTS = {'e', 'mas', 'então', 'entao', 'também', 'tambem', 'ou', 'além', 'alem', 'só', 'so', 'ah'}
+
+_word = re.compile(r'\w+')
+
+
+def _words(text):
+    # NFC junta acentos digitados como caractere separado ("e" + "´" vira "é")
+    return _word.findall(unicodedata.normalize('NFC', text).lower())
+
+
+def is_self_contained(question, min_words=CONTEXTUALIZE_MIN_WORDS):
+    """
+    Heurística barata: a pergunta é independente se tiver tamanho razoável,
+    não começar com conectivo de continuação e não usar pronomes/demonstrativos.
+    """
+    words = _words(question)
+    if len(words) < min_words:
+        return False
+    if words[0] in CONTINUATION_STARTS:
+        return False
+    return not any(word in REFERENCE_WORDS for word in words)
+
+
+def get_standalone_question_chain(llm, contextualize_prompt, use_heuristic=CONTEXTUALIZE_HEURISTIC):
+    """
+    Obtém a pergunta independente do histórico, evitando a chamada ao LLM quando possível:
+    - sem histórico: usa a própria entrada
+    - pergunta autocontida (heurística): usa a própria entrada
+    - caso contrário: reescreve com o prompt de contextualização
+    """
+    rewrite_chain = (contextualize_prompt | llm | StrOutputParser()).with_config(tags=[CONTEXTUALIZE_TAG])
+
+    def route(x):
+        if not x.get('chat_history'):
+            CONTEXTUALIZE_PATHS.inc(path='no_history')
+            return x['input']
+        if use_heuristic and is_self_contained(x['input']):
+            CONTEXTUALIZE_PATHS.inc(path='self_contained')
+            return x['input']
+        CONTEXTUALIZE_PATHS.inc(path='rewrite')
+        return rewrite_chain
+
+    return RunnableLambda(route).with_config(run_name='contextualize_question')
@@ -0,0 +1,103 @@
+import time
+
+from config import (
+    DEBOUNCE_SECONDS,
+    DEBOUNCE_ADAPTIVE,
+    DEBOUNCE_MIN_SECONDS,
+    DEBOUNCE_MAX_WAIT_SECONDS,
+    DEBOUNCE_GAP_FACTOR,
+    DEBOUNCE_LONG_MESSAGE_CHARS,
+)
+from metrics import histogram, observe_stage
+
+DEBOUNCE_WAIT = histogram(
+    'debounce_wait_seconds',
+    'Tempo entre a primeira mensagem do lote e o início do processamento',
+    buckets=(0.5, 1, 2, 3, 5, 8, 10, 15, 20, 30, 60),
+)
+
+# Peso do intervalo mais recente na média móvel exponencial
+EWMA_ALPHA = 0.3
+# Intervalos maiores que isso são conversas diferentes, não mensagens do mesmo lote
+MAX_LEARNED_GAP = 60
+# Por quanto tempo as estatísticas de um chat ficam guardadas
+STATS_TTL = 7 * 24 * 3600
+# Usado como espera máxima quando o modo adaptativo está desligado
+NO_LIMIT = 10 ** 9
+
+
+class AdaptiveDebouncePolicy:
+    """
+    Decide quanto esperar por mais mensagens antes de processar o chat:
+    - sinais claros de fim (pergunta, mensagem longa) encerram a espera cedo
+    - sem sinal, espera um múltiplo do intervalo típico entre mensagens daquele chat
+    - sem histórico de intervalos, espera DEBOUNCE_SECONDS
+    - nunca passa de DEBOUNCE_MAX_WAIT_SECONDS desde a primeira mensagem do lote
+    """
+
+    def __init__(
+        self,
+        adaptive=DEBOUNCE_ADAPTIVE,
+        max_delay=float(DEBOUNCE_SECONDS),
+        min_delay=DEBOUNCE_MIN_SECONDS,
+        max_wait=DEBOUNCE_MAX_WAIT_SECONDS,
+        gap_factor=DEBOUNCE_GAP_FACTOR,
+        long_message_chars=DEBOUNCE_LONG_MESSAGE_CHARS,
+    ):
+        self.adaptive = adaptive
+        self.max_delay = max_delay
+        self.min_delay = min_delay
+        self.max_wait = max_wait if adaptive else NO_LIMIT
+        self.gap_factor = gap_factor
+        self.long_message_chars = long_message_chars
+
+    def done_hint(self, message):
+        """Espera fixa quando a mensagem indica que o usuário terminou de escrever (ou None)."""
+        if not self.adaptive:
+            return self.max_delay
+        text = message.strip()
+        if text.endswith('?') or len(text) >= self.long_message_chars:
+            return self.min_delay
+        return None
+
+    def next_due(self, stats, message, now=None):
+        """
+        Atualiza as estatísticas do chat (dict com 'last', 'ewma', 'burst') e
+        devolve o horário em que o chat deve ser processado.
+        Mesma lógica do SCHEDULE_SCRIPT do DebounceScheduler, para o modo sem Redis.
+        """
+        now = time.time() if now is None else now
+        last, ewma = stats.get('last'), stats.get('ewma')
+        if last is not None and now - last <= MAX_LEARNED_GAP:
+            gap = now - last
+            ewma = gap if ewma is None else EWMA_ALPHA * gap + (1 - EWMA_ALPHA) * ewma
+        burst = stats.get('burst') or now
+
+        delay = self.done_hint(message)
+        if delay is None:
+            delay = min(max(ewma * self.gap_factor, self.min_delay), self.max_delay) if ewma is not None else self.max_delay
+
+        stats.update(last=now, ewma=ewma, burst=burst)
+        return min(now + delay, burst + self.max_wait)
+
+    def script_args(self, message):
+        """Parâmetros da política para o script de agendamento no Redis."""
+        hint = self.done_hint(message)
+        return [
+            '' if hint is None else hint,
+            EWMA_ALPHA,
+            self.gap_factor,
+            self.min_delay,
+            self.max_delay,
+            self.max_wait,
+            MAX_LEARNED_GAP,
+            STATS_TTL,
+        ]
+
+
+def observe_debounce_wait(seconds):
+    DEBOUNCE_WAIT.observe(seconds)
+    observe_stage('debounce_wait', seconds)
+
+
+debounce_policy = AdaptiveDebouncePolicy()
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+import orjson
+
+from debounce_policy import debounce_policy, observe_debounce_wait
+from config import (
+    BUFFER_KEY_SUFIX,
+    BUFFER_TTL,
+    DEBOUNCE_LEASE_SECONDS,
+    DEBOUNCE_MAX_ATTEMPTS,
+    DEBOUNCE_POLL_INTERVAL,
+)
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTERS = counter('debounce_dead_letters_total', 'Lotes descartados após falhar em todas as tentativas')
+
+# Sorted set com o horário em que cada chat deve ser processado
+DUE_KEY = 'debounce:due'
+# Lotes que falharam DEBOUNCE_MAX_ATTEMPTS vezes (os mais recentes primeiro), para inspeção manual
+DEAD_LETTER_KEY = 'debounce:dead_letter'
+DEAD_LETTER_SIZE = 1000
+# Quantos chats vencidos cada worker busca por ciclo
+CLAIM_BATCH = 50
+
+# Adiciona a mensagem, atualiza as estatísticas de intervalo do chat e agenda o processamento
+# (mesma lógica de AdaptiveDebouncePolicy.next_due). Devolve {tamanho do buffer, espera}.
+SCHEDULE_SCRIPT = """
+local now = tonumber(ARGV[3])
+local count = redis.call('RPUSH', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local alpha, factor = tonumber(ARGV[6]), tonumber(ARGV[7])
+local min_delay, max_delay, max_wait = tonumber(ARGV[8]), tonumber(ARGV[9]), tonumber(ARGV[10])
+local last = tonumber(redis.call('HGET', KEYS[2], 'last'))
+local ewma = tonumber(redis.call('HGET', KEYS[2], 'ewma'))
+local burst = tonumber(redis.call('HGET', KEYS[2], 'burst')) or now
+if last and now - last <= tonumber(ARGV[11]) then
+  local gap = now - last
+  if ewma then ewma = alpha * gap + (1 - alpha) * ewma else ewma = gap end
+end
+local delay = tonumber(ARGV[5])
+if not delay then
+  if ewma then delay = math.min(math.max(ewma * factor, min_delay), max_delay) else delay = max_delay end
+end
+local due = math.min(now + delay, burst + max_wait)
+redis.call('HSET', KEYS[2], 'last', ARGV[3], 'burst', tostring(burst))
+if ewma then redis.call('HSET', KEYS[2], 'ewma', tostring(ewma)) end
+redis.call('EXPIRE', KEYS[2], ARGV[12])
+redis.call('ZADD', KEYS[3], due, ARGV[1])
+return {count, tostring(due - now)}
+"""
+
+# Move o buffer para a lista "em processamento" e reagenda o chat para recuperação,
+# caso o worker caia antes de terminar. Não faz nada se uma mensagem nova adiou o chat.
+# Conta as tentativas do lote: só é zerada quando um turno conclui.
+DRAIN_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score or tonumber(score) > tonumber(ARGV[2]) then
+  return false
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+local messages = redis.call('LRANGE', KEYS[2], 0, -1)
+if #messages > 0 then
+  redis.call('RPUSH', KEYS[3], unpack(messages))
+  redis.call('DEL', KEYS[2])
+end
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+local attempts = redis.call('INCR', KEYS[5])
+redis.call('EXPIRE', KEYS[5], ARGV[4])
+local burst = redis.call('HGET', KEYS[4], 'burst') or ''
+redis.call('HDEL', KEYS[4], 'burst')
+return {burst, redis.call('LRANGE', KEYS[3], 0, -1), attempts}
+"""
+
+# Renova o lease e o horário de recuperação enquanto o turno está em andamento
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= ARGV[2] then
+  return 0
+end
+redis.call('PEXPIRE', KEYS[2], ARGV[3])
+if tonumber(redis.call('ZSCORE', KEYS[1], ARGV[1])) == tonumber(ARGV[4]) then
+  redis.call('ZADD', KEYS[1], ARGV[5], ARGV[1])
+end
+return 1
+"""
+
+# Conclui o turno: limpa a lista em processamento e as tentativas e só tira o chat
+# da agenda se nenhuma mensagem nova chegou durante o processamento
+COMPLETE_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= ARGV[2] then
+  return 0
+end
+redis.call('DEL', KEYS[3], KEYS[4])
+if tonumber(redis.call('ZSCORE', KEYS[1], ARGV[1])) == tonumber(ARGV[3]) then
+  redis.call('ZREM', KEYS[1], ARGV[1])
+end
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+
+class DebounceScheduler:
+    """
+    Agenda de debounce compartilhada via Redis entre workers e réplicas.
+    Cada chat tem um horário de vencimento no sorted set; o worker que obtém o lease
+    drena o buffer e processa o turno. Se ele cair ou o turno falhar, o chat volta a vencer
+    após o lease e qualquer outro worker reprocessa as mensagens que ficaram em processamento;
+    depois de 'max_attempts' tentativas o lote vai para DEAD_LETTER_KEY e o chat é liberado.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        lease_seconds=DEBOUNCE_LEASE_SECONDS,
+        poll_interval=DEBOUNCE_POLL_INTERVAL,
+        max_attempts=DEBOUNCE_MAX_ATTEMPTS,
+    ):
+        self.redis = redis_client
+        self.lease_ms = int(lease_seconds * 1000)
+        self.poll_interval = poll_interval
+        self.max_attempts = max(max_attempts, 1)
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._schedule = redis_client.register_script(SCHEDULE_SCRIPT)
+        self._drain = redis_client.register_script(DRAIN_SCRIPT)
+        self._renew = redis_client.register_script(RENEW_SCRIPT)
+        self._complete = redis_client.register_script(COMPLETE_SCRIPT)
+        self._active = {}
+        self._runner = None
+
+    @staticmethod
+    def _keys(chat_id):
+        buffer_key = f'{chat_id}{BUFFER_KEY_SUFIX}'
+        return buffer_key, f'{buffer_key}:inflight', f'{buffer_key}:lease', f'{buffer_key}:stats'
+
+    @staticmethod
+    def _attempts_key(chat_id):
+        return f'{chat_id}{BUFFER_KEY_SUFIX}:inflight:attempts'
+
+    async def schedule(self, chat_id, message, policy=debounce_policy):
+        """
+        Adiciona a mensagem ao buffer e (re)agenda o chat em um único round-trip.
+        Retorna (mensagens no buffer, segundos até o processamento).
+        """
+        buffer_key, _, _, stats_key = self._keys(chat_id)
+        count, delay = await self._schedule(
+            keys=[buffer_key, stats_key, DUE_KEY],
+            args=[chat_id, message, time.time(), BUFFER_TTL, *policy.script_args(message)],
+        )
+        return count, float(delay)
+
+    def start(self, process_turn):
+        """Inicia o loop que busca chats vencidos; process_turn(chat_id, messages) processa o turno."""
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run(process_turn))
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        for task in list(self._active.values()):
+            task.cancel()
+
+    async def _run(self, process_turn):
+        while True:
+            try:
+                due = await self.redis.zrangebyscore(DUE_KEY, '-inf', time.time(), start=0, num=CLAIM_BATCH)
+                for chat_id in due:
+                    if chat_id not in self._active:
+                        self._active[chat_id] = asyncio.create_task(self._claim(chat_id, process_turn))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[DEBOUNCE] ❌ Erro ao consultar agenda: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _claim(self, chat_id, process_turn):
+        buffer_key, inflight_key, lease_key, stats_key = self._keys(chat_id)
+        try:
+            acquired = await self.redis.set(lease_key, self.worker_id, nx=True, px=self.lease_ms)
+            if not acquired:
+                return  # Outro worker está processando este chat
+
+            # Horário de recuperação: se este worker cair, o chat vence de novo após o lease
+            turn = {'recovery_score': time.time() + self.lease_ms / 1000}
+            attempts_key = self._attempts_key(chat_id)
+            drained = await self._drain(
+                keys=[DUE_KEY, buffer_key, inflight_key, stats_key, attempts_key],
+                args=[chat_id, time.time(), turn['recovery_score'], BUFFER_TTL],
+            )
+            if drained is None:
+                await self.redis.delete(lease_key)
+                return
+            burst_start, messages, attempts = drained
+            if burst_start:
+                observe_debounce_wait(time.time() - float(burst_start))
+
+            if int(attempts) > self.max_attempts:
+                # O lote já falhou (ou derrubou o worker) em todas as tentativas: não reprocessa mais
+                await self._dead_letter(chat_id, messages, int(attempts) - 1)
+            else:
+                heartbeat = asyncio.create_task(self._heartbeat(chat_id, turn))
+                try:
+                    await process_turn(chat_id, messages)
+                finally:
+                    heartbeat.cancel()
+            await self._complete(
+                keys=[DUE_KEY, lease_key, inflight_key, attempts_key],
+                args=[chat_id, self.worker_id, turn['recovery_score']],
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("[DEBOUNCE] ❌ Erro ao processar chat %s: %s", chat_id, e)
+        finally:
+            self._active.pop(chat_id, None)
+
+    async def _dead_letter(self, chat_id, messages, attempts):
+        logger.error(
+            "[DEBOUNCE] ❌ Chat %s: lote de %d mensagem(ns) descartado após %d tentativas (%s)",
+            chat_id, len(messages), attempts, DEAD_LETTER_KEY,
+        )
+        DEAD_LETTERS.inc()
+        entry = orjson.dumps({'chat_id': chat_id, 'messages': messages, 'attempts': attempts, 'at': time.time()})
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(DEAD_LETTER_KEY, entry)
+            pipe.ltrim(DEAD_LETTER_KEY, 0, DEAD_LETTER_SIZE - 1)
+            await pipe.execute()
+
+    async def _heartbeat(self, chat_id, turn):
+        _, _, lease_key, _ = self._keys(chat_id)
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            new_score = time.time() + self.lease_ms / 1000
+            renewed = await self._renew(
+                keys=[DUE_KEY, lease_key],
+                args=[chat_id, self.worker_id, self.lease_ms, turn['recovery_score'], new_score],
+            )
+            if not renewed:
+                return
+            turn['recovery_score'] = new_score
@@ -0,0 +1,78 @@
+import logging
+import time
+from collections import OrderedDict
+
+from config import DEDUP_ENABLED, DEDUP_TTL, DEDUP_LOCAL_SIZE
+from metrics import counter
+from redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+DUPLICATES = counter('webhook_duplicates_total', 'Reentregas de webhook descartadas, por onde foram detectadas')
+
+KEY_PREFIX = 'seen:'
+
+
+class MessageDeduplicator:
+    """
+    Conjunto de ids de mensagem já recebidos, com validade de 'ttl' segundos.
+    Um LRU em memória descarta reentregas rápidas sem I/O; o Redis (SET NX EX)
+    cobre as demais réplicas e reinícios. Se o Redis falhar, vale só o LRU local.
+    """
+
+    def __init__(self, ttl=DEDUP_TTL, local_size=DEDUP_LOCAL_SIZE, enabled=DEDUP_ENABLED):
+        self.ttl = ttl
+        self.local_size = local_size
+        self.enabled = enabled
+        self._seen = OrderedDict()
+
+    @staticmethod
+    def _key(instance, message_id):
+        return f'{KEY_PREFIX}{instance or ""}:{message_id}'
+
+    def seen_locally(self, instance, message_id):
+        """Marca o id como visto neste processo; True se ele já tinha sido visto dentro do ttl."""
+        if not self.enabled or not message_id:
+            return False
+        key = self._key(instance, message_id)
+        now = time.time()
+        expires_at = self._seen.get(key)
+        if expires_at is not None and expires_at > now:
+            DUPLICATES.inc(source='local')
+            return True
+        self._seen[key] = now + self.ttl
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.local_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def forget(self, instance, message_id):
+        """Desfaz seen_locally (ex: a mensagem foi recusada e a Evolution vai reenviá-la)."""
+        self._seen.pop(self._key(instance, message_id), None)
+
+    async def claim(self, messages):
+        """
+        Registra os ids no Redis em um único pipeline e devolve só as mensagens inéditas.
+        'messages' são IncomingMessage; mensagens sem id sempre passam.
+        """
+        if not self.enabled:
+            return messages
+        with_id = [message for message in messages if message.message_id]
+        if not with_id:
+            return messages
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for message in with_id:
+                    pipe.set(self._key(message.instance, message.message_id), 1, nx=True, ex=self.ttl)
+                claimed = await pipe.execute()
+        except Exception as e:
+            logger.warning('[DEDUP] Redis indisponível, usando apenas o filtro local: %s', e)
+            return messages
+
+        duplicates = {id(message) for message, ok in zip(with_id, claimed) if not ok}
+        if duplicates:
+            DUPLICATES.inc(len(duplicates), source='redis')
+        return [message for message in messages if id(message) not in duplicates]
+
+
+deduplicator = MessageDeduplicator()
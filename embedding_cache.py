@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import counter
+
+CACHE_HITS = counter('embedding_cache_hits_total', 'Embeddings servidos pelo cache')
+CACHE_MISSES = counter('embedding_cache_misses_total', 'Embeddings calculados pela API')
+
+# A cada quantas inserções a limpeza (TTL + LRU) é executada
+EVICTION_INTERVAL = 500
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_text(text, casefold=False):
+    text = _whitespace.sub(' ', unicodedata.normalize('NFC', text)).strip()
+    return text.casefold() if casefold else text
+
+
+def encode_vector(vector):
+    """Serializa o vetor como float32 (4 bytes por dimensão)."""
+    return array('f', vector).tobytes()
+
+
+def decode_vector(blob):
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class SQLiteEmbeddingStore:
+    """Armazena vetores em SQLite com expiração por TTL e remoção LRU acima de max_entries."""
+
+    def __init__(self, path, max_entries=200000, ttl_seconds=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            ' key TEXT PRIMARY KEY, vector BLOB NOT NULL,'
+            ' created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed_at)')
+        self._conn.commit()
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        with self._lock:
+            # SQLite limita a quantidade de parâmetros por consulta
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ','.join('?' * len(part))
+                rows = self._conn.execute(
+                    f'SELECT key, vector, created_at FROM embeddings WHERE key IN ({placeholders})', part
+                ).fetchall()
+                for key, blob, created_at in rows:
+                    if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                        continue
+                    found[key] = decode_vector(blob)
+            if found:
+                self._conn.executemany(
+                    'UPDATE embeddings SET accessed_at = ? WHERE key = ?',
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, vector, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                [(key, encode_vector(vector), now, now) for key, vector in items.items()],
+            )
+            self._conn.commit()
+            self._inserts += len(items)
+            if self._inserts >= EVICTION_INTERVAL:
+                self._inserts = 0
+                self._evict(now)
+
+    def _evict(self, now):
+        if self.ttl_seconds:
+            self._conn.execute('DELETE FROM embeddings WHERE created_at < ?', (now - self.ttl_seconds,))
+        (total,) = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()
+        if total > self.max_entries:
+            self._conn.execute(
+                'DELETE FROM embeddings WHERE key IN ('
+                ' SELECT key FROM embeddings ORDER BY accessed_at LIMIT ?)',
+                (total - self.max_entries,),
+            )
+        self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM embeddings')
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envolve um modelo de embeddings com cache persistente chaveado por (modelo, hash do texto).
+    Consultas são normalizadas também em caixa, para que variações como
+    "Qual o horário?" e "qual o horário?" reaproveitem o mesmo vetor.
+    """
+
+    def __init__(self, underlying, store, model_name=None):
+        self.underlying = underlying
+        self.store = store
+        self.model_name = model_name or getattr(underlying, 'model', type(underlying).__name__)
+
+    def _key(self, text, casefold=False):
+        normalized = normalize_text(text, casefold=casefold)
+        return hashlib.sha256(f'{self.model_name}\0{normalized}'.encode('utf-8')).hexdigest()
+
+    def _lookup(self, texts, kind):
+        keys = [self._key(text, casefold=kind == 'query') for text in texts]
+        cached = self.store.get_many(list(set(keys)))
+        # Textos repetidos no mesmo lote são calculados uma vez só
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        CACHE_HITS.inc(len(keys) - len(missing), kind=kind)
+        CACHE_MISSES.inc(len(missing), kind=kind)
+        return keys, cached, missing
+
+    def _merge(self, keys, cached, missing, vectors):
+        computed = dict(zip(missing.keys(), vectors))
+        self.store.put_many(computed)
+        cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def embed_documents(self, texts):
+        keys, cached, missing = self._lookup(texts, 'document')
+        vectors = self.underlying.embed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, cached, missing, vectors)
+
+    def embed_query(self, text):
+        keys, cached, missing = self._lookup([text], 'query')
+        vectors = [self.underlying.embed_query(text)] if missing else []
+        return self._merge(keys, cached, missing, vectors)[0]
+
+    async def aembed_documents(self, texts):
+        keys, cached, missing = await asyncio.to_thread(self._lookup, texts, 'document')
+        vectors = await self.underlying.aembed_documents(list(missing.values())) if missing else []
+        return await asyncio.to_thread(self._merge, keys, cached, missing, vectors)
+
+    async def aembed_query(self, text):
+        keys, cached, missing = await asyncio.to_thread(self._lookup, [text], 'query')
+        vectors = [await self.underlying.aembed_query(text)] if missing else []
+        return (await asyncio.to_thread(self._merge, keys, cached, missing, vectors))[0]
@@ -1,36 +1,154 @@
-import requests
+import asyncio
+import logging
+import random
+from collections import OrderedDict
+
+import httpx
+
 from config import (
     EVOLUTION_API_URL,
     EVOLUTION_INSTANCE_NAME,
     EVOLUTION_AUTHENTICATION_API_KEY,
+    EVOLUTION_MAX_CONNECTIONS,
+    EVOLUTION_MAX_CONCURRENCY,
+    EVOLUTION_MAX_RETRIES,
+    EVOLUTION_TIMEOUT,
+)
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Status que valem nova tentativa (rate limit e erros do servidor)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+# Formatos de número aceitos pela Evolution API, na ordem em que são tentados
+NUMBER_FORMATS = (
+    lambda number: f"{number}@s.whatsapp.net",
+    lambda number: number,
 )
+# Quantos contatos têm o formato que funcionou memorizado
+NUMBER_FORMAT_CACHE_SIZE = 10000
+
+_client = None
+_semaphore = None
+_number_formats = OrderedDict()
+
+
+def get_client():
+    """Cliente HTTP compartilhado (pool de conexões com keep-alive)."""
+    global _client, _semaphore
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=EVOLUTION_API_URL,
+            headers={
+                "apikey": EVOLUTION_AUTHENTICATION_API_KEY,
+                "Content-Type": "application/json",
+            },
+            timeout=EVOLUTION_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=EVOLUTION_MAX_CONNECTIONS,
+                max_keepalive_connections=EVOLUTION_MAX_CONNECTIONS,
+            ),
+        )
+        _semaphore = asyncio.Semaphore(EVOLUTION_MAX_CONCURRENCY)
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _number_missing(data):
+    """Verifica se a resposta indica que o número não existe no WhatsApp ({"exists": false})."""
+    if isinstance(data, dict):
+        if data.get("exists") is False:
+            return True
+        return any(_number_missing(value) for value in data.values())
+    if isinstance(data, list):
+        return any(_number_missing(item) for item in data)
+    return False
+
+
+def _backoff_delay(attempt, response=None):
+    # Respeita o Retry-After da Evolution quando presente
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX_SECONDS)
+    # Backoff exponencial com jitter completo
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
 
-def send_whatsapp_message(number, text):
+
+async def _post(url, payload):
+    """
+    Envia o payload com retry em 5xx/429 e erros de transporte.
+    Retorna a resposta final ou None se todas as tentativas falharem.
+    """
+    client = get_client()
+    for attempt in range(EVOLUTION_MAX_RETRIES + 1):
+        response = None
+        try:
+            async with _semaphore:
+                response = await client.post(url, json=payload)
+            if response.status_code not in RETRY_STATUS:
+                return response
+        except httpx.TransportError as e:
+            logger.warning("[EVOLUTION] Erro de conexão (tentativa %d): %s", attempt + 1, e)
+
+        if attempt < EVOLUTION_MAX_RETRIES:
+            await asyncio.sleep(_backoff_delay(attempt, response))
+    return response
+
+
+def _format_order(clean_number):
+    """Tenta primeiro o formato que já funcionou para este contato."""
+    known = _number_formats.get(clean_number)
+    if known is None:
+        return list(range(len(NUMBER_FORMATS)))
+    _number_formats.move_to_end(clean_number)
+    return [known] + [i for i in range(len(NUMBER_FORMATS)) if i != known]
+
+
+def _remember_format(clean_number, index):
+    _number_formats[clean_number] = index
+    _number_formats.move_to_end(clean_number)
+    while len(_number_formats) > NUMBER_FORMAT_CACHE_SIZE:
+        _number_formats.popitem(last=False)
+
+
+async def send_whatsapp_message(number, text, instance=EVOLUTION_INSTANCE_NAME):
+    with span('evolution_send'):
+        return await _send(number, text, instance)
+
+
+async def _send(number, text, instance):
     clean_number = number.replace("@s.whatsapp.net", "").replace("@g.us", "")
+    url = f"/message/sendText/{instance}"
+
+    # Tentar formatos diferentes de número (o que funcionou fica memorizado por contato)
+    for index in _format_order(clean_number):
+        payload = {"number": NUMBER_FORMATS[index](clean_number), "text": text}
+        response = await _post(url, payload)
+        if response is None:
+            return False
 
-    url = f"{EVOLUTION_API_URL}/message/sendText/{EVOLUTION_INSTANCE_NAME}"
-    headers = {
-        "apikey": EVOLUTION_AUTHENTICATION_API_KEY,
-        "Content-Type": "application/json"
-    }
-
-    # Tentar formatos diferentes de número
-    for payload in [
-        {"number": f"{clean_number}@s.whatsapp.net", "text": text},
-        {"number": clean_number, "text": text}
-    ]:
         try:
-            response = requests.post(url=url, json=payload, headers=headers, timeout=10)
-            
-            if response.status_code in [200, 201]:
-                response_data = response.json()
-                # Verificar se o número existe
-                if "exists" in response.text and "false" in response.text:
-                    continue
-                    
-                return True
-                
-        except Exception as e:
-            continue
-            
+            response_data = response.json()
+        except ValueError:
+            response_data = None
+
+        if response.status_code in (200, 201) and not _number_missing(response_data):
+            _remember_format(clean_number, index)
+            return True
+
+        # Só vale tentar o outro formato se o número foi recusado; erros do servidor não mudam com o formato
+        if response.status_code in RETRY_STATUS:
+            logger.error("[EVOLUTION] Falha ao enviar após %d tentativas: %s", EVOLUTION_MAX_RETRIES + 1, response.status_code)
+            return False
+
     return False
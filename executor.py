@@ -0,0 +1,113 @@
+import asyncio
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from langchain_core.runnables import Runnable
+
+from config import (
+    CHAIN_EXECUTION_MODE,
+    CHAIN_THREAD_POOL_SIZE,
+    CHAIN_TENANT_CONCURRENCY,
+    CHAIN_QUEUE_SIZE,
+)
+from metrics import counter, gauge, histogram
+
+QUEUE_DEPTH = gauge('chain_queue_depth', 'Execuções de chain aguardando ou em andamento')
+QUEUE_WAIT = histogram('chain_queue_wait_seconds', 'Tempo aguardando vaga para executar o chain')
+EXECUTION_LATENCY = histogram('chain_execution_seconds', 'Duração da execução do chain')
+REJECTED = counter('chain_rejected_total', 'Execuções recusadas por fila cheia')
+
+
+class ExecutorQueueFull(Exception):
+    """A fila de execução atingiu CHAIN_QUEUE_SIZE."""
+
+
+def _has_native_async(chain):
+    """Verifica se o chain sobrescreve ainvoke (senão o padrão do LangChain usa o executor do loop)."""
+    return type(chain).ainvoke is not Runnable.ainvoke
+
+
+class ChainExecutor:
+    """
+    Executa chains e chamadas bloqueantes sem travar o event loop.
+    Limita a concorrência por instância (tenant) e o total de execuções pendentes.
+    """
+
+    def __init__(self, max_workers, tenant_concurrency, max_queue, mode='auto'):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chain')
+        self._tenant_concurrency = tenant_concurrency
+        self._tenant_limits = {}
+        self._max_queue = max_queue
+        self._mode = mode
+        self._pending = defaultdict(int)
+
+    def _limit_for(self, tenant):
+        # Semáforos são criados sob demanda para ficarem ligados ao loop em execução
+        if tenant not in self._tenant_limits:
+            self._tenant_limits[tenant] = asyncio.Semaphore(self._tenant_concurrency)
+        return self._tenant_limits[tenant]
+
+    def pending(self, tenant=None):
+        if tenant is None:
+            return sum(self._pending.values())
+        return self._pending[tenant]
+
+    @asynccontextmanager
+    async def _slot(self, tenant):
+        """Reserva uma vaga de execução do tenant (ou recusa se a fila estiver cheia)."""
+        if self.pending() >= self._max_queue:
+            REJECTED.inc(tenant=tenant)
+            raise ExecutorQueueFull(f'Fila de execução cheia ({self._max_queue})')
+
+        self._pending[tenant] += 1
+        QUEUE_DEPTH.set(self._pending[tenant], tenant=tenant)
+        enqueued_at = time.perf_counter()
+        try:
+            async with self._limit_for(tenant):
+                started_at = time.perf_counter()
+                QUEUE_WAIT.observe(started_at - enqueued_at, tenant=tenant)
+                try:
+                    yield
+                finally:
+                    EXECUTION_LATENCY.observe(time.perf_counter() - started_at, tenant=tenant)
+        finally:
+            self._pending[tenant] -= 1
+            QUEUE_DEPTH.set(self._pending[tenant], tenant=tenant)
+
+    async def _run(self, tenant, call):
+        async with self._slot(tenant):
+            return await call()
+
+    async def stream(self, chain, input, config=None, tenant='default'):
+        """Itera o astream do chain ocupando uma vaga durante toda a geração."""
+        async with self._slot(tenant):
+            async for chunk in chain.astream(input, config=config):
+                yield chunk
+
+    async def invoke(self, chain, input, config=None, tenant='default'):
+        """Invoca o chain com ainvoke nativo quando disponível, senão no pool de threads."""
+        if self._mode == 'auto' and _has_native_async(chain):
+            return await self._run(tenant, lambda: chain.ainvoke(input, config=config))
+        return await self.run_blocking(chain.invoke, input, config=config, tenant=tenant)
+
+    async def run_blocking(self, func, *args, tenant='default', **kwargs):
+        """Executa uma função síncrona (I/O bloqueante) no pool de threads."""
+        loop = asyncio.get_running_loop()
+        return await self._run(
+            tenant,
+            lambda: loop.run_in_executor(self._pool, partial(func, *args, **kwargs)),
+        )
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+chain_executor = ChainExecutor(
+    max_workers=CHAIN_THREAD_POOL_SIZE,
+    tenant_concurrency=CHAIN_TENANT_CONCURRENCY,
+    max_queue=CHAIN_QUEUE_SIZE,
+    mode=CHAIN_EXECUTION_MODE,
+)
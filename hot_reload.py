@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+
+from config import RELOAD_WATCH_INTERVAL
+from tenants import docs_dir_for, list_instances, prompt_paths
+
+logger = logging.getLogger(__name__)
+
+# Variáveis do .env com os prompts da instância padrão
+DEFAULT_PROMPT_VARS = ('AI_CONTEXTUALIZE_PROMPT_FILE', 'AI_SYSTEM_PROMPT_FILE')
+
+
+def default_prompt_paths():
+    return tuple(os.environ.get(name) for name in DEFAULT_PROMPT_VARS)
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def prompts_signature(instance):
+    return tuple((path, _stat(path)) for path in prompt_paths(instance, default_prompt_paths()))
+
+
+def docs_signature(docs_dir):
+    """Arquivos suportados da pasta com data de modificação e tamanho (sem ler o conteúdo)."""
+    if not docs_dir or not os.path.isdir(docs_dir):
+        return ()
+    from ingest import iter_files
+
+    return tuple((path, _stat(path)) for path in iter_files(docs_dir))
+
+
+class ReloadWatcher:
+    """
+    Consulta periodicamente os arquivos de prompt e as pastas de documentos de cada
+    instância e pede ao TenantRegistry a recarga só do que mudou: prompt alterado
+    remonta o chain; documento novo, alterado ou apagado ingere a pasta e remonta.
+    A primeira varredura só registra o estado atual.
+    """
+
+    def __init__(self, registry, interval=RELOAD_WATCH_INTERVAL):
+        self.registry = registry
+        self.interval = interval
+        self._signatures = {}
+        self._task = None
+
+    def _scan(self):
+        return {
+            instance: (prompts_signature(instance), docs_signature(docs_dir_for(instance)))
+            for instance in list_instances()
+        }
+
+    async def check(self):
+        """Uma varredura; devolve as instâncias recarregadas."""
+        signatures = await asyncio.to_thread(self._scan)
+        previous, self._signatures = self._signatures, signatures
+        if not previous:
+            return []
+        reloaded = []
+        for instance, (prompts, docs) in signatures.items():
+            old = previous.get(instance)
+            if old == (prompts, docs):
+                continue
+            # Instância nova em TENANTS_DIR: só ingere; o chain é montado na primeira mensagem
+            ingest = old is None or old[1] != docs
+            logger.info('[RELOAD] %s: %s alterados', instance, 'documentos' if ingest else 'prompts')
+            await self.registry.reload(instance, ingest=ingest)
+            reloaded.append(instance)
+        return reloaded
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.exception('[RELOAD] Erro ao verificar alterações: %s', e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,225 @@
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any
+
+import orjson
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from config import (
+    VECTOR_STORE_PATH,
+    RETRIEVER_MODE,
+    RETRIEVER_K,
+    RETRIEVER_FETCH_K,
+    RETRIEVER_RRF_K,
+    RETRIEVER_RERANK,
+    RETRIEVER_RERANK_MODEL,
+    RETRIEVER_CONTEXT_TOKENS,
+)
+from metrics import counter
+from token_budget import pack_documents
+from tenants import DEFAULT_COLLECTION_NAME
+from vectorstore import get_index_version, collection_name_of
+
+logger = logging.getLogger(__name__)
+
+RETRIEVER_HITS = counter('retriever_results_total', 'Documentos retornados, pela origem que os encontrou')
+
+INDEX_FILENAME = 'bm25_index.json'
+
+# Parâmetros usuais do BM25 (Okapi)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Palavras muito frequentes em português que não ajudam a diferenciar documentos
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'de', 'da', 'do', 'das', 'dos', 'e', 'em', 'na', 'no', 'nas', 'nos',
+    'um', 'uma', 'uns', 'umas', 'para', 'pra', 'por', 'com', 'que', 'se', 'ao', 'aos', 'ou',
+    'qual', 'quais', 'como', 'onde', 'quando', 'eu', 'voce', 'voces', 'me', 'meu', 'minha',
+}
+
+_token = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Minúsculas, sem acentos, sem stopwords; códigos e números ficam como termos próprios."""
+    text = ''.join(c for c in unicodedata.normalize('NFD', text.lower()) if unicodedata.category(c) != 'Mn')
+    return [token for token in _token.findall(text) if token not in STOPWORDS]
+
+
+def _doc_key(doc):
+    return doc.metadata.get('chunk_hash') or doc.id or doc.page_content
+
+
+class BM25Index:
+    """Índice BM25 em memória dos chunks da base, persistido junto da base vetorial."""
+
+    def __init__(self, entries, version='0'):
+        # entries: [{'id', 'text', 'metadata', 'terms': {termo: frequência}}]
+        self.version = version
+        self.docs = [
+            Document(page_content=entry['text'], metadata=entry['metadata'], id=entry['id'])
+            for entry in entries
+        ]
+        self._entries = entries
+        self._lengths = [sum(entry['terms'].values()) for entry in entries]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        self._postings = defaultdict(list)
+        for position, entry in enumerate(entries):
+            for term, frequency in entry['terms'].items():
+                self._postings[term].append((position, frequency))
+        total = len(entries)
+        self._idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, version='0'):
+        stored = vectorstore.get(include=['documents', 'metadatas'])
+        entries = [
+            {'id': cid, 'text': text, 'metadata': meta or {}, 'terms': dict(Counter(tokenize(text)))}
+            for cid, text, meta in zip(stored['ids'], stored['documents'], stored['metadatas'])
+            if text
+        ]
+        return cls(entries, version)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = orjson.loads(f.read())
+        return cls(data['entries'], data['version'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps({'version': self.version, 'entries': self._entries}))
+        os.replace(tmp_path, path)
+
+    def search(self, query, k):
+        """Os k documentos com maior pontuação BM25 para a consulta."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self._postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[position] / (self._avg_length or 1))
+                scores[position] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [self.docs[position] for position, _ in best]
+
+
+def index_path(collection_name=DEFAULT_COLLECTION_NAME):
+    filename = INDEX_FILENAME if collection_name == DEFAULT_COLLECTION_NAME else f'bm25_index.{collection_name}.json'
+    return os.path.join(VECTOR_STORE_PATH or '.', filename)
+
+
+def build_bm25_index(vectorstore):
+    """Reconstrói e grava o índice BM25 da coleção (chamado pela ingestão quando a base muda)."""
+    collection_name = collection_name_of(vectorstore)
+    index = BM25Index.from_vectorstore(vectorstore, get_index_version(collection_name))
+    index.save(index_path(collection_name))
+    return index
+
+
+def load_bm25_index(vectorstore):
+    """Usa o índice gravado se ele for da versão atual da coleção; senão reconstrói."""
+    collection_name = collection_name_of(vectorstore)
+    path = index_path(collection_name)
+    try:
+        index = BM25Index.load(path)
+        if index.version == get_index_version(collection_name):
+            return index
+    except (FileNotFoundError, orjson.JSONDecodeError, KeyError):
+        pass
+    return build_bm25_index(vectorstore)
+
+
+def reciprocal_rank_fusion(rankings, k=RETRIEVER_RRF_K):
+    """Combina listas ordenadas de documentos: cada posição vale 1 / (k + posição)."""
+    scores, docs = defaultdict(float), {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = _doc_key(doc)
+            scores[key] += 1 / (k + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class FlashRankReranker:
+    """Reordenação local (CPU, ONNX) com o FlashRank; opcional: `pip install flashrank`."""
+
+    def __init__(self, model_name=RETRIEVER_RERANK_MODEL):
+        from flashrank import Ranker
+
+        self._ranker = Ranker(model_name=model_name)
+        self._lock = threading.Lock()
+
+    def rerank(self, query, docs):
+        from flashrank import RerankRequest
+
+        passages = [{'id': position, 'text': doc.page_content} for position, doc in enumerate(docs)]
+        with self._lock:
+            ranked = self._ranker.rerank(RerankRequest(query=query, passages=passages))
+        return [docs[item['id']] for item in ranked]
+
+
+def get_reranker():
+    if not RETRIEVER_RERANK:
+        return None
+    try:
+        return FlashRankReranker()
+    except Exception as e:
+        logger.warning('Reranker indisponível, seguindo sem reordenação: %s', e)
+        return None
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Busca vetorial (Chroma) + BM25, combinadas por reciprocal rank fusion.
+    Termos exatos (códigos de curso, preços, nomes de rua) vêm do BM25; sinônimos e
+    paráfrases da busca vetorial. Opcionalmente reordena com um reranker local e
+    limita o resultado a um orçamento de tokens.
+    """
+
+    vectorstore: Any
+    index: Any
+    reranker: Any = None
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+    max_tokens: int = RETRIEVER_CONTEXT_TOKENS
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        vector_docs = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        lexical_docs = self.index.search(query, self.fetch_k)
+        fused = reciprocal_rank_fusion([vector_docs, lexical_docs])
+
+        vector_keys = {_doc_key(doc) for doc in vector_docs}
+        lexical_keys = {_doc_key(doc) for doc in lexical_docs}
+        if self.reranker is not None and fused:
+            fused = self.reranker.rerank(query, fused[:self.fetch_k])
+        docs = pack_documents(fused[:self.k], self.max_tokens)
+
+        for doc in docs:
+            key = _doc_key(doc)
+            source = 'both' if key in vector_keys and key in lexical_keys else 'vector' if key in vector_keys else 'bm25'
+            RETRIEVER_HITS.inc(source=source)
+        return docs
+
+
+def get_retriever(vectorstore):
+    """Recuperador configurado por RETRIEVER_MODE ('hybrid' ou 'vector')."""
+    if RETRIEVER_MODE != 'hybrid':
+        return vectorstore.as_retriever(search_kwargs={'k': RETRIEVER_K})
+    return HybridRetriever(
+        vectorstore=vectorstore,
+        index=load_bm25_index(vectorstore),
+        reranker=get_reranker(),
+    )
@@ -0,0 +1,500 @@
+"""
+Pipeline incremental de ingestão da base de conhecimento.
+
+Cada chunk recebe um id derivado do hash do seu conteúdo, então reprocessar um
+arquivo só embeda os chunks novos e remove os que deixaram de existir.
+O diário (ingest_journal.py) registra o estado de cada arquivo e os vetores já
+calculados, então uma ingestão interrompida retoma de onde parou.
+
+Uso:
+    python ingest.py [--dir RAG_FILES_DIR] [--force] [--prune]
+    python ingest.py --instance NOME  # documentos de TENANTS_DIR/NOME/docs na coleção da instância
+"""
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config import (
+    RAG_FILES_DIR,
+    INGEST_BATCH_SIZE,
+    INGEST_BATCH_MAX_CHARS,
+    INGEST_WORKERS,
+    INGEST_EMBED_CONCURRENCY,
+    INGEST_WRITE_BATCH_SIZE,
+    LOG_LEVEL,
+    check_required_settings,
+)
+from vectorstore import open_vectorstore, bump_index_version, collection_name_of
+from hybrid_retriever import build_bm25_index
+from ingest_journal import IngestJournal
+from tenants import DEFAULT_COLLECTION_NAME, DOCS_DIRNAME, collection_name_for, is_default_instance, tenant_dir
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt')
+
+# Novas tentativas de um lote de embedding que recebeu rate limit (429)
+EMBED_MAX_RETRIES = 5
+EMBED_BACKOFF_BASE_SECONDS = 1.0
+EMBED_BACKOFF_MAX_SECONDS = 60.0
+
+
+def iter_files(root):
+    """Percorre recursivamente os arquivos suportados (inclusive em processed/)."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.endswith(SUPPORTED_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(source, text):
+    return hashlib.sha256(f'{source}\0{text}'.encode('utf-8')).hexdigest()
+
+
+def get_loader(path):
+    return PyPDFLoader(path) if path.endswith('.pdf') else TextLoader(path, encoding='utf-8')
+
+
+def iter_chunks(path, source, splitter):
+    """Carrega o arquivo página a página e gera (id, chunk) sem manter o documento inteiro em memória."""
+    for page in get_loader(path).lazy_load():
+        for chunk in splitter.split_documents([page]):
+            cid = chunk_id(source, chunk.page_content)
+            chunk.metadata['source'] = source
+            chunk.metadata['chunk_hash'] = cid
+            yield cid, chunk
+
+
+def split_file(path, source):
+    """
+    Lê e divide um arquivo em chunks. Roda em um processo do pool (a leitura de PDF usa CPU),
+    por isso devolve tuplas simples (id, texto, metadados) em vez de Documents.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return [(cid, chunk.page_content, chunk.metadata) for cid, chunk in iter_chunks(path, source, splitter)]
+
+
+def _is_rate_limit(error):
+    return getattr(error, 'status_code', None) == 429 or type(error).__name__ == 'RateLimitError'
+
+
+def _retry_after(error):
+    """Retry-After da resposta de rate limit, em segundos (ou None se ausente)."""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return min(float(value), EMBED_BACKOFF_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return None
+
+
+class _EmbeddingWindow:
+    """
+    Limite de lotes de embedding em andamento: cai pela metade a cada rate limit
+    (com pausa de todas as threads) e volta a crescer um lote por vez após sucessos.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max(max_size, 1)
+        self.size = self.max_size
+        self._successes = 0
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self._pause_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            self._successes += 1
+            if self.size < self.max_size and self._successes >= self.size:
+                self.size += 1
+                self._successes = 0
+
+    def on_rate_limit(self, delay):
+        with self._lock:
+            self.size = max(self.size // 2, 1)
+            self._successes = 0
+            self._pause_until = max(self._pause_until, time.monotonic() + delay)
+
+
+class _EmbeddingWriter:
+    """
+    Acumula chunks em lotes limitados por quantidade e tamanho, embeda vários lotes em
+    paralelo (até INGEST_EMBED_CONCURRENCY, menos após rate limit) e grava no Chroma em
+    blocos de INGEST_WRITE_BATCH_SIZE, sem embedar de novo (upsert com os vetores prontos).
+    As gravações acontecem só na thread que chama add/close.
+    """
+
+    def __init__(
+        self,
+        vectorstore,
+        journal,
+        max_items=INGEST_BATCH_SIZE,
+        max_chars=INGEST_BATCH_MAX_CHARS,
+        concurrency=INGEST_EMBED_CONCURRENCY,
+        write_batch=INGEST_WRITE_BATCH_SIZE,
+    ):
+        self.vectorstore = vectorstore
+        self.embeddings = vectorstore.embeddings
+        self.journal = journal
+        self.collection = collection_name_of(vectorstore)
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.write_batch = write_batch
+        self.window = _EmbeddingWindow(concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=self.window.max_size, thread_name_prefix='embed')
+        self._in_flight = {}
+        self.ids, self.docs, self.chars = [], [], 0
+        self._embedded = []
+        self.written = 0
+        self.batches = 0
+        self.resumed = 0
+        self.failed_sources = set()
+
+    def add(self, cid, doc):
+        size = len(doc.page_content)
+        if self.docs and (len(self.docs) >= self.max_items or self.chars + size > self.max_chars):
+            self._submit()
+        self.ids.append(cid)
+        self.docs.append(doc)
+        self.chars += size
+
+    def _embed(self, ids, docs):
+        texts = [doc.page_content for doc in docs]
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            self.window.wait()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if not _is_rate_limit(e) or attempt == EMBED_MAX_RETRIES:
+                    raise
+                delay = _retry_after(e) or min(EMBED_BACKOFF_BASE_SECONDS * 2 ** attempt, EMBED_BACKOFF_MAX_SECONDS)
+                self.window.on_rate_limit(delay)
+                continue
+            self.window.on_success()
+            return ids, docs, vectors
+
+    def _submit(self):
+        if not self.docs:
+            return
+        ids, docs = self.ids, self.docs
+        self.ids, self.docs, self.chars = [], [], 0
+
+        # Vetores calculados por uma execução interrompida vão direto para a gravação
+        resumed = self.journal.pending_vectors(self.collection, ids)
+        if resumed:
+            self._embedded.append((
+                [cid for cid in ids if cid in resumed],
+                [doc for cid, doc in zip(ids, docs) if cid in resumed],
+                [resumed[cid] for cid in ids if cid in resumed],
+            ))
+            self.resumed += len(resumed)
+            docs = [doc for cid, doc in zip(ids, docs) if cid not in resumed]
+            ids = [cid for cid in ids if cid not in resumed]
+
+        if ids:
+            # Janela cheia: espera algum lote terminar (e grava o que já foi embedado)
+            while len(self._in_flight) >= self.window.size:
+                self._collect(FIRST_COMPLETED)
+            self._in_flight[self._pool.submit(self._embed, ids, docs)] = docs
+            self.batches += 1
+        self._collect(None)
+
+    def _collect(self, return_when):
+        if return_when is None:
+            done = {future for future in self._in_flight if future.done()}
+        else:
+            done, _ = wait(self._in_flight, return_when=return_when)
+        for future in done:
+            docs = self._in_flight.pop(future)
+            try:
+                ids, docs, vectors = future.result()
+            except Exception as e:
+                # Os arquivos do lote não são marcados como ingeridos e voltam na próxima execução
+                sources = {doc.metadata.get('source') for doc in docs}
+                self.failed_sources |= sources
+                logger.error('[INGEST] ❌ Erro ao embedar lote de %s: %s', ', '.join(sorted(map(str, sources))), e)
+                continue
+            # Checkpoint: um reinício a partir daqui não paga de novo por este lote
+            self.journal.save_vectors(self.collection, ids, vectors)
+            self._embedded.append((ids, docs, vectors))
+        if sum(len(ids) for ids, _, _ in self._embedded) >= self.write_batch:
+            self._write()
+
+    def _write(self):
+        ids, documents, metadatas, vectors = [], [], [], []
+        for batch_ids, batch_docs, batch_vectors in self._embedded:
+            ids.extend(batch_ids)
+            documents.extend(doc.page_content for doc in batch_docs)
+            metadatas.extend(doc.metadata for doc in batch_docs)
+            vectors.extend(batch_vectors)
+        self._embedded = []
+        if ids:
+            self.vectorstore._collection.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+            self.journal.clear_vectors(self.collection, ids)
+            self.written += len(ids)
+
+    def close(self):
+        """Embeda o que sobrou, espera os lotes em andamento e grava tudo."""
+        self._submit()
+        while self._in_flight:
+            self._collect(FIRST_COMPLETED)
+        self._write()
+        self._pool.shutdown()
+
+
+@dataclass(slots=True)
+class _FilePlan:
+    path: str
+    source: str
+    collection: str
+    file_hash: str
+    existing_ids: list
+    existing_metadatas: list
+    unchanged: bool
+
+
+def plan_file(vectorstore, journal, path, source, force=False):
+    """
+    Chunks já gravados do arquivo e se ele mudou desde a última ingestão. O arquivo só é
+    pulado se o diário registra a versão atual como concluída e todos os chunks dela
+    estão na base; uma ingestão interrompida deixa o arquivo 'pending' e ele é retomado.
+    """
+    collection = collection_name_of(vectorstore)
+    existing = vectorstore.get(where={'source': source}, include=['metadatas'])
+    current_hash = file_hash(path)
+    entry = journal.get_file(collection, source)
+    unchanged = (
+        not force
+        and entry is not None
+        and entry.state == 'done'
+        and entry.file_hash == current_hash
+        and entry.chunk_ids == set(existing['ids'])
+    )
+    return _FilePlan(path, source, collection, current_hash, existing['ids'], existing['metadatas'], unchanged)
+
+
+def add_file_chunks(writer, plan, chunks):
+    """
+    Registra no diário os chunks da versão atual e envia ao writer os que ainda não estão
+    na base; devolve (ids da versão atual, adicionados).
+    """
+    existing_ids = set(plan.existing_ids)
+    current = {}
+    for cid, text, metadata in chunks:
+        current.setdefault(cid, (text, metadata))
+    writer.journal.begin_file(plan.collection, plan.source, plan.file_hash, current)
+
+    added = 0
+    for cid, (text, metadata) in current.items():
+        if cid in existing_ids:
+            continue
+        writer.add(cid, Document(page_content=text, metadata={**metadata, 'file_hash': plan.file_hash}))
+        added += 1
+    return set(current), added
+
+
+def finish_file(vectorstore, journal, plan, seen):
+    """
+    Remove os chunks que não existem mais na nova versão do arquivo e marca os mantidos
+    com o hash atual. Só deve rodar depois que os chunks novos foram gravados.
+    """
+    stale = [cid for cid in plan.existing_ids if cid not in seen]
+    if stale:
+        vectorstore.delete(ids=stale)
+
+    # Marca os chunks mantidos com o hash atual, para o arquivo ser pulado na próxima execução
+    kept = [cid for cid in plan.existing_ids if cid in seen]
+    if kept:
+        metadatas = [
+            {**(meta or {}), 'file_hash': plan.file_hash}
+            for cid, meta in zip(plan.existing_ids, plan.existing_metadatas)
+            if cid in seen
+        ]
+        vectorstore._collection.update(ids=kept, metadatas=metadatas)
+    journal.finish_file(plan.collection, plan.source)
+    return len(kept), len(stale)
+
+
+def _split_files(plans, workers):
+    """
+    Gera (plano, chunks) na ordem em que os arquivos terminam de ser lidos; chunks é a
+    exceção se a leitura falhou. Com mais de um worker, a leitura e a divisão rodam em
+    processos separados, com no máximo 2 arquivos por worker à frente do embedding.
+    """
+    if workers <= 1 or len(plans) < 2:
+        for plan in plans:
+            try:
+                yield plan, split_file(plan.path, plan.source)
+            except Exception as e:
+                yield plan, e
+        return
+
+    remaining = iter(plans)
+    pending = {}
+    # spawn: o processo da API tem threads (event loop, pools) e fork com threads pode travar
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(workers, len(plans)), mp_context=context) as pool:
+        def submit_next():
+            plan = next(remaining, None)
+            if plan is not None:
+                pending[pool.submit(split_file, plan.path, plan.source)] = plan
+
+        for _ in range(workers * 2):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                plan = pending.pop(future)
+                submit_next()
+                try:
+                    yield plan, future.result()
+                except Exception as e:
+                    yield plan, e
+
+
+def prune(vectorstore, sources):
+    """Remove chunks de arquivos que não existem mais e chunks antigos sem hash de conteúdo."""
+    stored = vectorstore.get(include=['metadatas'])
+    orphan_ids = [
+        cid
+        for cid, meta in zip(stored['ids'], stored['metadatas'])
+        if not meta or 'chunk_hash' not in meta or meta.get('source') not in sources
+    ]
+    if orphan_ids:
+        vectorstore.delete(ids=orphan_ids)
+    return len(orphan_ids)
+
+
+def _ingest_files(vectorstore, journal, root, force, remove_missing, workers):
+    totals = {'files': 0, 'changed': 0, 'added': 0, 'kept': 0, 'removed': 0, 'resumed': 0}
+    sources = set()
+    plans = []
+    for path in iter_files(root):
+        source = os.path.relpath(path, root)
+        sources.add(source)
+        try:
+            plan = plan_file(vectorstore, journal, path, source, force=force)
+        except Exception as e:
+            logger.error('[INGEST] ❌ Erro ao ingerir %s: %s', source, e)
+            continue
+        totals['files'] += 1
+        if plan.unchanged:
+            totals['kept'] += len(plan.existing_ids)
+        else:
+            plans.append(plan)
+
+    # Leitura em processos, embedding em lotes paralelos e gravação em blocos, em fluxo contínuo
+    writer = _EmbeddingWriter(vectorstore, journal)
+    results = []
+    try:
+        for plan, chunks in _split_files(plans, workers or os.cpu_count() or 1):
+            if isinstance(chunks, Exception):
+                logger.error('[INGEST] ❌ Erro ao ingerir %s: %s', plan.source, chunks)
+                continue
+            seen, added = add_file_chunks(writer, plan, chunks)
+            results.append((plan, seen, added))
+    finally:
+        writer.close()
+    totals['resumed'] = writer.resumed
+
+    # Só marca os arquivos como ingeridos depois que todos os chunks novos foram gravados
+    for plan, seen, added in results:
+        if plan.source in writer.failed_sources:
+            continue
+        kept, removed = finish_file(vectorstore, journal, plan, seen)
+        totals['changed'] += 1
+        totals['added'] += added
+        totals['kept'] += kept
+        totals['removed'] += removed
+        logger.info('[INGEST] %s: +%d / =%d / -%d chunks', plan.source, added, kept, removed)
+
+    if remove_missing:
+        totals['removed'] += prune(vectorstore, sources)
+        journal.remove_missing(collection_name_of(vectorstore), sources)
+    return totals
+
+
+def ingest_directory(vectorstore, root=RAG_FILES_DIR, force=False, remove_missing=False, workers=INGEST_WORKERS):
+    if not root or not os.path.isdir(root):
+        logger.warning('[INGEST] Diretório de documentos não encontrado: %s', root)
+        return {}
+
+    started_at = time.perf_counter()
+    journal = IngestJournal()
+    try:
+        totals = _ingest_files(vectorstore, journal, root, force, remove_missing, workers)
+    finally:
+        journal.close()
+
+    # Sinaliza aos caches de respostas que a base mudou e refaz o índice BM25
+    if totals['added'] or totals['removed']:
+        bump_index_version(collection_name_of(vectorstore))
+        build_bm25_index(vectorstore)
+
+    logger.info(
+        '[INGEST] ✅ %d arquivos (%d alterados), %d chunks adicionados (%d retomados do diário), %d removidos em %.1fs',
+        totals['files'], totals['changed'], totals['added'], totals['resumed'], totals['removed'],
+        time.perf_counter() - started_at,
+    )
+    return totals
+
+
+def ingest_tenant(tenant, force=False, remove_missing=False):
+    """Sincroniza os documentos da instância com a coleção dela."""
+    if not tenant.docs_dir:
+        return {}
+    return ingest_directory(
+        open_vectorstore(tenant.collection_name),
+        root=tenant.docs_dir,
+        force=force,
+        remove_missing=remove_missing,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingestão incremental da base de conhecimento.')
+    parser.add_argument('--dir', default=RAG_FILES_DIR, help='Diretório com os PDFs/TXTs')
+    parser.add_argument('--force', action='store_true', help='Reprocessa arquivos mesmo sem alteração')
+    parser.add_argument('--prune', action='store_true', help='Remove chunks de arquivos apagados')
+    parser.add_argument('--instance', help='Instância configurada em TENANTS_DIR (padrão: EVOLUTION_INSTANCE_NAME)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    check_required_settings()
+    root, collection_name = args.dir, DEFAULT_COLLECTION_NAME
+    if args.instance and not is_default_instance(args.instance):
+        directory = tenant_dir(args.instance)
+        if directory is None:
+            parser.error(f'instância não encontrada em TENANTS_DIR: {args.instance}')
+        root = os.path.join(directory, DOCS_DIRNAME)
+        collection_name = collection_name_for(args.instance)
+    ingest_directory(open_vectorstore(collection_name), root=root, force=args.force, remove_missing=args.prune)
+
+
+if __name__ == '__main__':
+    main()
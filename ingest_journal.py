@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+
+from config import INGEST_JOURNAL_PATH
+from embedding_cache import decode_vector, encode_vector
+
+# SQLite limita a quantidade de parâmetros por consulta
+PARAMS_PER_QUERY = 500
+
+
+@dataclass(slots=True, frozen=True)
+class JournalEntry:
+    file_hash: str
+    state: str
+    chunk_ids: frozenset
+
+
+class IngestJournal:
+    """
+    Manifesto da ingestão em SQLite, por coleção: arquivo → hash → ids dos chunks → estado.
+    - 'pending': a versão atual do arquivo começou a ser ingerida e ainda não terminou
+    - 'done': todos os chunks da versão atual estão na base vetorial
+    Vetores já calculados e ainda não gravados no Chroma ficam em pending_vectors, então
+    uma ingestão interrompida retoma sem pagar de novo pelos embeddings.
+    """
+
+    def __init__(self, path=INGEST_JOURNAL_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Ingestões de instâncias diferentes podem rodar em paralelo com conexões próprias
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' collection TEXT NOT NULL, source TEXT NOT NULL, file_hash TEXT NOT NULL,'
+            ' state TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (collection, source));'
+            'CREATE TABLE IF NOT EXISTS file_chunks ('
+            ' collection TEXT NOT NULL, source TEXT NOT NULL, chunk_id TEXT NOT NULL,'
+            ' PRIMARY KEY (collection, source, chunk_id));'
+            'CREATE TABLE IF NOT EXISTS pending_vectors ('
+            ' collection TEXT NOT NULL, chunk_id TEXT NOT NULL, vector BLOB NOT NULL,'
+            ' PRIMARY KEY (collection, chunk_id));'
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def get_file(self, collection, source):
+        row = self._conn.execute(
+            'SELECT file_hash, state FROM files WHERE collection = ? AND source = ?', (collection, source)
+        ).fetchone()
+        if row is None:
+            return None
+        chunk_ids = self._conn.execute(
+            'SELECT chunk_id FROM file_chunks WHERE collection = ? AND source = ?', (collection, source)
+        ).fetchall()
+        return JournalEntry(row[0], row[1], frozenset(chunk_id for (chunk_id,) in chunk_ids))
+
+    def begin_file(self, collection, source, file_hash, chunk_ids):
+        """Registra a versão do arquivo que está sendo ingerida e os chunks que ela deve ter."""
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (collection, source, file_hash, state, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (collection, source, file_hash, 'pending', time.time()),
+            )
+            self._conn.execute('DELETE FROM file_chunks WHERE collection = ? AND source = ?', (collection, source))
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO file_chunks (collection, source, chunk_id) VALUES (?, ?, ?)',
+                [(collection, source, chunk_id) for chunk_id in chunk_ids],
+            )
+
+    def finish_file(self, collection, source):
+        """Marca o arquivo como ingerido e descarta vetores pendentes que sobraram dele."""
+        with self._conn:
+            self._conn.execute(
+                'UPDATE files SET state = ?, updated_at = ? WHERE collection = ? AND source = ?',
+                ('done', time.time(), collection, source),
+            )
+            self._conn.execute(
+                'DELETE FROM pending_vectors WHERE collection = ? AND chunk_id IN ('
+                ' SELECT chunk_id FROM file_chunks WHERE collection = ? AND source = ?)',
+                (collection, collection, source),
+            )
+
+    def save_vectors(self, collection, ids, vectors):
+        """Checkpoint de um lote embedado, antes de ele ser gravado no Chroma."""
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO pending_vectors (collection, chunk_id, vector) VALUES (?, ?, ?)',
+                [(collection, chunk_id, encode_vector(vector)) for chunk_id, vector in zip(ids, vectors)],
+            )
+
+    def pending_vectors(self, collection, ids):
+        """Vetores de uma execução anterior interrompida, por id de chunk."""
+        found = {}
+        for start in range(0, len(ids), PARAMS_PER_QUERY):
+            part = ids[start:start + PARAMS_PER_QUERY]
+            placeholders = ','.join('?' * len(part))
+            rows = self._conn.execute(
+                f'SELECT chunk_id, vector FROM pending_vectors WHERE collection = ? AND chunk_id IN ({placeholders})',
+                [collection, *part],
+            ).fetchall()
+            found.update((chunk_id, decode_vector(blob)) for chunk_id, blob in rows)
+        return found
+
+    def clear_vectors(self, collection, ids):
+        """Os chunks foram gravados no Chroma; os vetores pendentes não são mais necessários."""
+        with self._conn:
+            self._conn.executemany(
+                'DELETE FROM pending_vectors WHERE collection = ? AND chunk_id = ?',
+                [(collection, chunk_id) for chunk_id in ids],
+            )
+
+    def remove_missing(self, collection, sources):
+        """Esquece os arquivos que não existem mais na pasta."""
+        known = self._conn.execute('SELECT source FROM files WHERE collection = ?', (collection,)).fetchall()
+        missing = [source for (source,) in known if source not in sources]
+        with self._conn:
+            for source in missing:
+                self._conn.execute(
+                    'DELETE FROM pending_vectors WHERE collection = ? AND chunk_id IN ('
+                    ' SELECT chunk_id FROM file_chunks WHERE collection = ? AND source = ?)',
+                    (collection, collection, source),
+                )
+                self._conn.execute('DELETE FROM file_chunks WHERE collection = ? AND source = ?', (collection, source))
+                self._conn.execute('DELETE FROM files WHERE collection = ? AND source = ?', (collection, source))
+        return len(missing)
@@ -1,61 +1,222 @@
+import asyncio
+import logging
+import secrets
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
-from message_buffer import buffer_message
-from env_loader import load_env_with_file_contents
-from chains import get_conversational_rag_chain
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-app = FastAPI()
+from config import (
+    LOG_LEVEL,
+    METRICS_ENABLED,
+    INGEST_ON_STARTUP,
+    STARTUP_BUILD_ATTEMPTS,
+    STARTUP_RETRY_SECONDS,
+    EVOLUTION_INSTANCE_NAME,
+    ADMIN_API_KEY,
+    check_required_settings,
+)
+from metrics import gauge, render_prometheus
+from webhook_ingress import webhook_ingress
+from tenants import TenantRegistry, conversation_key, is_known_instance, list_instances
 
-# Carrega variáveis do .env e conteúdos de arquivos
-env = load_env_with_file_contents()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
-contextualize_prompt_text = env.get("AI_CONTEXTUALIZE_PROMPT_FILE")
-system_prompt_text = env.get("AI_SYSTEM_PROMPT_FILE")
+STARTUP_SECONDS = gauge('startup_seconds', 'Tempo de montagem do chain na inicialização')
 
-# Cria o chain conversacional
-conversational_rag_chain = get_conversational_rag_chain(
-    contextualize_prompt_text, 
-    system_prompt_text
-)
 
+class Pipeline:
+    """
+    Estado da montagem do chain em segundo plano. Os módulos pesados (LangChain, Chroma,
+    OpenAI, Google) só são importados aqui, depois que a API já está aceitando conexões.
+    """
 
-@app.post('/webhook')
-async def webhook(request: Request):
-    try:
-        data = await request.json()
-        
-        # Extração segura dos dados
-        event_type = data.get('event')
-        data_obj = data.get('data', {})
-        
-        # Verificar se a mensagem é do próprio bot (fromMe)
-        key_data = data_obj.get('key', {})
-        from_me = key_data.get('fromMe', False)
-        
-        chat_id = key_data.get('remoteJid')
-        
-        # Tentar extrair mensagem de diferentes locais
-        message_data = data_obj.get('message', {})
-        message = (
-            message_data.get('conversation') or 
-            message_data.get('extendedTextMessage', {}).get('text') or
-            message_data.get('imageMessage', {}).get('caption') or
-            None
+    def __init__(self):
+        self.tenants = None
+        self.watcher = None
+        self.error = None
+        self.status = 'starting'
+        self.ready = asyncio.Event()
+        self._task = None
+        self._background = set()
+
+    @staticmethod
+    def _default_prompts():
+        from env_loader import load_env_with_file_contents
+
+        # Carrega variáveis do .env e conteúdos de arquivos; são os prompts da instância padrão.
+        # Lido de novo a cada montagem, para uma recarga pegar o texto atual dos arquivos
+        env = load_env_with_file_contents()
+        return env.get("AI_CONTEXTUALIZE_PROMPT_FILE"), env.get("AI_SYSTEM_PROMPT_FILE")
+
+    async def _build_once(self):
+        check_required_settings()
+        tenants = TenantRegistry(self._default_prompts)
+        # Importa e monta o chain fora do event loop: /health e /webhook seguem respondendo.
+        # As demais instâncias são montadas na primeira mensagem de cada uma
+        await tenants.get_chain(EVOLUTION_INSTANCE_NAME)
+        from hot_reload import ReloadWatcher
+
+        self.tenants = tenants
+        self.watcher = ReloadWatcher(tenants)
+
+    async def _build(self):
+        started_at = time.perf_counter()
+        attempts = max(STARTUP_BUILD_ATTEMPTS, 1)
+        for attempt in range(1, attempts + 1):
+            try:
+                await self._build_once()
+                break
+            except Exception as e:
+                logger.exception('Erro ao montar o chain (tentativa %d de %d): %s', attempt, attempts, e)
+                self.error = str(e)
+            if attempt == attempts:
+                # Libera as mensagens que aguardam na fila: handle_message as descarta
+                self.status = 'error'
+                self.ready.set()
+                return
+            self.status = 'retrying'
+            await asyncio.sleep(STARTUP_RETRY_SECONDS * 2 ** (attempt - 1))
+        from message_buffer import start_debounce_worker
+
+        start_debounce_worker(self.tenants.get_chain)
+        self.status, self.error = 'ready', None
+        self.ready.set()
+        STARTUP_SECONDS.set(time.perf_counter() - started_at)
+        logger.info('Chain pronto em %.1fs', time.perf_counter() - started_at)
+
+        if INGEST_ON_STARTUP == 'background':
+            self.run_in_background(self._ingest())
+        self.watcher.start()
+
+    async def _ingest(self):
+        # Ingere cada instância e troca o chain das já carregadas pela versão com a base atualizada
+        for instance in await asyncio.to_thread(list_instances):
+            await self.tenants.reload(instance, ingest=True, prune=False)
+
+    def run_in_background(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def start(self):
+        self._task = asyncio.create_task(self._build())
+
+    async def handle_message(self, message):
+        """
+        Entrega a mensagem ao buffer da instância que a recebeu; enquanto o chain monta,
+        as mensagens esperam na fila. O chain da instância só é montado na hora de responder.
+        Se a montagem falhou em todas as tentativas, as mensagens são descartadas.
+        """
+        await self.ready.wait()
+        if self.status != 'ready':
+            logger.error('Mensagem descartada, o chain não foi montado: %s', message.chat_id)
+            return
+        if not is_known_instance(message.instance):
+            logger.warning('Mensagem de instância desconhecida descartada: %s', message.instance)
+            return
+        from message_buffer import buffer_message
+
+        await buffer_message(
+            chat_id=conversation_key(message.instance, message.chat_id),
+            message=message.text,
+            get_chain=self.tenants.get_chain,
         )
 
-        # Ignorar mensagens do próprio bot
-        if from_me:
-            return {'status': 'ok'}
-
-        if chat_id and message and not '@g.us' in chat_id:            
-            await buffer_message(
-                chat_id=chat_id,
-                message=message,
-                conversational_rag_chain=conversational_rag_chain,
-            )
-        
-        return {'status': 'ok'}
-    except Exception as e:
-        print(f"Erro ao processar webhook: {e}")
-        import traceback
-        traceback.print_exc()
-        return {'status': 'error', 'message': str(e)}
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        for task in list(self._background):
+            task.cancel()
+        if self.status != 'ready':
+            return
+        await self.watcher.stop()
+        from message_buffer import stop_debounce_worker
+        from executor import chain_executor
+        from evolution_api import close_client
+
+        await stop_debounce_worker()
+        chain_executor.shutdown()
+        await close_client()
+
+
+pipeline = None
+
+
+async def startup():
+    global pipeline
+    pipeline = Pipeline()
+    pipeline.start()
+    # A fila aceita webhooks desde já; a entrega ao buffer aguarda o chain ficar pronto
+    webhook_ingress.start(pipeline.handle_message)
+
+
+async def shutdown():
+    from redis_pool import close_pools
+
+    await webhook_ingress.stop()
+    await pipeline.stop()
+    await close_pools()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await startup()
+    yield
+    await shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get('/health')
+async def health():
+    """Liveness: o processo está de pé e o event loop responde."""
+    return {'status': 'ok'}
+
+
+@app.get('/ready')
+async def ready():
+    """Readiness: o chain foi montado e as mensagens estão sendo processadas."""
+    if pipeline is not None and pipeline.status == 'ready':
+        return {'status': 'ready'}
+    status = pipeline.status if pipeline is not None else 'starting'
+    body = {'status': status}
+    if pipeline is not None and pipeline.error:
+        body['error'] = pipeline.error
+    return JSONResponse(body, status_code=503)
+
+
+if METRICS_ENABLED:
+    @app.get('/metrics')
+    async def metrics():
+        return PlainTextResponse(render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+if ADMIN_API_KEY:
+    @app.post('/admin/reload')
+    async def admin_reload(request: Request, instance: str | None = None, ingest: bool = False):
+        """
+        Recarrega os prompts (e, com ingest=true, a base de conhecimento) de uma instância
+        em segundo plano. Turnos em andamento terminam com a versão anterior.
+        """
+        if not secrets.compare_digest(request.headers.get('apikey', ''), ADMIN_API_KEY):
+            return JSONResponse({'status': 'unauthorized'}, status_code=401)
+        if pipeline is None or pipeline.status != 'ready':
+            return JSONResponse({'status': pipeline.status if pipeline is not None else 'starting'}, status_code=503)
+        if not is_known_instance(instance):
+            return JSONResponse({'status': 'unknown_instance'}, status_code=404)
+        pipeline.run_in_background(pipeline.tenants.reload(instance, ingest=ingest))
+        return JSONResponse({'status': 'reloading'}, status_code=202)
+
+
+@app.post('/webhook')
+async def webhook(request: Request):
+    # Responde sem esperar o Redis: a mensagem segue para o buffer em segundo plano
+    result = webhook_ingress.accept(await request.body())
+    if result in ('queue_full', 'not_started'):
+        return JSONResponse({'status': 'busy'}, status_code=503)
+    return {'status': 'ok'}
@@ -1,34 +1,114 @@
-from config import REDIS_URL
-from langchain_community.chat_message_histories import RedisChatMessageHistory
-import redis.asyncio as redis
+import orjson
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import message_to_dict, messages_from_dict
+
+from metrics import span
+from redis_pool import get_redis, get_sync_redis
+
+# Mesmo prefixo do RedisChatMessageHistory, para reaproveitar históricos já gravados
+KEY_PREFIX = 'message_store:'
+
+
+def encode_message(message):
+    """Serializa de forma compacta; só guarda o formato completo quando há campos além do texto."""
+    extra = {key: value for key, value in message.additional_kwargs.items() if value}
+    if extra or getattr(message, 'tool_calls', None) or message.name or not isinstance(message.content, str):
+        return orjson.dumps({'m': message_to_dict(message)})
+    return orjson.dumps({'t': message.type, 'c': message.content})
+
+
+def decode_message(raw):
+    data = orjson.loads(raw)
+    if 't' in data:
+        return messages_from_dict([{'type': data['t'], 'data': {'content': data['c']}}])[0]
+    if 'm' in data:
+        return messages_from_dict([data['m']])[0]
+    # Formato do RedisChatMessageHistory do LangChain
+    return messages_from_dict([data])[0]
+
+
+class BoundedRedisChatMessageHistory(BaseChatMessageHistory):
+    """
+    Histórico em lista do Redis limitado às últimas 'max_messages' mensagens.
+    Cada escrita é um único pipeline LPUSH + LTRIM + EXPIRE e cada leitura um único LRANGE,
+    então o custo por turno é constante, independente do tamanho da conversa.
+    """
+
+    def __init__(self, session_id, max_messages=10, ttl=7200):
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.key = f'{KEY_PREFIX}{session_id}'
+
+    @staticmethod
+    def _sync_client():
+        return get_sync_redis()
+
+    @staticmethod
+    def _async_client():
+        return get_redis()
+
+    def _decode(self, raw_messages):
+        # LPUSH guarda da mais nova para a mais antiga
+        return [decode_message(raw) for raw in reversed(raw_messages)]
+
+    def _write(self, pipe, messages):
+        pipe.lpush(self.key, *[encode_message(message) for message in messages])
+        pipe.ltrim(self.key, 0, self.max_messages - 1)
+        pipe.expire(self.key, self.ttl)
+
+    @property
+    def messages(self):
+        with span('history_load'):
+            return self._decode(self._sync_client().lrange(self.key, 0, self.max_messages - 1))
+
+    def add_messages(self, messages):
+        if not messages:
+            return
+        with self._sync_client().pipeline(transaction=True) as pipe:
+            self._write(pipe, messages)
+            pipe.execute()
+
+    def clear(self):
+        self._sync_client().delete(self.key)
+
+    async def aget_messages(self):
+        with span('history_load'):
+            return self._decode(await self._async_client().lrange(self.key, 0, self.max_messages - 1))
+
+    async def aadd_messages(self, messages):
+        if not messages:
+            return
+        async with self._async_client().pipeline(transaction=True) as pipe:
+            self._write(pipe, messages)
+            await pipe.execute()
+
+    async def aclear(self):
+        await self._async_client().delete(self.key)
+
 
 def get_session_history(session_id, max_messages=10):
     """
     Retorna o histórico da sessão com limite de mensagens.
     Mantém apenas as últimas 'max_messages' mensagens para evitar confusão de contexto.
     """
-    history = RedisChatMessageHistory(
+    return BoundedRedisChatMessageHistory(
         session_id=session_id,
-        url=REDIS_URL,
+        max_messages=max_messages,
         ttl=7200,  # TTL de 2 horas (7200 segundos) - após isso, histórico expira
     )
-    
-    # Limita o histórico às últimas N mensagens
-    messages = history.messages
-    if len(messages) > max_messages:
-        # Mantém apenas as últimas max_messages mensagens
-        messages_to_keep = messages[-max_messages:]
-        # Limpa o histórico e readiciona apenas as mensagens recentes
-        history.clear()
-        for msg in messages_to_keep:
-            history.add_message(msg)
-    
-    return history
+
 
 async def clear_session_history(session_id):
     """Limpa completamente o histórico de uma sessão específica"""
-    redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    redis_client = get_redis()
     pattern = f"evolution:{session_id}*"
-    keys = await redis_client.keys(pattern)
-    if keys:
-        await redis_client.delete(*keys)
\ No newline at end of file
+    # SCAN em lotes em vez de KEYS, que bloqueia o Redis compartilhado
+    batch = []
+    async for key in redis_client.scan_iter(match=pattern, count=500):
+        batch.append(key)
+        if len(batch) >= 500:
+            await redis_client.unlink(*batch)
+            batch = []
+    if batch:
+        await redis_client.unlink(*batch)
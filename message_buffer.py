@@ -1,11 +1,25 @@
 import asyncio
-import redis.asyncio as redis
+import logging
 import os
+import time
 
 from collections import defaultdict
 
-from config import REDIS_URL, BUFFER_KEY_SUFIX, DEBOUNCE_SECONDS, BUFFER_TTL
+from config import REDIS_URL, REPLY_STREAMING, TURN_SHED_MESSAGE
 from evolution_api import send_whatsapp_message
+from executor import chain_executor
+from redis_pool import get_redis
+from debounce_scheduler import DebounceScheduler
+from debounce_policy import debounce_policy, observe_debounce_wait
+from metrics import span
+from reply_stream import stream_reply, supports_streaming
+from tracing import pipeline_tracer
+from turn_scheduler import turn_scheduler
+from tenants import split_conversation_key
+
+logger = logging.getLogger(__name__)
+
+ERROR_REPLY = "Desculpe, houve um erro ao processar sua mensagem."
 
 # Modo de desenvolvimento - se não conseguir conectar ao Redis, usa modo local
 DEVELOPMENT_MODE = os.getenv('DEVELOPMENT_MODE', 'false').lower() == 'true'
@@ -14,7 +28,7 @@ USE_REDIS = True
 # Tenta conectar ao Redis, se falhar, usa modo local
 try:
     if REDIS_URL and not DEVELOPMENT_MODE:
-        redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        redis_client = get_redis()
         USE_REDIS = True
     else:
         USE_REDIS = False
@@ -23,122 +37,147 @@ except Exception as e:
     USE_REDIS = False
     redis_client = None
 
+# Agenda de debounce distribuída (Redis): qualquer worker/réplica pode processar os chats vencidos
+scheduler = DebounceScheduler(redis_client) if USE_REDIS and redis_client else None
+
 # Buffer local para desenvolvimento
 local_buffer = defaultdict(list)
+local_stats = defaultdict(dict)
 debounce_tasks = defaultdict(asyncio.Task)
 
-async def buffer_message(chat_id: str, message: str, conversational_rag_chain):
+
+def start_debounce_worker(get_chain):
+    """
+    Inicia o worker que processa os chats vencidos na agenda do Redis.
+    get_chain(instância) devolve o chain da instância dona do chat.
+    """
+    if scheduler:
+        scheduler.start(lambda key, messages: process_turn(key, messages, get_chain))
+
+
+async def stop_debounce_worker():
+    if scheduler:
+        await scheduler.stop()
+
+
+async def buffer_message(chat_id: str, message: str, get_chain):
+    """
+    Adiciona a mensagem ao buffer do chat. chat_id é a chave da conversa
+    (tenants.conversation_key), que identifica também a instância.
+    """
     global USE_REDIS
-    buffer_key = f'{chat_id}{BUFFER_KEY_SUFIX}'
-    
-    print(f"\n{'='*60}")
-    print(f"[BUFFER] Nova mensagem recebida: '{message}'")
-    print(f"[BUFFER] Chat ID: {chat_id}")
-    print(f"[BUFFER] Modo Redis: {USE_REDIS}")
-
-    if USE_REDIS and redis_client:
+
+    logger.debug("[BUFFER] Nova mensagem recebida de %s (Redis: %s): %r", chat_id, USE_REDIS, message)
+
+    if USE_REDIS and scheduler:
         try:
-            # Primeiro verifica quantas mensagens já existem
-            current_count = await redis_client.llen(buffer_key)
-            print(f"[BUFFER] Mensagens existentes no Redis antes de adicionar: {current_count}")
-            
-            await redis_client.rpush(buffer_key, message)
-            await redis_client.expire(buffer_key, BUFFER_TTL)
-            
-            new_count = await redis_client.llen(buffer_key)
-            print(f"[BUFFER] ✅ Mensagem adicionada ao Redis. Total agora: {new_count}")
+            # RPUSH + estatísticas + ZADD na agenda em um único round-trip
+            with span('buffer_push', backend='redis'):
+                new_count, delay = await scheduler.schedule(chat_id, message)
+            logger.debug("[BUFFER] ✅ %s: %d mensagens no Redis, processamento em %.1fs", chat_id, new_count, delay)
+            return
         except Exception as e:
-            print(f"[BUFFER] ❌ Erro ao adicionar ao Redis: {e}. Mudando para buffer local.")
+            logger.warning("[BUFFER] ❌ Erro ao adicionar ao Redis: %s. Mudando para buffer local.", e)
             USE_REDIS = False
-            # Adiciona ao buffer local
-            local_buffer[chat_id].append(message)
-            print(f"[BUFFER] Total no buffer local: {len(local_buffer[chat_id])}")
-    else:
-        # Modo local
-        print(f"[BUFFER] Mensagens no buffer local antes: {len(local_buffer[chat_id])}")
+
+    # Modo local
+    with span('buffer_push', backend='local'):
         local_buffer[chat_id].append(message)
-        print(f"[BUFFER] ✅ Mensagem adicionada ao buffer local. Total agora: {len(local_buffer[chat_id])}")
-        print(f"[BUFFER] Conteúdo do buffer local: {local_buffer[chat_id]}")
+        delay = max(debounce_policy.next_due(local_stats[chat_id], message) - time.time(), 0)
+        if debounce_tasks.get(chat_id):
+            debounce_tasks[chat_id].cancel()
+        debounce_tasks[chat_id] = asyncio.create_task(handle_debounce(chat_id, get_chain, delay))
+    logger.debug("[BUFFER] ✅ %s: %d mensagens no buffer local, processamento em %.1fs", chat_id, len(local_buffer[chat_id]), delay)
 
-    if debounce_tasks.get(chat_id):
-        print(f"[BUFFER] ⏱️ Cancelando task anterior e reiniciando debounce de {DEBOUNCE_SECONDS}s")
-        debounce_tasks[chat_id].cancel()
-    else:
-        print(f"[BUFFER] 🆕 Primeira mensagem - criando nova task de debounce de {DEBOUNCE_SECONDS}s")
 
-    debounce_tasks[chat_id] = asyncio.create_task(handle_debounce(chat_id, conversational_rag_chain))
-    print(f"{'='*60}\n")
+async def handle_debounce(chat_id: str, get_chain, delay: float):
+    """Debounce em memória, usado quando o Redis não está disponível."""
+    try:
+        await asyncio.sleep(delay)
 
+        messages = local_buffer[chat_id].copy()
+        local_buffer[chat_id].clear()
+        debounce_tasks.pop(chat_id, None)
+        burst_start = local_stats[chat_id].pop('burst', None)
+        if burst_start:
+            observe_debounce_wait(time.time() - burst_start)
 
-async def handle_debounce(chat_id: str, conversational_rag_chain):
-    try:
-        print(f"\n[DEBOUNCE] 💤 Aguardando {DEBOUNCE_SECONDS}s antes de processar...")
-        await asyncio.sleep(float(DEBOUNCE_SECONDS))
-        
-        print(f"\n{'='*60}")
-        print(f"[DEBOUNCE] ⏰ Tempo de espera terminou! Processando mensagens...")
-
-        # Busca mensagens do buffer (Redis ou local)
-        if USE_REDIS and redis_client:
-            try:
-                buffer_key = f'{chat_id}{BUFFER_KEY_SUFIX}'
-                count_before = await redis_client.llen(buffer_key)
-                print(f"[DEBOUNCE] Mensagens no Redis antes de recuperar: {count_before}")
-                
-                messages = await redis_client.lrange(buffer_key, 0, -1)
-                await redis_client.delete(buffer_key)
-                
-                print(f"[DEBOUNCE] ✅ Recuperadas {len(messages)} mensagens do Redis")
-                print(f"[DEBOUNCE] Mensagens recuperadas: {messages}")
-            except Exception as e:
-                print(f"[DEBOUNCE] ❌ Erro ao buscar do Redis: {e}. Usando buffer local.")
-                messages = local_buffer[chat_id].copy()
-                local_buffer[chat_id].clear()
-        else:
-            # Modo local
-            print(f"[DEBOUNCE] Buffer local antes de recuperar: {local_buffer[chat_id]}")
-            messages = local_buffer[chat_id].copy()
-            local_buffer[chat_id].clear()
-            print(f"[DEBOUNCE] ✅ Recuperadas {len(messages)} mensagens do buffer local")
-            print(f"[DEBOUNCE] Mensagens recuperadas: {messages}")
-
-        # Se houver múltiplas mensagens, agrupa com informação contextual
-        if len(messages) > 1:
-            full_message = '\n'.join(messages).strip()
-            print(f"\n[DEBOUNCE] 🎉 ✅ AGRUPANDO {len(messages)} MENSAGENS com quebra de linha")
-            print(f"[DEBOUNCE] Mensagens individuais:")
-            for i, msg in enumerate(messages, 1):
-                print(f"  {i}. '{msg}'")
-            print(f"\n[DEBOUNCE] Mensagem final enviada para IA:")
-            print(f"---\n{full_message}\n---")
-        else:
-            full_message = messages[0].strip() if messages else ''
-            print(f"\n[DEBOUNCE] ⚠️ APENAS 1 MENSAGEM NO BUFFER: '{full_message}'")
-        
-        if full_message:
-            try:
-                result = conversational_rag_chain.invoke(
-                    input={'input': full_message},
-                    config={'configurable': {'session_id': chat_id}},
-                )
-                # Tenta buscar 'answer' (RAG) ou 'output' (Agent)
-                ai_response = result.get('answer') or result.get('output', '')
-            except Exception as e:
-                print(f'Erro ao invocar o chain: {e}')
-                import traceback
-                traceback.print_exc()
-                ai_response = "Desculpe, houve um erro ao processar sua mensagem."
+        await process_turn(chat_id, messages, get_chain)
 
+    except asyncio.CancelledError:
+        pass  # Nova mensagem recebida: a task seguinte processa o lote completo
+    except Exception as e:
+        logger.exception('[DEBOUNCE] Erro inesperado no debounce: %s', e)
+
+
+async def process_turn(key: str, messages, get_chain):
+    """
+    Processa um lote de mensagens pelo TurnScheduler: um turno por chat de cada vez
+    (lotes que chegam durante a geração entram no próximo turno) e limite global de geração.
+    """
+    instance, chat_id = split_conversation_key(key)
+
+    async def shed(_messages):
+        try:
+            await send_whatsapp_message(number=chat_id, text=TURN_SHED_MESSAGE, instance=instance)
+        except Exception as e:
+            logger.exception('Erro ao enviar mensagem: %s', e)
+
+    async def handler(batch):
+        chain = await get_chain(instance)
+        if chain is None:
+            logger.warning('[DEBOUNCE] %s: instância %s desconhecida, mensagens descartadas', chat_id, instance)
+            return
+        await generate_reply(key, batch, chain)
+
+    await turn_scheduler.run(key, list(messages), handler, shed=shed)
+
+
+async def generate_reply(key: str, messages, conversational_rag_chain):
+    """Agrupa as mensagens do buffer, invoca o chain e envia a resposta."""
+    instance, chat_id = split_conversation_key(key)
+    # Se houver múltiplas mensagens, agrupa com quebra de linha
+    full_message = '\n'.join(messages).strip()
+    logger.debug("[DEBOUNCE] %s: processando %d mensagens: %r", key, len(messages), full_message)
+
+    if not full_message:
+        return
+
+    chain_input = {'input': full_message}
+    chain_config = {'configurable': {'session_id': key}, 'callbacks': [pipeline_tracer]}
+
+    if REPLY_STREAMING and supports_streaming(conversational_rag_chain):
+        # Envia cada parte da resposta assim que ela fica pronta
+        sent = await stream_reply(
+            chain_executor.stream(conversational_rag_chain, chain_input, config=chain_config, tenant=instance),
+            lambda text: send_whatsapp_message(number=chat_id, text=text, instance=instance),
+        )
+        if not sent:
             try:
-                send_whatsapp_message(
-                    number=chat_id,
-                    text=ai_response,
-                )
+                await send_whatsapp_message(number=chat_id, text=ERROR_REPLY, instance=instance)
             except Exception as e:
-                print(f'Erro ao enviar mensagem: {e}')
+                logger.exception('Erro ao enviar mensagem: %s', e)
+        return
 
-    except asyncio.CancelledError:
-        print(f"[DEBOUNCE] Task cancelada - nova mensagem recebida")
-        pass
+    try:
+        # Executa fora do event loop para não travar o webhook e os outros chats
+        result = await chain_executor.invoke(
+            conversational_rag_chain,
+            input=chain_input,
+            config=chain_config,
+            tenant=instance,
+        )
+        # Tenta buscar 'answer' (RAG) ou 'output' (Agent)
+        ai_response = result.get('answer') or result.get('output', '')
+    except Exception as e:
+        logger.exception('Erro ao invocar o chain: %s', e)
+        ai_response = ERROR_REPLY
+
+    try:
+        await send_whatsapp_message(
+            number=chat_id,
+            text=ai_response,
+            instance=instance,
+        )
     except Exception as e:
-        print(f'[DEBOUNCE] Erro inesperado no debounce: {e}')
\ No newline at end of file
+        logger.exception('Erro ao enviar mensagem: %s', e)
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Buckets padrão (segundos) para latências do pipeline
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = {}
+_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Counter:
+    """Contador monotônico com suporte a labels."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with _lock:
+            self._values[_label_key(labels)] += amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0.0)
+
+
+class Gauge:
+    """Valor instantâneo (ex: profundidade de fila) com suporte a labels."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = defaultdict(float)
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        with _lock:
+            self._values[_label_key(labels)] += amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0.0)
+
+
+class Histogram:
+    """Histograma cumulativo de observações (latências, tamanhos)."""
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._counts = {}
+        self._sums = defaultdict(float)
+        self._totals = defaultdict(int)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] += value
+            self._totals[key] += 1
+
+    def count(self, **labels):
+        return self._totals.get(_label_key(labels), 0)
+
+    def sum(self, **labels):
+        return self._sums.get(_label_key(labels), 0.0)
+
+
+def _register(cls, name, description, **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, description, **kwargs)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name, description):
+    return _register(Counter, name, description)
+
+
+def gauge(name, description):
+    return _register(Gauge, name, description)
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, description, buckets=buckets)
+
+
+# Duração de cada etapa do pipeline (webhook, buffer, debounce, histórico, LLMs, tools, envio)
+STAGE_LATENCY = histogram('pipeline_stage_seconds', 'Duração de cada etapa do processamento de mensagens')
+
+
+def observe_stage(stage, seconds, **labels):
+    STAGE_LATENCY.observe(seconds, stage=stage, **labels)
+
+
+@contextmanager
+def span(stage, **labels):
+    """Mede a duração do bloco como uma etapa do pipeline (funciona em código síncrono e assíncrono)."""
+    started_at = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started_at, status=status, **labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render_prometheus():
+    """Exporta todas as métricas no formato texto do Prometheus."""
+    lines = []
+    with _lock:
+        for metric in _registry.values():
+            if isinstance(metric, Histogram):
+                kind = 'histogram'
+            elif isinstance(metric, Counter):
+                kind = 'counter'
+            else:
+                kind = 'gauge'
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {kind}')
+            if isinstance(metric, Histogram):
+                for key, counts in metric._counts.items():
+                    for bound, count in zip(metric.buckets, counts):
+                        lines.append(f'{metric.name}_bucket{_format_labels(key, [("le", _format_value(bound))])} {count}')
+                    lines.append(f'{metric.name}_bucket{_format_labels(key, [("le", "+Inf")])} {metric._totals[key]}')
+                    lines.append(f'{metric.name}_sum{_format_labels(key)} {_format_value(metric._sums[key])}')
+                    lines.append(f'{metric.name}_count{_format_labels(key)} {metric._totals[key]}')
+            else:
+                for key, value in metric._values.items():
+                    lines.append(f'{metric.name}{_format_labels(key)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,145 @@
+import logging
+
+from langchain_core.runnables import RunnableLambda
+
+from config import (
+    PROMPT_MAX_INPUT_TOKENS,
+    PROMPT_HISTORY_TOKENS,
+    PROMPT_MESSAGE_MAX_TOKENS,
+    RETRIEVER_CONTEXT_TOKENS,
+)
+from metrics import counter, histogram
+from token_budget import count_tokens, truncate_tokens, pack_documents
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKENS = histogram(
+    'prompt_section_tokens',
+    'Tokens de cada parte do prompt após o orçamento',
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+TRIMMED = counter('prompt_trimmed_total', 'Mensagens do histórico e documentos cortados pelo orçamento')
+
+# Sobreposição entre chunks vizinhos considerada repetição (o splitter usa chunk_overlap=100)
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 200
+TRUNCATED_SUFFIX = ' […]'
+# Acima dessa fração do orçamento, o prompt de sistema deixa pouco espaço para contexto e histórico
+SYSTEM_WARNING_RATIO = 0.5
+
+
+def _overlap(previous, current):
+    """Tamanho do maior sufixo de 'previous' que é prefixo de 'current'."""
+    for size in range(min(len(previous), len(current), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:size]):
+            return size
+    return 0
+
+
+def dedupe_documents(docs):
+    """
+    Remove chunks repetidos ou contidos em outro e corta o trecho que um chunk
+    repete de um vizinho do mesmo arquivo já mantido (sobreposição do text splitter).
+    """
+    kept = []
+    for doc in docs:
+        text = doc.page_content
+        if any(text in other.page_content for other in kept):
+            TRIMMED.inc(section='context')
+            continue
+        source = doc.metadata.get('source')
+        for other in kept:
+            if other.metadata.get('source') != source:
+                continue
+            # O vizinho pode vir antes ou depois deste chunk no arquivo
+            size = _overlap(other.page_content, text)
+            if size:
+                text = text[size:].lstrip()
+            size = _overlap(text, other.page_content)
+            if size:
+                text = text[:-size].rstrip()
+        if not text:
+            TRIMMED.inc(section='context')
+            continue
+        kept.append(doc if text == doc.page_content else doc.model_copy(update={'page_content': text}))
+    return kept
+
+
+class PromptBudget:
+    """
+    Divide o orçamento de tokens de entrada entre prompt de sistema, histórico e contexto:
+    - o contexto recuperado tem prioridade: até context_tokens ficam reservados para ele
+    - o histórico fica com as mensagens mais recentes que couberem no que sobra (até
+      history_tokens), e cada mensagem longa (ex: um texto colado) é truncada em message_tokens
+    - o contexto é deduplicado e empacotado no espaço que o histórico deixou
+    """
+
+    def __init__(
+        self,
+        system_text,
+        max_tokens=PROMPT_MAX_INPUT_TOKENS,
+        history_tokens=PROMPT_HISTORY_TOKENS,
+        message_tokens=PROMPT_MESSAGE_MAX_TOKENS,
+        context_tokens=RETRIEVER_CONTEXT_TOKENS,
+    ):
+        self.system_tokens = count_tokens(system_text or '')
+        self.max_tokens = max_tokens
+        self.history_tokens = history_tokens
+        self.message_tokens = message_tokens
+        self.context_tokens = context_tokens
+        if self.system_tokens > max_tokens * SYSTEM_WARNING_RATIO:
+            logger.warning(
+                'O prompt de sistema usa %d dos %d tokens de PROMPT_MAX_INPUT_TOKENS; '
+                'sobram %d para contexto (%d reservados) e histórico',
+                self.system_tokens, max_tokens, max(max_tokens - self.system_tokens, 0), context_tokens,
+            )
+
+    def _shorten(self, message):
+        if not isinstance(message.content, str) or count_tokens(message.content) <= self.message_tokens:
+            return message
+        TRIMMED.inc(section='message')
+        content = truncate_tokens(message.content, self.message_tokens) + TRUNCATED_SUFFIX
+        return message.model_copy(update={'content': content})
+
+    def fit_history(self, messages, question=''):
+        """Mensagens mais recentes que cabem no orçamento, em ordem cronológica."""
+        available = self.max_tokens - self.system_tokens - count_tokens(question)
+        # Reserva o espaço do contexto antes: sem ele, uma conversa longa tira o embasamento da resposta
+        reserved = max(min(self.context_tokens, available), 0)
+        budget = max(min(self.history_tokens, available - reserved), 0)
+        kept, used = [], 0
+        for message in reversed(messages or []):
+            message = self._shorten(message)
+            tokens = count_tokens(message.content if isinstance(message.content, str) else str(message.content))
+            if used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+        # Resultado de tool sem a chamada que o originou é rejeitado pela API
+        while kept and kept[0].type == 'tool':
+            kept.pop(0)
+        if len(kept) < len(messages or []):
+            TRIMMED.inc(len(messages) - len(kept), section='history')
+        PROMPT_TOKENS.observe(used, section='history')
+        return kept
+
+    def fit_context(self, docs, history=(), question=''):
+        """Documentos deduplicados que cabem no que sobrou do orçamento."""
+        history_used = sum(count_tokens(message.content) for message in history if isinstance(message.content, str))
+        remaining = self.max_tokens - self.system_tokens - history_used - count_tokens(question)
+        packed = pack_documents(dedupe_documents(docs), max(min(self.context_tokens, remaining), 0))
+        PROMPT_TOKENS.observe(sum(count_tokens(doc.page_content) for doc in packed), section='context')
+        return packed
+
+    def history_step(self):
+        """Runnable que aplica o orçamento ao 'chat_history' da entrada."""
+        return RunnableLambda(
+            lambda x: self.fit_history(x.get('chat_history') or [], x.get('input', ''))
+        ).with_config(run_name='budget_history')
+
+    def context_step(self):
+        """Runnable que aplica o orçamento ao 'context' recuperado."""
+        return RunnableLambda(
+            lambda x: self.fit_context(x.get('context') or [], x.get('chat_history') or [], x.get('input', ''))
+        ).with_config(run_name='budget_context')
@@ -0,0 +1,44 @@
+import redis
+import redis.asyncio as aioredis
+
+from config import REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT
+
+# Pools únicos por processo, compartilhados por buffer, memória e demais módulos
+_async_pool = None
+_sync_pool = None
+
+
+def _pool_options():
+    return {
+        'max_connections': REDIS_MAX_CONNECTIONS,
+        'socket_timeout': REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': REDIS_SOCKET_TIMEOUT,
+        'health_check_interval': 30,
+        'decode_responses': True,
+    }
+
+
+def get_redis():
+    """Cliente assíncrono sobre o pool compartilhado."""
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = aioredis.BlockingConnectionPool.from_url(REDIS_URL, **_pool_options())
+    return aioredis.Redis(connection_pool=_async_pool)
+
+
+def get_sync_redis():
+    """Cliente síncrono sobre o pool compartilhado (para código executado no pool de threads)."""
+    global _sync_pool
+    if _sync_pool is None:
+        _sync_pool = redis.BlockingConnectionPool.from_url(REDIS_URL, **_pool_options())
+    return redis.Redis(connection_pool=_sync_pool)
+
+
+async def close_pools():
+    global _async_pool, _sync_pool
+    if _async_pool is not None:
+        await _async_pool.disconnect()
+        _async_pool = None
+    if _sync_pool is not None:
+        _sync_pool.disconnect()
+        _sync_pool = None
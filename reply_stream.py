@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import re
+
+from config import REPLY_CHUNK_MIN_CHARS, REPLY_CHUNK_MAX_CHARS
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+REPLY_CHUNKS = counter('reply_chunks_total', 'Mensagens enviadas por resposta em modo streaming')
+
+# Chave da resposta no chain RAG; o agent com tools responde em 'output' e não gera tokens parciais
+STREAMING_OUTPUT_KEY = 'answer'
+
+_sentence_end = re.compile(r'[.!?…](?=\s)')
+
+
+def supports_streaming(chain):
+    """Só o chain RAG produz a resposta token a token; o AgentExecutor devolve tudo no final."""
+    return getattr(chain, 'output_messages_key', None) == STREAMING_OUTPUT_KEY
+
+
+class ReplyChunker:
+    """
+    Divide o texto gerado em mensagens de WhatsApp com tamanho natural:
+    - corta em fim de parágrafo assim que a mensagem tem pelo menos 'min_chars'
+    - se passar de 'max_chars' sem isso, corta no último fim de frase ou parágrafo (ou espaço) antes do limite
+    """
+
+    def __init__(self, min_chars=REPLY_CHUNK_MIN_CHARS, max_chars=REPLY_CHUNK_MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ''
+
+    def _split_point(self):
+        paragraph = self._buffer.find('\n\n', self.min_chars)
+        if 0 <= paragraph <= self.max_chars:
+            return paragraph
+        if len(self._buffer) <= self.max_chars:
+            return None
+        window = self._buffer[:self.max_chars]
+        boundaries = [match.end() for match in _sentence_end.finditer(window)]
+        boundaries.append(window.rfind('\n\n'))
+        best = max(boundaries)
+        if best > 0:
+            return best
+        space = window.rfind(' ', self.min_chars)
+        return space if space > 0 else self.max_chars
+
+    def feed(self, text):
+        """Acrescenta um trecho gerado e devolve as mensagens que já podem ser enviadas."""
+        self._buffer += text
+        ready = []
+        while (cut := self._split_point()) is not None:
+            chunk, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:].lstrip()
+            if chunk:
+                ready.append(chunk)
+        return ready
+
+    def flush(self):
+        chunk, self._buffer = self._buffer.strip(), ''
+        return [chunk] if chunk else []
+
+
+async def stream_reply(chunks, send, chunker=None):
+    """
+    Consome os pedaços de saída do chain (dicts com 'answer' parcial) e envia cada mensagem
+    assim que fica pronta. Os envios acontecem em uma única task, na ordem de geração,
+    enquanto o modelo continua gerando. Devolve quantas mensagens foram enviadas;
+    se a geração falhar no meio, o que já foi enviado fica e o erro é só registrado.
+    """
+    chunker = chunker or ReplyChunker()
+    outbox = asyncio.Queue()
+    sent = 0
+
+    async def sender():
+        nonlocal sent
+        while (text := await outbox.get()) is not None:
+            try:
+                await send(text)
+                sent += 1
+            except Exception as e:
+                logger.exception('Erro ao enviar parte da resposta: %s', e)
+
+    sender_task = asyncio.create_task(sender())
+    try:
+        async for chunk in chunks:
+            delta = chunk.get(STREAMING_OUTPUT_KEY) if isinstance(chunk, dict) else None
+            if isinstance(delta, str) and delta:
+                for text in chunker.feed(delta):
+                    outbox.put_nowait(text)
+        for text in chunker.flush():
+            outbox.put_nowait(text)
+    except Exception as e:
+        logger.exception('Erro durante a geração da resposta: %s', e)
+    finally:
+        outbox.put_nowait(None)
+        await sender_task
+        REPLY_CHUNKS.inc(sent)
+    return sent
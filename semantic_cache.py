@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import time
+
+from langchain_chroma import Chroma
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.utils import AddableDict
+
+from config import (
+    VECTOR_STORE_PATH,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL,
+)
+from embedding_cache import normalize_text
+from metrics import counter
+from tenants import DEFAULT_COLLECTION_NAME
+from vectorstore import get_embeddings, get_index_version
+
+CACHE_REQUESTS = counter('semantic_cache_requests_total', 'Consultas ao cache semântico de respostas')
+
+COLLECTION_NAME = 'semantic_cache'
+
+
+def prompt_version(*parts):
+    """Identificador curto da combinação de prompts/modelo; respostas de outras versões são ignoradas."""
+    return hashlib.sha256('\0'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:12]
+
+
+class SemanticCache:
+    """
+    Cache de pares (pergunta independente → resposta) com busca por vizinho mais próximo.
+    As entradas são separadas por versão dos prompts e por versão da base vetorial,
+    então uma nova ingestão invalida automaticamente as respostas anteriores.
+    Cada coleção da base (instância) tem sua própria coleção de cache.
+    """
+
+    def __init__(
+        self,
+        prompt_version,
+        collection_name=DEFAULT_COLLECTION_NAME,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds=SEMANTIC_CACHE_TTL,
+    ):
+        self.prompt_version = prompt_version
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.store = Chroma(
+            collection_name=COLLECTION_NAME if collection_name == DEFAULT_COLLECTION_NAME else f'{COLLECTION_NAME}_{collection_name}'[:63],
+            embedding_function=get_embeddings(),
+            persist_directory=VECTOR_STORE_PATH,
+            collection_metadata={'hnsw:space': 'cosine'},
+        )
+        self._purged_namespace = None
+
+    @property
+    def namespace(self):
+        return f'{self.prompt_version}:{get_index_version(self.collection_name)}'
+
+    def _purge_stale(self, namespace):
+        """Remove entradas de versões antigas (uma vez por namespace)."""
+        if self._purged_namespace == namespace:
+            return
+        self._purged_namespace = namespace
+        self.store._collection.delete(where={'namespace': {'$ne': namespace}})
+
+    def lookup(self, question):
+        namespace = self.namespace
+        self._purge_stale(namespace)
+        results = self.store.similarity_search_with_score(question, k=1, filter={'namespace': namespace})
+        if results:
+            doc, distance = results[0]
+            fresh = time.time() - doc.metadata.get('created_at', 0) <= self.ttl_seconds
+            if fresh and 1 - distance >= self.threshold:
+                CACHE_REQUESTS.inc(result='hit')
+                return doc.metadata['answer']
+        CACHE_REQUESTS.inc(result='miss')
+        return None
+
+    def store_answer(self, question, answer):
+        if not answer:
+            return
+        namespace = self.namespace
+        entry_id = hashlib.sha256(f'{namespace}\0{normalize_text(question, casefold=True)}'.encode('utf-8')).hexdigest()
+        self.store.add_texts(
+            [question],
+            metadatas=[{'namespace': namespace, 'answer': answer, 'created_at': time.time()}],
+            ids=[entry_id],
+        )
+
+
+class SemanticCachedChain(Runnable):
+    """
+    Envolve o chain de recuperação + resposta: se uma pergunta equivalente já foi
+    respondida, devolve a resposta guardada sem chamar o LLM.
+    Espera a chave 'standalone_question' na entrada. Em streaming, um acerto sai como um
+    único pedaço e uma falta repassa os pedaços do chain, guardando a resposta no final.
+    """
+
+    def __init__(self, chain, cache):
+        self.chain = chain
+        self.cache = cache
+
+    def _cached_output(self, input, answer):
+        return AddableDict({**input, 'context': [], 'answer': answer})
+
+    def invoke(self, input, config=None, **kwargs):
+        question = input['standalone_question']
+        answer = self.cache.lookup(question)
+        if answer is not None:
+            return self._cached_output(input, answer)
+        output = self.chain.invoke(input, config, **kwargs)
+        self.cache.store_answer(question, output.get('answer'))
+        return output
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        question = input['standalone_question']
+        answer = await asyncio.to_thread(self.cache.lookup, question)
+        if answer is not None:
+            return self._cached_output(input, answer)
+        output = await self.chain.ainvoke(input, config, **kwargs)
+        await asyncio.to_thread(self.cache.store_answer, question, output.get('answer'))
+        return output
+
+    @staticmethod
+    def _collect_answer(parts, chunk):
+        delta = chunk.get('answer') if isinstance(chunk, dict) else None
+        if isinstance(delta, str):
+            parts.append(delta)
+
+    def stream(self, input, config=None, **kwargs):
+        question = input['standalone_question']
+        answer = self.cache.lookup(question)
+        if answer is not None:
+            yield self._cached_output(input, answer)
+            return
+        parts = []
+        for chunk in self.chain.stream(input, config, **kwargs):
+            self._collect_answer(parts, chunk)
+            yield chunk
+        self.cache.store_answer(question, ''.join(parts))
+
+    async def astream(self, input, config=None, **kwargs):
+        question = input['standalone_question']
+        answer = await asyncio.to_thread(self.cache.lookup, question)
+        if answer is not None:
+            yield self._cached_output(input, answer)
+            return
+        parts = []
+        async for chunk in self.chain.astream(input, config, **kwargs):
+            self._collect_answer(parts, chunk)
+            yield chunk
+        await asyncio.to_thread(self.cache.store_answer, question, ''.join(parts))
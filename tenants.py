@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from config import EVOLUTION_INSTANCE_NAME, RAG_FILES_DIR, TENANTS_DIR, TENANT_CACHE_SIZE
+from metrics import counter, gauge, observe_stage
+
+logger = logging.getLogger(__name__)
+
+TENANT_LOADS = counter('tenant_loads_total', 'Consultas ao registro de instâncias, por resultado')
+TENANTS_LOADED = gauge('tenants_loaded', 'Instâncias com chain montado em memória')
+TENANT_RELOADS = counter('tenant_reloads_total', 'Recargas de prompts/base de conhecimento, por resultado')
+
+# Coleção do Chroma usada pela instância padrão (nome padrão do LangChain, para manter a base existente)
+DEFAULT_COLLECTION_NAME = 'langchain'
+
+# Arquivos dentro de TENANTS_DIR/<instância>/; prompts ausentes usam os da instância padrão
+CONTEXTUALIZE_PROMPT_FILENAME = 'contextualize_prompt.txt'
+SYSTEM_PROMPT_FILENAME = 'system_prompt.txt'
+DOCS_DIRNAME = 'docs'
+
+# Separador entre instância e chat nas chaves de buffer/histórico (não aparece em JIDs do WhatsApp)
+KEY_SEPARATOR = '/'
+
+_valid_instance = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,62}$')
+
+
+def is_default_instance(instance):
+    return not instance or instance == EVOLUTION_INSTANCE_NAME
+
+
+def conversation_key(instance, chat_id):
+    """
+    Chave do chat no buffer, na agenda de debounce e no histórico. A instância padrão
+    usa só o chat_id, mantendo as chaves que já existem no Redis.
+    """
+    if is_default_instance(instance):
+        return chat_id
+    return f'{instance}{KEY_SEPARATOR}{chat_id}'
+
+
+def split_conversation_key(key):
+    """Inverso de conversation_key: (instância, chat_id)."""
+    if KEY_SEPARATOR in key:
+        instance, chat_id = key.split(KEY_SEPARATOR, 1)
+        return instance, chat_id
+    return EVOLUTION_INSTANCE_NAME, key
+
+
+def collection_name_for(instance):
+    if is_default_instance(instance):
+        return DEFAULT_COLLECTION_NAME
+    return f'tenant_{re.sub(r"[^A-Za-z0-9_-]", "_", instance)}'[:63]
+
+
+def tenant_dir(instance):
+    """Diretório da instância em TENANTS_DIR (ou None se ela não estiver configurada)."""
+    if not TENANTS_DIR or not instance or not _valid_instance.match(instance):
+        return None
+    path = os.path.join(TENANTS_DIR, instance)
+    return path if os.path.isdir(path) else None
+
+
+def docs_dir_for(instance):
+    """Pasta de documentos da instância (ou None se ela não tiver uma)."""
+    if is_default_instance(instance):
+        return RAG_FILES_DIR
+    directory = tenant_dir(instance)
+    if directory is None:
+        return None
+    docs_dir = os.path.join(directory, DOCS_DIRNAME)
+    return docs_dir if os.path.isdir(docs_dir) else None
+
+
+def list_instances():
+    """Instância padrão seguida das configuradas em TENANTS_DIR."""
+    instances = [EVOLUTION_INSTANCE_NAME]
+    if TENANTS_DIR and os.path.isdir(TENANTS_DIR):
+        for name in sorted(os.listdir(TENANTS_DIR)):
+            if name != EVOLUTION_INSTANCE_NAME and tenant_dir(name):
+                instances.append(name)
+    return instances
+
+
+def is_known_instance(instance):
+    return is_default_instance(instance) or tenant_dir(instance) is not None
+
+
+@dataclass(slots=True, frozen=True)
+class Tenant:
+    instance: str
+    contextualize_prompt: str
+    system_prompt: str
+    collection_name: str
+    docs_dir: str | None
+
+    @property
+    def is_default(self):
+        return is_default_instance(self.instance)
+
+
+def _read_prompt(directory, filename, default):
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def prompt_paths(instance, default_paths):
+    """Arquivos de prompt que a instância usa (os próprios ou, na falta deles, os padrão)."""
+    directory = None if is_default_instance(instance) else tenant_dir(instance)
+    if directory is None:
+        return [path for path in default_paths if path]
+    paths = []
+    for filename, default in zip((CONTEXTUALIZE_PROMPT_FILENAME, SYSTEM_PROMPT_FILENAME), default_paths):
+        path = os.path.join(directory, filename)
+        paths.append(path if os.path.exists(path) else default)
+    return [path for path in paths if path]
+
+
+def load_tenant(instance, default_prompts):
+    """
+    Configuração da instância: prompts e documentos de TENANTS_DIR/<instância>/
+    (a instância padrão usa os prompts do .env e RAG_FILES_DIR). None se for desconhecida.
+    """
+    contextualize_prompt, system_prompt = default_prompts
+    if is_default_instance(instance):
+        return Tenant(EVOLUTION_INSTANCE_NAME, contextualize_prompt, system_prompt, DEFAULT_COLLECTION_NAME, RAG_FILES_DIR)
+    directory = tenant_dir(instance)
+    if directory is None:
+        return None
+    return Tenant(
+        instance=instance,
+        contextualize_prompt=_read_prompt(directory, CONTEXTUALIZE_PROMPT_FILENAME, contextualize_prompt),
+        system_prompt=_read_prompt(directory, SYSTEM_PROMPT_FILENAME, system_prompt),
+        collection_name=collection_name_for(instance),
+        docs_dir=docs_dir_for(instance),
+    )
+
+
+class TenantRegistry:
+    """
+    Chains por instância da Evolution, montados sob demanda e mantidos em um LRU de
+    'max_size' entradas (a instância padrão nunca é removida). Os clientes pesados (LLM,
+    embeddings, Redis) são compartilhados; cada instância só tem seus prompts e sua coleção.
+    Turnos em andamento continuam com o chain que receberam mesmo se ele sair do LRU
+    ou for trocado por uma recarga.
+    """
+
+    def __init__(self, load_default_prompts, build_chain=None, max_size=TENANT_CACHE_SIZE):
+        # load_default_prompts() lê de novo os prompts da instância padrão a cada montagem
+        self.load_default_prompts = load_default_prompts
+        self.max_size = max(max_size, 1)
+        self._build_chain = build_chain
+        self._chains = OrderedDict()
+        self._loading = {}
+        self._reload_locks = {}
+
+    def loaded_instances(self):
+        return list(self._chains)
+
+    def load_tenant(self, instance):
+        return load_tenant(instance, self.load_default_prompts())
+
+    def _build(self, tenant):
+        build_chain = self._build_chain
+        if build_chain is None:
+            from chains import get_tenant_chain as build_chain
+        return build_chain(tenant)
+
+    def _load(self, instance):
+        tenant = self.load_tenant(instance)
+        return None if tenant is None else self._build(tenant)
+
+    def _store(self, instance, chain):
+        self._chains[instance] = chain
+        self._chains.move_to_end(instance)
+        while len(self._chains) > self.max_size:
+            oldest = next((name for name in self._chains if not is_default_instance(name)), None)
+            if oldest is None:
+                break
+            del self._chains[oldest]
+            logger.info('[TENANT] %s removida do cache', oldest)
+        TENANTS_LOADED.set(len(self._chains))
+
+    async def get_chain(self, instance):
+        """Chain da instância (montado em uma thread na primeira vez) ou None se ela for desconhecida."""
+        instance = EVOLUTION_INSTANCE_NAME if is_default_instance(instance) else instance
+        chain = self._chains.get(instance)
+        if chain is not None:
+            self._chains.move_to_end(instance)
+            TENANT_LOADS.inc(result='hit')
+            return chain
+
+        # Mensagens simultâneas de uma instância nova aguardam a mesma montagem
+        task = self._loading.get(instance)
+        if task is None:
+            task = asyncio.ensure_future(self._load_and_store(instance))
+            self._loading[instance] = task
+            task.add_done_callback(lambda done: self._loading.pop(instance) if self._loading.get(instance) is done else None)
+        return await asyncio.shield(task)
+
+    async def _load_and_store(self, instance):
+        started_at = time.perf_counter()
+        try:
+            chain = await asyncio.to_thread(self._load, instance)
+        except Exception:
+            TENANT_LOADS.inc(result='error')
+            raise
+        if chain is None:
+            TENANT_LOADS.inc(result='unknown')
+            logger.warning('[TENANT] Instância desconhecida: %s', instance)
+            return None
+        observe_stage('tenant_load', time.perf_counter() - started_at)
+        TENANT_LOADS.inc(result='miss')
+        self._store(instance, chain)
+        logger.info('[TENANT] %s pronta em %.1fs', instance, time.perf_counter() - started_at)
+        return chain
+
+    async def reload(self, instance, ingest=False, prune=True):
+        """
+        Relê os prompts (e, com ingest, sincroniza os documentos; com prune, também remove
+        os de arquivos apagados) da instância e monta um chain novo em uma thread. A troca é uma única atribuição no event loop: turnos em
+        andamento terminam com o chain antigo e os seguintes já usam o novo.
+        Instâncias ainda não carregadas só são ingeridas; o chain é montado na próxima mensagem.
+        """
+        instance = EVOLUTION_INSTANCE_NAME if is_default_instance(instance) else instance
+        lock = self._reload_locks.setdefault(instance, asyncio.Lock())
+        async with lock:
+            started_at = time.perf_counter()
+            try:
+                tenant = await asyncio.to_thread(self.load_tenant, instance)
+                if tenant is None:
+                    TENANT_RELOADS.inc(result='unknown')
+                    return 'unknown'
+                if ingest and tenant.docs_dir:
+                    from ingest import ingest_tenant
+
+                    await asyncio.to_thread(ingest_tenant, tenant, remove_missing=prune)
+                if instance not in self._chains:
+                    TENANT_RELOADS.inc(result='not_loaded')
+                    return 'not_loaded'
+                chain = await asyncio.to_thread(self._build, tenant)
+            except Exception as e:
+                TENANT_RELOADS.inc(result='error')
+                logger.exception('[TENANT] Erro ao recarregar %s; mantendo a versão atual: %s', instance, e)
+                return 'error'
+            self._store(instance, chain)
+            TENANT_RELOADS.inc(result='reloaded')
+            logger.info('[TENANT] %s recarregada em %.1fs', instance, time.perf_counter() - started_at)
+            return 'reloaded'
@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from googleapiclient.errors import HttpError
+
+import calendar_tools
+from calendar_index import CalendarEventIndex
+
+
+def _event(event_id, start, summary='Reunião', status='confirmed'):
+    return {
+        'id': event_id,
+        'status': status,
+        'summary': summary,
+        'start': {'dateTime': start.isoformat()},
+        'end': {'dateTime': (start + timedelta(hours=1)).isoformat()},
+    }
+
+
+class _Request:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class _Status:
+    def __init__(self, status):
+        self.status = status
+        self.reason = ''
+
+
+class FakeCalendarService:
+    """Imita service.events() da API: cada list() consome a próxima resposta da fila."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.list_calls = []
+        self.inserted = []
+        self.deleted = []
+
+    def events(self):
+        return self
+
+    def list(self, **params):
+        self.list_calls.append(params)
+        return _Request(self.responses.pop(0))
+
+    def insert(self, calendarId, body):
+        event = {**body, 'id': f'novo{len(self.inserted)}', 'status': 'confirmed', 'htmlLink': 'https://calendar'}
+        self.inserted.append(event)
+        return _Request(event)
+
+    def delete(self, calendarId, eventId):
+        self.deleted.append(eventId)
+        return _Request({})
+
+
+def _gone():
+    return HttpError(_Status(410), b'{"error": {"message": "Sync token is no longer valid"}}')
+
+
+@pytest.fixture
+def now():
+    return datetime.now(timezone.utc)
+
+
+def test_initial_sync_is_bounded_by_the_booking_window(now):
+    service = FakeCalendarService([{'items': [_event('a', now + timedelta(days=1))], 'nextSyncToken': 't1'}])
+    index = CalendarEventIndex(lambda: service, past_days=30, future_days=90)
+
+    index.sync()
+
+    params = service.list_calls[0]
+    assert 'syncToken' not in params
+    time_min = datetime.fromisoformat(params['timeMin'].replace('Z', '+00:00'))
+    time_max = datetime.fromisoformat(params['timeMax'].replace('Z', '+00:00'))
+    assert timedelta(days=29) < now - time_min < timedelta(days=31)
+    assert timedelta(days=89) < time_max - now < timedelta(days=91)
+    assert [event['id'] for event in index.list_events(now, now + timedelta(days=7))] == ['a']
+
+
+def test_incremental_sync_applies_changes_with_the_sync_token(now):
+    service = FakeCalendarService([
+        {'items': [_event('a', now + timedelta(days=1)), _event('b', now + timedelta(days=2))], 'nextSyncToken': 't1'},
+        {'items': [_event('a', now, status='cancelled'), _event('c', now + timedelta(days=3))], 'nextSyncToken': 't2'},
+    ])
+    index = CalendarEventIndex(lambda: service)
+
+    index.sync()
+    index.sync()
+
+    assert service.list_calls[1]['syncToken'] == 't1'
+    assert 'timeMin' not in service.list_calls[1]
+    assert [event['id'] for event in index.list_events(now, now + timedelta(days=7))] == ['b', 'c']
+
+
+def test_expired_sync_token_triggers_a_full_resync(now):
+    service = FakeCalendarService([
+        {'items': [_event('a', now + timedelta(days=1))], 'nextSyncToken': 't1'},
+        _gone(),
+        {'items': [_event('b', now + timedelta(days=2))], 'nextSyncToken': 't2'},
+        {'items': [], 'nextSyncToken': 't3'},
+    ])
+    index = CalendarEventIndex(lambda: service)
+
+    index.sync()
+    index.sync()
+
+    assert 'syncToken' not in service.list_calls[2]
+    assert 'timeMin' in service.list_calls[2]
+    assert [event['id'] for event in index.list_events(now, now + timedelta(days=7))] == ['b']
+    index.sync()
+    assert service.list_calls[3]['syncToken'] == 't2'
+
+
+def test_index_does_not_answer_before_sync_or_outside_the_window(now):
+    service = FakeCalendarService([{'items': [], 'nextSyncToken': 't1'}])
+    index = CalendarEventIndex(lambda: service, future_days=30)
+
+    assert index.list_events(now, now + timedelta(days=7)) is None
+    index.sync()
+    assert index.list_events(now, now + timedelta(days=7)) == []
+    assert index.list_events(now, now + timedelta(days=60)) is None
+    assert index.search_events('reunião', now - timedelta(days=400)) is None
+
+
+def test_tools_write_through_to_the_index(monkeypatch, now):
+    service = FakeCalendarService([{'items': [_event('a', now + timedelta(days=1))], 'nextSyncToken': 't1'}])
+    index = CalendarEventIndex(lambda: service)
+    index.sync()
+    monkeypatch.setattr(calendar_tools, 'calendar_index', index)
+    monkeypatch.setattr(calendar_tools, 'get_calendar_service', lambda: service)
+    start = now + timedelta(days=2)
+
+    calendar_tools.create_calendar_event.invoke({
+        'summary': 'Visita à escola',
+        'start_datetime': start.isoformat(),
+        'end_datetime': (start + timedelta(hours=1)).isoformat(),
+    })
+    calendar_tools.delete_calendar_event.invoke({'event_id': 'a'})
+
+    # As listagens seguintes saem do índice, sem nova chamada de list() à API
+    listing = calendar_tools.list_calendar_events.invoke({'days_ahead': 7})
+    assert 'Visita à escola' in listing
+    assert 'Reunião' not in listing
+    assert 'Visita' in calendar_tools.search_calendar_events.invoke({'query': 'visita escola'})
+    assert len(service.list_calls) == 1
+
+
+def test_tools_fall_back_to_the_api_while_the_index_is_cold(monkeypatch, now):
+    service = FakeCalendarService([{'items': [_event('a', now + timedelta(days=1))]}])
+    monkeypatch.setattr(calendar_tools, 'calendar_index', CalendarEventIndex(lambda: service))
+    monkeypatch.setattr(calendar_tools, 'get_calendar_service', lambda: service)
+
+    assert 'Reunião' in calendar_tools.list_calendar_events.invoke({'days_ahead': 7})
+    assert service.list_calls[0]['orderBy'] == 'startTime'
+    assert 'timeMax' in service.list_calls[0]
+
+
+def test_background_sync_never_starts_the_interactive_login(monkeypatch, tmp_path):
+    def fail(*args, **kwargs):
+        raise AssertionError('login interativo na thread de fundo')
+
+    monkeypatch.setattr(calendar_tools.InstalledAppFlow, 'from_client_secrets_file', fail)
+    (tmp_path / 'credentials.json').write_text('{}')
+    manager = calendar_tools.CalendarServiceManager(
+        token_path=str(tmp_path / 'token.pickle'), credentials_path=str(tmp_path / 'credentials.json'))
+    index = CalendarEventIndex(lambda: manager.service(interactive=False))
+
+    with pytest.raises(calendar_tools.CalendarAuthorizationRequired):
+        index.sync()
+    manager._sync_index(index)
+
+    assert manager._auth_warned
+    assert not manager._lock.locked()
+    assert index.list_events(datetime.now(timezone.utc), None) is None
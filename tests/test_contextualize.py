@@ -0,0 +1,33 @@
+import unicodedata
+
+import pytest
+
+from contextualize import is_self_contained
+
+
+@pytest.mark.parametrize(
+    'question, expected',
+    [
+        ('É possível pagar no cartão?', True),
+        ('A escola está aberta no sábado?', True),
+        ('Qual o valor da mensalidade do ensino médio?', True),
+        ('Vocês têm aula de inglês no período da tarde?', True),
+        ('E o preço do material?', False),
+        ('Mas e no sábado, abre?', False),
+        ('Então qual é o horário?', False),
+        ('Quanto custa esta matrícula aqui?', False),
+        ('Qual o horário dela na sexta?', False),
+        ('E la tem estacionamento perto?', False),
+        ('Tem estacionamento lá perto?', False),
+        ('Qual o preço?', False),
+    ],
+)
+def test_is_self_contained(question, expected):
+    assert is_self_contained(question, min_words=4) is expected
+
+
+def test_is_self_contained_with_decomposed_accents():
+    # "é" digitado como "e" + acento combinante continua sendo o verbo, não o conectivo
+    question = unicodedata.normalize('NFD', 'É possível pagar no cartão?')
+    assert question != unicodedata.normalize('NFC', question)
+    assert is_self_contained(question, min_words=4)
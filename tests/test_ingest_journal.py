@@ -0,0 +1,104 @@
+import pytest
+
+import ingest
+from ingest_journal import IngestJournal
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class FakeCollection:
+    """Coleção do Chroma em memória; fail_upsert simula a queda do processo na gravação."""
+
+    name = 'langchain'
+
+    def __init__(self):
+        self.records = {}
+        self.fail_upsert = False
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if self.fail_upsert:
+            raise RuntimeError('processo interrompido')
+        for cid, vector, text, metadata in zip(ids, embeddings, documents, metadatas):
+            self.records[cid] = (vector, text, metadata)
+
+    def update(self, ids, metadatas):
+        for cid, metadata in zip(ids, metadatas):
+            vector, text, _ = self.records[cid]
+            self.records[cid] = (vector, text, metadata)
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.embeddings = FakeEmbeddings()
+        self._collection = FakeCollection()
+
+    def get(self, where=None, include=None):
+        records = self._collection.records.items()
+        if where:
+            records = [(cid, record) for cid, record in records if record[2].get('source') == where['source']]
+        return {'ids': [cid for cid, _ in records], 'metadatas': [record[2] for _, record in records]}
+
+    def delete(self, ids):
+        for cid in ids:
+            self._collection.records.pop(cid, None)
+
+
+@pytest.fixture
+def docs(tmp_path):
+    root = tmp_path / 'docs'
+    root.mkdir()
+    paragraphs = [f'Parágrafo {i}: ' + 'informação sobre matrícula e mensalidade. ' * 8 for i in range(12)]
+    (root / 'regulamento.txt').write_text('\n\n'.join(paragraphs), encoding='utf-8')
+    return str(root)
+
+
+def _run(vectorstore, journal, root):
+    return ingest._ingest_files(vectorstore, journal, root, force=False, remove_missing=False, workers=1)
+
+
+def test_interrupted_ingestion_resumes_without_re_embedding(tmp_path, docs):
+    journal = IngestJournal(str(tmp_path / 'journal.sqlite'))
+    vectorstore = FakeVectorStore()
+
+    # 1ª execução: os lotes são embedados e salvos no diário, mas a gravação no Chroma falha
+    vectorstore._collection.fail_upsert = True
+    with pytest.raises(RuntimeError):
+        _run(vectorstore, journal, docs)
+    chunk_ids = sorted(journal.get_file('langchain', 'regulamento.txt').chunk_ids)
+    embedded_before = len(vectorstore.embeddings.embedded)
+    assert len(chunk_ids) > 1
+    assert embedded_before == len(chunk_ids)
+    assert journal.get_file('langchain', 'regulamento.txt').state == 'pending'
+    assert sorted(journal.pending_vectors('langchain', chunk_ids)) == chunk_ids
+    assert vectorstore._collection.records == {}
+
+    # 2ª execução: os vetores pendentes são reaproveitados e o arquivo só é concluído após a gravação
+    vectorstore._collection.fail_upsert = False
+    finish_file = journal.finish_file
+    written_at_finish = []
+
+    def checked_finish_file(collection, source):
+        written_at_finish.append(set(vectorstore._collection.records))
+        finish_file(collection, source)
+
+    journal.finish_file = checked_finish_file
+    totals = _run(vectorstore, journal, docs)
+
+    assert len(vectorstore.embeddings.embedded) == embedded_before
+    assert totals['resumed'] == len(chunk_ids)
+    assert totals['added'] == len(chunk_ids)
+    assert written_at_finish == [set(chunk_ids)]
+    assert journal.get_file('langchain', 'regulamento.txt').state == 'done'
+    assert journal.pending_vectors('langchain', chunk_ids) == {}
+
+    # 3ª execução: nada mudou, o arquivo é pulado
+    assert _run(vectorstore, journal, docs)['changed'] == 0
+    assert len(vectorstore.embeddings.embedded) == embedded_before
+    journal.close()
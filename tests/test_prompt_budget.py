@@ -0,0 +1,66 @@
+import logging
+import os
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+from prompt_budget import PromptBudget
+from token_budget import count_tokens
+
+SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'bot', 'prompts', 'system.txt')
+
+
+@pytest.fixture
+def system_prompt():
+    with open(SYSTEM_PROMPT_PATH, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _chat(turns):
+    messages = []
+    for i in range(turns // 2):
+        messages.append(HumanMessage(f'Pergunta {i} sobre matrícula, horários e valores da escola. ' * 3))
+        messages.append(AIMessage(f'Resposta {i} com os detalhes do regulamento e das mensalidades. ' * 6))
+    return messages
+
+
+def _docs():
+    return [
+        Document(page_content=f'Trecho {i} do regulamento: ' + f'regra número {i} sobre o assunto. ' * 40, metadata={'source': f'doc{i}.pdf'})
+        for i in range(4)
+    ]
+
+
+@pytest.mark.parametrize('max_tokens', [6000, 9000])
+def test_long_chat_does_not_crowd_out_retrieved_context(system_prompt, max_tokens):
+    budget = PromptBudget(system_prompt, max_tokens=max_tokens, history_tokens=1500, context_tokens=1500)
+    question = 'Qual o valor da mensalidade?'
+
+    history = budget.fit_history(_chat(30), question)
+    context = budget.fit_context(_docs(), history, question)
+
+    assert len(context) == 4
+    used = (
+        budget.system_tokens
+        + count_tokens(question)
+        + sum(count_tokens(message.content) for message in history)
+        + sum(count_tokens(doc.page_content) for doc in context)
+    )
+    assert used <= max_tokens
+
+
+def test_history_gets_what_is_left_after_the_context_reservation(system_prompt):
+    budget = PromptBudget(system_prompt, max_tokens=9000, history_tokens=1500, context_tokens=1500)
+    history = budget.fit_history(_chat(30), 'Qual o horário?')
+    assert 0 < sum(count_tokens(message.content) for message in history) <= 1500
+
+
+def test_warns_when_the_system_prompt_takes_most_of_the_budget(system_prompt, caplog):
+    with caplog.at_level(logging.WARNING, logger='prompt_budget'):
+        PromptBudget(system_prompt, max_tokens=6000)
+    assert 'prompt de sistema' in caplog.text
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='prompt_budget'):
+        PromptBudget(system_prompt, max_tokens=20000)
+    assert caplog.text == ''
@@ -0,0 +1,47 @@
+import orjson
+import pytest
+
+from webhook_ingress import parse_message, prefilter
+
+
+def _payload(key, message, event='messages.upsert'):
+    return orjson.dumps({'event': event, 'instance': 'escola', 'data': {'key': key, 'message': message}})
+
+
+DIRECT = {'remoteJid': '5511999999999@s.whatsapp.net', 'fromMe': False, 'id': 'ABC'}
+
+
+def _classify(body):
+    return prefilter(body) or parse_message(body)[0]
+
+
+@pytest.mark.parametrize(
+    'body, expected',
+    [
+        (_payload(DIRECT, {'conversation': 'Oi'}, event='connection.update'), 'ignored_event'),
+        (_payload({**DIRECT, 'fromMe': True}, {'conversation': 'Oi'}), 'from_me'),
+        (_payload({**DIRECT, 'remoteJid': '123456@g.us'}, {'conversation': 'Oi'}), 'group'),
+        (_payload(DIRECT, {'imageMessage': {}}), 'no_text'),
+        (_payload(DIRECT, {'conversation': 'Oi'}), None),
+        # Mensagem citada de um grupo, enviada por nós, em uma conversa direta
+        (
+            _payload(DIRECT, {'extendedTextMessage': {
+                'text': 'Qual o horário?',
+                'contextInfo': {'remoteJid': '123456@g.us', 'fromMe': True, 'quotedMessage': {'conversation': 'Oi'}},
+            }}),
+            None,
+        ),
+        # Texto que menciona os campos não é confundido com a chave
+        (_payload(DIRECT, {'conversation': '"fromMe":true "remoteJid":"x@g.us"'}), None),
+    ],
+)
+def test_webhook_classification(body, expected):
+    assert _classify(body) == expected
+
+
+def test_parse_message_reads_the_key():
+    reason, message = parse_message(_payload(DIRECT, {'extendedTextMessage': {'text': 'Qual o horário?'}}), received_at=1.0)
+    assert reason is None
+    assert (message.chat_id, message.text, message.message_id, message.instance) == (
+        DIRECT['remoteJid'], 'Qual o horário?', 'ABC', 'escola',
+    )
@@ -0,0 +1,67 @@
+import logging
+
+from config import OPENAI_MODEL_NAME
+
+logger = logging.getLogger(__name__)
+
+# Aproximação usada quando o tiktoken não conhece o modelo nem consegue baixar o vocabulário
+CHARS_PER_TOKEN = 4
+FALLBACK_ENCODING = 'o200k_base'
+
+_encoder = None
+_encoder_loaded = False
+
+
+def _get_encoder():
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken
+
+            try:
+                _encoder = tiktoken.encoding_for_model(OPENAI_MODEL_NAME)
+            except KeyError:
+                _encoder = tiktoken.get_encoding(FALLBACK_ENCODING)
+        except Exception as e:
+            logger.warning('Tokenizador indisponível, contando tokens pelo tamanho do texto: %s', e)
+    return _encoder
+
+
+def count_tokens(text):
+    """Número de tokens do texto, contado localmente."""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens):
+    """Corta o texto para caber em max_tokens."""
+    if max_tokens <= 0:
+        return ''
+    encoder = _get_encoder()
+    if encoder is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoder.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoder.decode(tokens[:max_tokens])
+
+
+def pack_documents(docs, max_tokens):
+    """
+    Mantém, na ordem de relevância, os documentos que couberem em max_tokens
+    (os que não cabem são pulados). O primeiro documento é truncado em vez de
+    descartado, para o contexto nunca voltar vazio.
+    """
+    packed, used = [], 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if used + tokens <= max_tokens:
+            packed.append(doc)
+            used += tokens
+        elif not packed:
+            packed.append(doc.model_copy(update={'page_content': truncate_tokens(doc.page_content, max_tokens)}))
+            used = max_tokens
+    return packed
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import observe_stage
+
+# Tag aplicada ao LLM de reescrita da pergunta, para separá-lo do LLM de resposta
+CONTEXTUALIZE_TAG = 'contextualize'
+
+
+class PipelineTracer(BaseCallbackHandler):
+    """
+    Callback do LangChain que mede as etapas internas do chain como etapas do pipeline:
+    LLM de contextualização, recuperação, LLM de resposta e cada chamada de tool.
+    Sem estado por turno, então uma única instância serve todas as execuções.
+    """
+
+    def __init__(self):
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, stage, **labels):
+        with self._lock:
+            self._started[run_id] = (stage, labels, time.perf_counter())
+
+    def _end(self, run_id, status):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is not None:
+            stage, labels, started_at = started
+            observe_stage(stage, time.perf_counter() - started_at, status=status, **labels)
+
+    def _llm_stage(self, tags):
+        return 'contextualize_llm' if tags and CONTEXTUALIZE_TAG in tags else 'answer_llm'
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        self._start(run_id, self._llm_stage(tags))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        self._start(run_id, self._llm_stage(tags))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, 'ok')
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, 'error')
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, 'retrieval')
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, 'ok')
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, 'error')
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, 'tool', tool=(serialized or {}).get('name') or kwargs.get('name') or 'unknown')
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, 'ok')
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, 'error')
+
+
+pipeline_tracer = PipelineTracer()
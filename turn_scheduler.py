@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import defaultdict
+
+from config import TURN_MAX_CONCURRENCY, TURN_QUEUE_SLO_SECONDS, TURN_SHED_ENABLED
+from metrics import counter, gauge, observe_stage
+
+logger = logging.getLogger(__name__)
+
+TURNS = counter('turns_total', 'Turnos de conversa, por resultado (processed, merged, shed)')
+TURNS_ACTIVE = gauge('turns_active', 'Turnos gerando resposta agora')
+TURNS_WAITING = gauge('turns_waiting', 'Turnos aguardando vaga de geração')
+
+# Peso da duração mais recente na média móvel usada para estimar a espera
+EWMA_ALPHA = 0.2
+# Estimativa inicial da duração de um turno, antes de haver medições
+INITIAL_TURN_SECONDS = 10.0
+
+
+class TurnScheduler:
+    """
+    Coordena os turnos de geração:
+    - no máximo um turno por chat de cada vez; mensagens que chegam durante a geração
+      ficam pendentes e são juntadas no próximo turno do mesmo chat
+    - no máximo 'max_concurrency' turnos gerando ao mesmo tempo; os demais esperam em
+      fila de prioridade (menor valor primeiro; por padrão, ordem de chegada)
+    - se a espera estimada passar de 'slo_seconds', o turno é descartado e 'shed'
+      é chamado para avisar o usuário
+    """
+
+    def __init__(self, max_concurrency=TURN_MAX_CONCURRENCY, slo_seconds=TURN_QUEUE_SLO_SECONDS, shed_enabled=TURN_SHED_ENABLED):
+        self.max_concurrency = max_concurrency
+        self.slo_seconds = slo_seconds
+        self.shed_enabled = shed_enabled
+        self._active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._running = set()
+        self._pending = defaultdict(list)
+        self._pending_since = {}
+        self._turn_seconds = INITIAL_TURN_SECONDS
+
+    def estimated_wait(self):
+        """Espera estimada para um turno que entrasse na fila agora."""
+        if self._active < self.max_concurrency and not self._waiters:
+            return 0.0
+        return (len(self._waiters) + 1) / self.max_concurrency * self._turn_seconds
+
+    def _update_gauges(self):
+        TURNS_ACTIVE.set(self._active)
+        TURNS_WAITING.set(len(self._waiters))
+
+    async def _acquire(self, priority):
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            self._update_gauges()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        self._update_gauges()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # A vaga pode ter sido repassada no mesmo instante do cancelamento
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        # Repassa a vaga diretamente ao próximo da fila, sem liberar e disputar de novo
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_gauges()
+                return
+        self._active -= 1
+        self._update_gauges()
+
+    async def run(self, chat_id, messages, handler, shed=None, priority=None):
+        """
+        Executa handler(messages) para o chat respeitando as regras acima.
+        Se o chat já está em um turno, as mensagens são guardadas para o próximo e run retorna.
+        """
+        if chat_id in self._running:
+            self._pending[chat_id].extend(messages)
+            self._pending_since.setdefault(chat_id, time.time())
+            TURNS.inc(result='merged')
+            return
+
+        self._running.add(chat_id)
+        try:
+            priority = time.time() if priority is None else priority
+            while messages:
+                try:
+                    await self._run_turn(chat_id, messages, handler, shed, priority)
+                except Exception as e:
+                    logger.exception('[TURN] Erro no turno de %s: %s', chat_id, e)
+                messages = self._pending.pop(chat_id, [])
+                priority = self._pending_since.pop(chat_id, None) or time.time()
+        finally:
+            self._running.discard(chat_id)
+
+    async def _run_turn(self, chat_id, messages, handler, shed, priority):
+        wait = self.estimated_wait()
+        if self.shed_enabled and shed is not None and wait > self.slo_seconds:
+            TURNS.inc(result='shed')
+            logger.warning('[TURN] %s descartado: espera estimada de %.0fs', chat_id, wait)
+            await shed(messages)
+            return
+
+        enqueued_at = time.perf_counter()
+        await self._acquire(priority)
+        started_at = time.perf_counter()
+        observe_stage('turn_admission', started_at - enqueued_at)
+        try:
+            await handler(messages)
+            TURNS.inc(result='processed')
+        finally:
+            duration = time.perf_counter() - started_at
+            self._turn_seconds = EWMA_ALPHA * duration + (1 - EWMA_ALPHA) * self._turn_seconds
+            self._release()
+
+
+turn_scheduler = TurnScheduler()
@@ -1,43 +1,68 @@
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
 import os
-import shutil
-from config import VECTOR_STORE_PATH, RAG_FILES_DIR
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import time
+
+from config import (
+    VECTOR_STORE_PATH,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_CACHE_TTL,
+)
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
+from embedding_cache import CachedEmbeddings, SQLiteEmbeddingStore
+from tenants import DEFAULT_COLLECTION_NAME
+
+_embeddings = None
+
 
+def get_embeddings():
+    """Cliente de embeddings compartilhado pelo RAG, pelo agent e pela ingestão."""
+    global _embeddings
+    if _embeddings is None:
+        embeddings = OpenAIEmbeddings()
+        if EMBEDDING_CACHE_ENABLED:
+            store = SQLiteEmbeddingStore(
+                EMBEDDING_CACHE_PATH,
+                max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                ttl_seconds=EMBEDDING_CACHE_TTL,
+            )
+            embeddings = CachedEmbeddings(embeddings, store)
+        _embeddings = embeddings
+    return _embeddings
 
-def load_documents():
-    docs = []
-    processed_dir = os.path.join(RAG_FILES_DIR, 'processed')
-    os.makedirs(processed_dir, exist_ok=True)
-
-    files = [
-        os.path.join(RAG_FILES_DIR, f)
-        for f in os.listdir(RAG_FILES_DIR)
-        if f.endswith('.pdf') or f.endswith('.txt')
-    ]
-
-    for file in files:
-        loader = PyPDFLoader(file) if file.endswith('.pdf') else TextLoader(file)
-        docs.extend(loader.load())
-        dest_path = os.path.join(processed_dir, os.path.basename(file))
-        shutil.move(file, dest_path)
-
-    return docs
-    
-
-def get_vectorstore():
-    docs = load_documents()
-    if docs:
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=100)
-        splits = text_splitter.split_documents(docs)
-        return Chroma.from_documents(
-            documents=splits,
-            embedding=OpenAIEmbeddings(),
-            persist_directory=VECTOR_STORE_PATH,
-        )
+
+def open_vectorstore(collection_name=DEFAULT_COLLECTION_NAME):
+    """Abre a coleção da base vetorial persistida, sem ingerir documentos."""
     return Chroma(
-        embedding_function=OpenAIEmbeddings(),
+        collection_name=collection_name,
+        embedding_function=get_embeddings(),
         persist_directory=VECTOR_STORE_PATH,
-    )   
\ No newline at end of file
+    )
+
+
+def collection_name_of(vectorstore):
+    return vectorstore._collection.name
+
+
+def _index_version_path(collection_name=DEFAULT_COLLECTION_NAME):
+    filename = 'index_version' if collection_name == DEFAULT_COLLECTION_NAME else f'index_version.{collection_name}'
+    return os.path.join(VECTOR_STORE_PATH or '.', filename)
+
+
+def get_index_version(collection_name=DEFAULT_COLLECTION_NAME):
+    """Versão atual da coleção (muda a cada ingestão com alterações); usada para invalidar caches."""
+    try:
+        with open(_index_version_path(collection_name), 'r', encoding='utf-8') as f:
+            return f.read().strip() or '0'
+    except FileNotFoundError:
+        return '0'
+
+
+def bump_index_version(collection_name=DEFAULT_COLLECTION_NAME):
+    os.makedirs(VECTOR_STORE_PATH or '.', exist_ok=True)
+    path = _index_version_path(collection_name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, path)
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+import orjson
+
+from config import WEBHOOK_QUEUE_SIZE, WEBHOOK_BATCH_SIZE, WEBHOOK_COALESCE
+from dedup import deduplicator as default_deduplicator
+from metrics import counter, gauge, observe_stage
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_EVENTS = counter('webhook_events_total', 'Webhooks recebidos, por resultado')
+INGRESS_QUEUE_DEPTH = gauge('webhook_queue_depth', 'Mensagens aceitas aguardando entrada no buffer')
+
+# Único evento que gera resposta (filtrado no corpo bruto, antes de decodificar o JSON)
+MESSAGE_EVENTS = ('messages.upsert', 'MESSAGES_UPSERT')
+_MESSAGE_EVENT_BYTES = tuple(event.encode() for event in MESSAGE_EVENTS)
+
+
+@dataclass(slots=True, frozen=True)
+class IncomingMessage:
+    chat_id: str
+    text: str
+    message_id: str | None
+    instance: str | None
+    received_at: float
+
+
+def prefilter(body):
+    """
+    'ignored_event' se o corpo bruto não contém um evento de mensagem (ou None se precisa ser
+    decodificado). Só o tipo do evento é verificado nos bytes: fromMe e remoteJid também
+    aparecem em mensagens citadas e encaminhadas, então são lidos de data.key depois do parse.
+    """
+    if not any(event in body for event in _MESSAGE_EVENT_BYTES):
+        return 'ignored_event'
+    return None
+
+
+def parse_message(body, received_at=None):
+    """
+    Decodifica o payload da Evolution e extrai a mensagem de texto.
+    Devolve (None, mensagem) ou (motivo, None) quando o webhook deve ser ignorado.
+    """
+    data = orjson.loads(body)
+    if not isinstance(data, dict) or data.get('event') not in MESSAGE_EVENTS:
+        return 'ignored_event', None
+    data_obj = data.get('data') or {}
+    key = data_obj.get('key') or {}
+    if key.get('fromMe'):
+        return 'from_me', None
+    chat_id = key.get('remoteJid')
+    if not chat_id:
+        return 'invalid', None
+    if '@g.us' in chat_id:
+        return 'group', None
+
+    # Tentar extrair mensagem de diferentes locais
+    message = data_obj.get('message') or {}
+    text = (
+        message.get('conversation') or
+        (message.get('extendedTextMessage') or {}).get('text') or
+        (message.get('imageMessage') or {}).get('caption')
+    )
+    if not text:
+        return 'no_text', None
+    return None, IncomingMessage(
+        chat_id=chat_id,
+        text=text,
+        message_id=key.get('id'),
+        instance=data.get('instance'),
+        received_at=time.time() if received_at is None else received_at,
+    )
+
+
+def group_by_chat(messages):
+    """Agrupa as mensagens por instância e chat, preservando a ordem de chegada dentro de cada chat."""
+    by_chat = {}
+    for message in messages:
+        by_chat.setdefault((message.instance, message.chat_id), []).append(message)
+    return list(by_chat.values())
+
+
+def coalesce(group):
+    """Junta em uma só as mensagens de um chat que chegaram juntas na fila."""
+    if len(group) == 1:
+        return group[0]
+    return IncomingMessage(
+        chat_id=group[0].chat_id,
+        text='\n'.join(message.text for message in group),
+        message_id=group[-1].message_id,
+        instance=group[-1].instance,
+        received_at=group[0].received_at,
+    )
+
+
+class WebhookIngress:
+    """
+    Recebe os webhooks sem esperar o Redis: filtra eventos irrelevantes no corpo bruto,
+    decodifica com orjson e coloca a mensagem em uma fila em memória. Um worker em segundo
+    plano retira as mensagens em lotes e as entrega ao buffer: chats diferentes em paralelo,
+    mensagens do mesmo chat em ordem (ou agrupadas em uma só, com WEBHOOK_COALESCE).
+    Reentregas do mesmo id de mensagem são descartadas antes de chegar ao buffer.
+    """
+
+    def __init__(
+        self,
+        max_queue=WEBHOOK_QUEUE_SIZE,
+        batch_size=WEBHOOK_BATCH_SIZE,
+        coalesce_bursts=WEBHOOK_COALESCE,
+        deduplicator=default_deduplicator,
+    ):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.coalesce_bursts = coalesce_bursts
+        self.deduplicator = deduplicator
+        self._queue = None
+        self._task = None
+
+    def start(self, handle_message):
+        """Inicia o worker; handle_message(IncomingMessage) leva a mensagem ao buffer."""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._worker(handle_message))
+
+    async def stop(self, timeout=5):
+        """Tenta esvaziar a fila antes de encerrar o worker."""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning('[WEBHOOK] %d mensagens descartadas no encerramento', self._queue.qsize())
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def accept(self, body):
+        """
+        Processa o corpo bruto do webhook e devolve o resultado ('queued', 'ignored_event', ...).
+        Nunca espera I/O; 'queue_full' indica que a Evolution deve tentar de novo.
+        """
+        started_at = time.perf_counter()
+        reason = prefilter(body)
+        message = None
+        if reason is None:
+            try:
+                reason, message = parse_message(body)
+            except orjson.JSONDecodeError:
+                reason = 'invalid'
+        observe_stage('webhook_parse', time.perf_counter() - started_at)
+
+        if reason is None:
+            if self._queue is None:
+                reason = 'not_started'
+            elif self.deduplicator.seen_locally(message.instance, message.message_id):
+                reason = 'duplicate'
+            else:
+                try:
+                    self._queue.put_nowait(message)
+                    INGRESS_QUEUE_DEPTH.set(self._queue.qsize())
+                    reason = 'queued'
+                except asyncio.QueueFull:
+                    # A Evolution vai reenviar: a próxima entrega não pode ser tratada como duplicata
+                    self.deduplicator.forget(message.instance, message.message_id)
+                    reason = 'queue_full'
+        WEBHOOK_EVENTS.inc(result=reason)
+        return reason
+
+    def _take_batch(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _deliver(self, handle_message, group):
+        for message in [coalesce(group)] if self.coalesce_bursts else group:
+            try:
+                await handle_message(message)
+            except Exception as e:
+                logger.exception('[WEBHOOK] Erro ao entregar mensagem de %s: %s', message.chat_id, e)
+
+    async def _worker(self, handle_message):
+        while True:
+            batch = self._take_batch(await self._queue.get())
+            INGRESS_QUEUE_DEPTH.set(self._queue.qsize())
+            now = time.time()
+            for message in batch:
+                observe_stage('webhook_queue', now - message.received_at)
+            try:
+                fresh = await self.deduplicator.claim(batch)
+                await asyncio.gather(*(self._deliver(handle_message, group) for group in group_by_chat(fresh)))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+webhook_ingress = WebhookIngress()